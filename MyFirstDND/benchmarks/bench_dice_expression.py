@@ -0,0 +1,90 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 骰子表达式微基准
+对比旧版(每次调用都用正则解析)与编译缓存版的单次解析+掷骰耗时
+用法: python benchmarks/bench_dice_expression.py [--number N]
+"""
+
+import argparse
+import json
+import os
+import random
+import re
+import sys
+import timeit
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from rules.dice_expression import compile_expression
+from rules.dice_roller import DiceRoller
+
+def legacy_roll_dice(dice_notation: str) -> Dict:
+    """旧版roll_dice的解析+掷骰逻辑，作为对照组"""
+    pattern = r'^(\d*)d(\d+)([+-]\d+)?$'
+    match = re.match(pattern, dice_notation.lower())
+    if not match:
+        raise ValueError(f"无效的骰子表达式: {dice_notation}")
+    count = int(match.group(1)) if match.group(1) else 1
+    sides = int(match.group(2))
+    modifier = int(match.group(3)) if match.group(3) else 0
+    rolls = [random.randint(1, sides) for _ in range(count)]
+    return {
+        "notation": dice_notation,
+        "count": count,
+        "sides": sides,
+        "modifier": modifier,
+        "rolls": rolls,
+        "total": sum(rolls) + modifier
+    }
+
+def load_monster_notations() -> List[str]:
+    """从怪物图鉴中收集所有伤害表达式"""
+    with open(os.path.join(ROOT, "monsters/monster_manual.json"), 'r', encoding='utf-8') as f:
+        manual = json.load(f)
+    notations = []
+    for monster in manual.get("monsters", {}).values():
+        for action in monster.get("actions", {}).values():
+            if action.get("damage"):
+                notations.append(action["damage"])
+    return notations
+
+def run(number: int) -> Dict:
+    """执行基准测试，返回每次调用的纳秒耗时"""
+    notations = load_monster_notations()
+    roller = DiceRoller()
+    results = {}
+    
+    cases = {
+        "legacy_parse_and_roll": lambda: [legacy_roll_dice(n) for n in notations],
+        "compiled_parse_and_roll": lambda: [roller.roll_dice(n) for n in notations],
+        "legacy_parse_only": lambda: [re.match(r'^(\d*)d(\d+)([+-]\d+)?$', n.lower()) for n in notations],
+        "compiled_parse_only": lambda: [compile_expression(n) for n in notations],
+    }
+    for name, func in cases.items():
+        seconds = min(timeit.repeat(func, number=number, repeat=5))
+        results[name] = seconds / (number * len(notations)) * 1e9
+        # 避免历史记录无限增长影响后续测量
+        roller.roll_history.clear()
+    
+    results["speedup_parse_and_roll"] = results["legacy_parse_and_roll"] / results["compiled_parse_and_roll"]
+    results["notations"] = len(notations)
+    return results
+
+def main():
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="骰子表达式解析+掷骰微基准")
+    parser.add_argument("--number", type=int, default=20000, help="每轮重复次数")
+    args = parser.parse_args()
+    
+    results = run(args.number)
+    print(f"表达式数量: {results['notations']}")
+    for name in ("legacy_parse_only", "compiled_parse_only",
+                 "legacy_parse_and_roll", "compiled_parse_and_roll"):
+        print(f"{name:28s} {results[name]:8.1f} ns/次")
+    print(f"解析+掷骰加速比: {results['speedup_parse_and_roll']:.2f}x")
+
+if __name__ == "__main__":
+    main()
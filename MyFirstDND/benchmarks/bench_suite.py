@@ -0,0 +1,331 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 热点路径基准套件
+测量骰子、战斗记录器、战利品管理器、快速战斗和JSON编码的吞吐量与延迟，
+结果输出为JSON，并可与保存的基线对比，发现性能回退
+用法: python benchmarks/bench_suite.py [--sessions 0 200 1000] [--baseline benchmarks/baseline.json]
+"""
+
+import argparse
+import json
+import os
+import platform
+import random
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime
+from typing import Callable, Dict, List, Optional
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from benchmarks.synthetic_data import _synthetic_round, build_data_dir, synthetic_session
+from rules.dice_roller import DiceRoller
+from utils.ai_instruction_loader import AIInstructionLoader
+from utils.auto_combat_system import AutoCombatSystem
+from utils.combat_recorder import CombatRecorder
+from utils.data_store import data_store
+from utils.loot_manager import LootManager
+from utils.models import CombatRound
+from utils.serialization import orjson
+from utils.storage_backend import DOCUMENTS
+
+DEFAULT_BASELINE = os.path.join(ROOT, "benchmarks/baseline.json")
+# 平均延迟超过基线的该倍数时视为回退
+DEFAULT_THRESHOLD = 1.5
+
+def summarize(samples: List[float], ops_per_sample: int = 1) -> Dict:
+    """把逐次耗时(秒)汇总为吞吐量和延迟分位数(微秒)"""
+    ordered = sorted(samples)
+    count = len(ordered)
+    per_op = [s / ops_per_sample * 1e6 for s in ordered]
+    total = sum(samples)
+    return {
+        "samples": count,
+        "ops_per_sec": count * ops_per_sample / total if total else None,
+        "mean_us": sum(per_op) / count,
+        "p50_us": per_op[count // 2],
+        "p95_us": per_op[min(int(count * 0.95), count - 1)],
+        "max_us": per_op[-1]
+    }
+
+def measure(func: Callable, repeat: int, ops_per_sample: int = 1) -> Dict:
+    """重复调用func并逐次计时"""
+    timer = time.perf_counter
+    samples = []
+    for _ in range(repeat):
+        start = timer()
+        func()
+        samples.append(timer() - start)
+    return summarize(samples, ops_per_sample)
+
+def bench_dice(repeat: int) -> Dict:
+    """DiceRoller.roll_dice / roll_attack"""
+    roller = DiceRoller(seed=1)
+    batch = 1000
+    
+    def chunk(call):
+        def run():
+            for _ in range(batch):
+                call()
+        return run
+    
+    results = {
+        "dice.roll_dice[1d8+3]": measure(chunk(lambda: roller.roll_dice("1d8+3")), repeat, batch),
+        "dice.roll_dice[4d6kh3]": measure(chunk(lambda: roller.roll_dice("4d6kh3")), repeat, batch),
+        "dice.roll_attack[+5 vs 15, 1d8+3]": measure(chunk(lambda: roller.roll_attack(5, 15, "none", "1d8+3")),
+                                                     repeat, batch),
+    }
+    return results
+
+def bench_record_round(work_dir: str, sessions: int, rounds: int, rounds_per_session: int) -> Dict:
+    """CombatRecorder.record_combat_round，并记录耗时随已记录回合数的变化"""
+    data_path = build_data_dir(os.path.join(work_dir, f"record_{sessions}"), sessions, rounds_per_session)
+    recorder = CombatRecorder(data_path)
+    recorder.start_combat("combat_bench", [{"name": "哥布林"}])
+    
+    timer = time.perf_counter
+    samples = []
+    for i in range(rounds):
+        round_data = {"round": i + 1, "type": "player_action",
+                      "player_action": {"type": "attack", "hit": True, "damage": 5}}
+        start = timer()
+        recorder.record_combat_round(round_data)
+        samples.append(timer() - start)
+    
+    result = summarize(samples)
+    # 每10%的回合取一个点，观察单回合耗时是否随已记录回合数增长
+    step = max(rounds // 10, 1)
+    result["curve_us"] = [[i, samples[i] * 1e6] for i in range(0, rounds, step)]
+    result["first_us"] = samples[0] * 1e6
+    result["last_us"] = samples[-1] * 1e6
+    return result
+
+def bench_end_combat(work_dir: str, sessions: int, repeat: int, rounds_per_session: int) -> Dict:
+    """CombatRecorder.end_combat (每场战斗先记录10个回合，不计时)"""
+    data_path = build_data_dir(os.path.join(work_dir, f"end_{sessions}"), sessions, rounds_per_session)
+    recorder = CombatRecorder(data_path)
+    
+    timer = time.perf_counter
+    samples = []
+    for k in range(repeat):
+        recorder.start_combat(f"combat_bench_{k}", [{"name": "哥布林"}])
+        for i in range(10):
+            recorder.record_combat_round({"round": i + 1, "type": "player_action",
+                                          "player_action": {"type": "attack", "hit": False}})
+        start = timer()
+        recorder.end_combat({"victory": True, "player_damage_dealt": 10, "enemy_damage_dealt": 3})
+        samples.append(timer() - start)
+    result = summarize(samples)
+    # 每次结束战斗重写的四个文档的大小
+    result["bytes_written"] = sum(os.path.getsize(os.path.join(data_path, DOCUMENTS[name]))
+                                  for name in ("combat_history", "player_character", "balance_analysis",
+                                               "adventure_log"))
+    return result
+
+def bench_serialization(sessions: int, repeat: int, rounds_per_session: int) -> Dict:
+    """编码一份含sessions场战斗的历史文档：缩进、紧凑和orjson(已安装时)的耗时与字节数"""
+    rng = random.Random(0)
+    history = {"combat_sessions": [synthetic_session(rng, i, rounds_per_session) for i in range(sessions)]}
+    encoders = {
+        "json.indent2": lambda: json.dumps(history, ensure_ascii=False, indent=2).encode('utf-8'),
+        "json.compact": lambda: json.dumps(history, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+    }
+    if orjson is not None:
+        encoders["orjson"] = lambda: orjson.dumps(history, option=orjson.OPT_NON_STR_KEYS)
+    
+    results = {}
+    for mode, encode in encoders.items():
+        result = measure(encode, repeat)
+        result["bytes"] = len(encode())
+        results[f"serialize.{mode}[sessions={sessions}]"] = result
+    return results
+
+def bench_add_loot(work_dir: str, inventory_items: int, repeat: int) -> Dict:
+    """LootManager.add_loot"""
+    data_path = build_data_dir(os.path.join(work_dir, f"loot_{inventory_items}"),
+                               inventory_items=inventory_items)
+    manager = LootManager(data_path)
+    loot = [{"name": "治疗药水", "type": "consumable", "quantity": 1},
+            {"name": "金币", "type": "currency", "gold": 10}]
+    return measure(lambda: manager.add_loot(loot), repeat)
+
+def bench_loot_batch(work_dir: str, inventory_items: int, repeat: int) -> Dict:
+    """战斗后整理背包(添加5件战利品、装备1件、喝1瓶药水)，逐个调用与放在一个背包事务中"""
+    data_path = build_data_dir(os.path.join(work_dir, f"loot_batch_{inventory_items}"),
+                               inventory_items=inventory_items)
+    manager = LootManager(data_path)
+    loot = [{"name": "治疗药水", "type": "consumable", "quantity": 1},
+            {"name": "长剑", "type": "weapon"},
+            {"name": "匕首", "type": "weapon"},
+            {"name": "绳子", "type": "misc"},
+            {"name": "金币", "type": "currency", "gold": 10}]
+    
+    def run():
+        for item in loot:
+            manager.add_loot([item])
+        manager.equip_item("长剑", "weapon")
+        manager.use_consumable("治疗药水")
+    
+    def run_batched():
+        with manager.transaction():
+            run()
+    
+    return {
+        f"loot.post_combat[items={inventory_items}]": measure(run, repeat),
+        f"loot.post_combat_transaction[items={inventory_items}]": measure(run_batched, repeat)
+    }
+
+def bench_quick_combat(work_dir: str, sessions: int, repeat: int, rounds_per_session: int) -> Dict:
+    """AutoCombatSystem.quick_combat (两个哥布林，三次玩家行动)"""
+    data_path = build_data_dir(os.path.join(work_dir, f"quick_{sessions}"), sessions, rounds_per_session)
+    system = AutoCombatSystem(data_path, seed=1)
+    enemies = [{"name": "哥布林"}, {"name": "哥布林"}]
+    
+    def run():
+        actions = [{"type": "attack", "hit": True, "damage": 6},
+                   {"type": "attack", "hit": False},
+                   {"type": "attack", "hit": True, "damage": 4}]
+        system.quick_combat(enemies, actions)
+    
+    return measure(run, repeat)
+
+def bench_system_status(work_dir: str, sessions: int, repeat: int, rounds_per_session: int) -> Dict:
+    """AIInstructionLoader.get_system_status (检查五个数据文件)，并统计期间的解析次数"""
+    data_path = build_data_dir(os.path.join(work_dir, f"status_{sessions}"), sessions, rounds_per_session)
+    loader = AIInstructionLoader(data_path)
+    parses_before = data_store.stats()["parses"]
+    result = measure(loader.get_system_status, repeat * 10)
+    result["parses"] = data_store.stats()["parses"] - parses_before
+    return result
+
+def bench_round_models(repeat: int, count: int = 10000) -> Dict:
+    """count条回合以原始字典和CombatRound模型保存的内存占用，以及汇总敌人伤害的属性访问耗时"""
+    rng = random.Random(0)
+    lines = [json.dumps(_synthetic_round(rng, i // 2 + 1, i % 2 == 0)) for i in range(count)]
+    
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    dicts = [json.loads(line) for line in lines]
+    middle = tracemalloc.get_traced_memory()[0]
+    models = [CombatRound.from_dict(json.loads(line)) for line in lines]
+    after = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    
+    def sum_dicts():
+        return sum(r["enemy_action"].get("damage", 0) for r in dicts
+                   if r["type"] == "enemy_action" and r["enemy_action"].get("hit"))
+    
+    def sum_models():
+        return sum(r.action.damage for r in models if r.type == "enemy_action" and r.action.hit)
+    
+    dict_result = measure(sum_dicts, repeat * 10)
+    dict_result["bytes"] = middle - before
+    model_result = measure(sum_models, repeat * 10)
+    model_result["bytes"] = after - middle
+    return {
+        f"rounds.dict[rounds={count}]": dict_result,
+        f"rounds.model[rounds={count}]": model_result
+    }
+
+def run_suite(sessions: List[int], inventory: List[int], rounds: int, repeat: int,
+              rounds_per_session: int, work_dir: str) -> Dict:
+    """执行全部基准，返回结果字典"""
+    results = {}
+    results.update(bench_dice(repeat))
+    results.update(bench_round_models(repeat))
+    for size in sessions:
+        results[f"recorder.record_combat_round[sessions={size}]"] = bench_record_round(
+            work_dir, size, rounds, rounds_per_session)
+        results[f"recorder.end_combat[sessions={size}]"] = bench_end_combat(
+            work_dir, size, repeat, rounds_per_session)
+        results[f"auto.quick_combat[sessions={size}]"] = bench_quick_combat(
+            work_dir, size, repeat, rounds_per_session)
+        results[f"ai.get_system_status[sessions={size}]"] = bench_system_status(
+            work_dir, size, repeat, rounds_per_session)
+        results.update(bench_serialization(size, repeat, rounds_per_session))
+    for size in inventory:
+        results[f"loot.add_loot[items={size}]"] = bench_add_loot(work_dir, size, repeat * 3)
+        results.update(bench_loot_batch(work_dir, size, repeat))
+    return results
+
+def compare(results: Dict, baseline: Dict, threshold: float) -> List[Dict]:
+    """与基线逐项对比平均延迟，返回对比列表"""
+    rows = []
+    for name, current in results.items():
+        previous = baseline.get("results", {}).get(name)
+        if not previous:
+            continue
+        ratio = current["mean_us"] / previous["mean_us"] if previous["mean_us"] else None
+        rows.append({
+            "name": name,
+            "baseline_us": previous["mean_us"],
+            "current_us": current["mean_us"],
+            "ratio": ratio,
+            "regression": ratio is not None and ratio > threshold
+        })
+    return rows
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口，出现回退时返回1"""
+    parser = argparse.ArgumentParser(description="骰子/战斗记录/战利品热点路径基准套件")
+    parser.add_argument("--sessions", nargs="+", type=int, default=[0, 25, 100],
+                        help="合成数据目录中历史战斗的数量，每个取值单独测一轮")
+    parser.add_argument("--rounds-per-session", type=int, default=20, help="每场历史战斗的回合记录数")
+    parser.add_argument("--inventory", nargs="+", type=int, default=[0, 500], help="背包中额外物品的数量")
+    parser.add_argument("--rounds", type=int, default=50, help="单场战斗连续记录的回合数")
+    parser.add_argument("--repeat", type=int, default=5, help="每项重复次数(骰子每次重复包含1000次调用)")
+    parser.add_argument("--output", help="把结果写入JSON文件")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="对比的基线文件")
+    parser.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="判定回退的延迟倍数")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为新的基线")
+    args = parser.parse_args(argv)
+    
+    with tempfile.TemporaryDirectory(prefix="dnd_bench_") as work_dir:
+        results = run_suite(args.sessions, args.inventory, args.rounds, args.repeat,
+                            args.rounds_per_session, work_dir)
+    
+    report = {
+        "meta": {
+            "timestamp": datetime.now().isoformat(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "config": {k: v for k, v in vars(args).items() if k not in ("output", "baseline", "save_baseline")}
+        },
+        "results": results
+    }
+    
+    for name, result in results.items():
+        size = result.get("bytes", result.get("bytes_written"))
+        extra = f"  {size:10d} B" if size is not None else ""
+        print(f"{name:48s} {result['mean_us']:12.1f} us  p95 {result['p95_us']:12.1f} us{extra}")
+    
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+    
+    if args.save_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+        print(f"已保存基线: {args.baseline}")
+        return 0
+    
+    if not os.path.exists(args.baseline):
+        return 0
+    with open(args.baseline, 'r', encoding='utf-8') as f:
+        baseline = json.load(f)
+    rows = compare(results, baseline, args.threshold)
+    regressions = [row for row in rows if row["regression"]]
+    print()
+    print("与基线对比:")
+    for row in rows:
+        flag = "  <-- 回退" if row["regression"] else ""
+        print(f"{row['name']:48s} {row['baseline_us']:12.1f} -> {row['current_us']:12.1f} us "
+              f"({row['ratio']:.2f}x){flag}")
+    return 1 if regressions else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 基准测试用的合成数据目录
+复制仓库自带的数据文件，再按指定规模填充历史战斗和背包物品
+"""
+
+import json
+import os
+import random
+import shutil
+from datetime import datetime, timedelta
+from typing import Dict, List
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# 需要复制的数据目录
+DATA_DIRS = ("characters", "combat", "adventures", "items", "monsters", "config")
+
+ENEMY_NAMES = ("哥布林", "兽人", "狼", "强盗")
+
+def _synthetic_round(rng: random.Random, round_number: int, player_turn: bool) -> Dict:
+    """生成一条与AutoCombatSystem记录格式一致的回合数据"""
+    hit = rng.random() < 0.6
+    damage = rng.randint(1, 11) if hit else 0
+    natural = rng.randint(1, 20)
+    if player_turn:
+        return {
+            "round": round_number,
+            "type": "player_action",
+            "player_action": {"round": round_number, "type": "attack", "target": rng.choice(ENEMY_NAMES),
+                              "hit": hit, "damage": damage},
+            "timestamp": datetime(2024, 1, 1).isoformat()
+        }
+    return {
+        "round": round_number,
+        "type": "enemy_action",
+        "enemy_name": rng.choice(ENEMY_NAMES),
+        "enemy_action": {
+            "round": round_number,
+            "type": "attack",
+            "target": "player",
+            "attack_roll": {"type": "d20", "advantage": "无", "rolls": [natural], "total": natural,
+                            "is_critical": natural == 20, "is_critical_failure": natural == 1},
+            "damage": damage,
+            "hit": hit
+        },
+        "timestamp": datetime(2024, 1, 1).isoformat()
+    }
+
+def synthetic_session(rng: random.Random, index: int, rounds: int) -> Dict:
+    """生成一场已结束的合成战斗"""
+    start = datetime(2024, 1, 1) + timedelta(hours=index)
+    round_list = [_synthetic_round(rng, i // 2 + 1, i % 2 == 0) for i in range(rounds)]
+    dealt = sum(r["player_action"]["damage"] for r in round_list if r["type"] == "player_action")
+    taken = sum(r["enemy_action"]["damage"] for r in round_list if r["type"] == "enemy_action")
+    return {
+        "combat_id": f"combat_synthetic_{index:06d}",
+        "start_time": start.isoformat(),
+        "rng_seed": {"entropy": str(index), "spawn_key": [0]},
+        "rounds": round_list,
+        "enemies": [{"name": rng.choice(ENEMY_NAMES)} for _ in range(rng.randint(1, 4))],
+        "loot_gained": [],
+        "victory": rng.random() < 0.7,
+        "total_actions": rounds,
+        "player_damage_dealt": dealt,
+        "enemy_damage_dealt": taken,
+        "enemies_defeated": [],
+        "summary": "合成战斗",
+        "end_time": (start + timedelta(minutes=10)).isoformat()
+    }
+
+def synthetic_items(count: int) -> List[Dict]:
+    """生成背包中的合成物品"""
+    return [{"name": f"合成物品{i}", "type": "misc", "quantity": 1, "value": i % 50} for i in range(count)]
+
+def build_data_dir(path: str, sessions: int = 0, rounds_per_session: int = 20,
+                   inventory_items: int = 0, seed: int = 0) -> str:
+    """在path下创建合成数据目录，返回该目录
+
+    sessions: combat_history.json 中已结束的历史战斗数量
+    rounds_per_session: 每场历史战斗的回合记录数
+    inventory_items: 角色背包中额外填充的物品数量
+    """
+    if os.path.exists(path):
+        shutil.rmtree(path)
+    os.makedirs(path)
+    for name in DATA_DIRS:
+        source = os.path.join(ROOT, name)
+        if os.path.isdir(source):
+            shutil.copytree(source, os.path.join(path, name))
+    
+    rng = random.Random(seed)
+    history_file = os.path.join(path, "combat/combat_history.json")
+    with open(history_file, 'r', encoding='utf-8') as f:
+        history = json.load(f)
+    history.pop("current_combat", None)
+    history["combat_sessions"] = [synthetic_session(rng, i, rounds_per_session) for i in range(sessions)]
+    history["recent_combats"] = list(history["combat_sessions"])
+    with open(history_file, 'w', encoding='utf-8') as f:
+        json.dump(history, f, ensure_ascii=False, indent=2)
+    
+    if inventory_items:
+        player_file = os.path.join(path, "characters/player_character.json")
+        with open(player_file, 'r', encoding='utf-8') as f:
+            player = json.load(f)
+        player["equipment"].setdefault("items", []).extend(synthetic_items(inventory_items))
+        with open(player_file, 'w', encoding='utf-8') as f:
+            json.dump(player, f, ensure_ascii=False, indent=2)
+    
+    return path
@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 骰子表达式编译器
+把骰子表达式编译成可复用的求值器，相同表达式只解析一次
+支持: 多项求和(2d6+1d4+3)、保留/丢弃(4d6kh3, 2d20kl1, 4d6dl1)、
+      重骰(2d6r1, 1d20ro<2)、爆骰(1d6!, 1d10!>9)、百分骰(d%)
+"""
+
+import random
+import re
+from array import array
+from functools import lru_cache
+from typing import Dict, FrozenSet, List, Optional, Sequence, Tuple
+
+# 单颗骰子最多连续爆骰次数，防止无限爆骰
+MAX_EXPLOSIONS = 20
+# 单个骰子项允许的最大骰子数和面数，超出时拒绝解析(表达式可能来自命令行等外部输入)
+MAX_DICE = 1000
+MAX_SIDES = 10000
+# 已编译表达式缓存的容量
+CACHE_SIZE = 1024
+
+_TERM_PATTERN = re.compile(
+    r'([+-])?(?:(\d*)d(\d+|%)((?:(?:kh|kl|dh|dl|k|ro|r)[<>=]?\d+|![<>=]?\d*)*)|(\d+))'
+)
+_MODIFIER_PATTERN = re.compile(r'(kh|kl|dh|dl|k|ro|r|!)([<>=]?)(\d*)')
+
+def _face_set(sides: int, comparison: str, value: int) -> FrozenSet[int]:
+    """把比较条件(=N, <N, >N)转换为满足条件的骰面集合"""
+    if comparison == "<":
+        return frozenset(range(1, min(value, sides) + 1))
+    if comparison == ">":
+        return frozenset(range(max(value, 1), sides + 1))
+    return frozenset([value]) if 1 <= value <= sides else frozenset()
+
+class DiceTerm:
+    """单个骰子项，例如 4d6kh3、1d6!、2d6r1"""
+    
+    __slots__ = ("count", "sides", "sign", "keep", "keep_highest",
+                 "reroll", "reroll_once", "explode", "faces", "is_simple")
+    
+    def __init__(self, count: int, sides: int, sign: int = 1, keep: Optional[int] = None,
+                 keep_highest: bool = True, reroll: FrozenSet[int] = frozenset(),
+                 reroll_once: bool = False, explode: FrozenSet[int] = frozenset()):
+        """初始化骰子项"""
+        self.count = count
+        self.sides = sides
+        self.sign = sign
+        self.keep = keep
+        self.keep_highest = keep_highest
+        self.reroll = reroll
+        self.reroll_once = reroll_once
+        self.explode = explode
+        # range对象不随面数占用内存，random.choices按下标取值，结果与元组相同
+        self.faces = range(1, sides + 1)
+        self.is_simple = keep is None and not reroll and not explode
+    
+    def _roll_die(self, rng) -> int:
+        """掷一颗骰子，处理重骰和爆骰"""
+        sides = self.sides
+        value = int(rng.random() * sides) + 1
+        
+        if self.reroll:
+            if self.reroll_once:
+                if value in self.reroll:
+                    value = int(rng.random() * sides) + 1
+            else:
+                while value in self.reroll:
+                    value = int(rng.random() * sides) + 1
+        
+        if self.explode:
+            face = value
+            explosions = 0
+            while face in self.explode and explosions < MAX_EXPLOSIONS:
+                face = int(rng.random() * sides) + 1
+                value += face
+                explosions += 1
+        
+        return value
+    
+    def roll(self, rng=random) -> Tuple[int, List[int], List[int]]:
+        """掷这一项，返回(带符号小计, 全部骰子, 计入小计的骰子)"""
+        if self.is_simple:
+            sides = self.sides
+            rand = rng.random
+            rolls = [int(rand() * sides) + 1 for _ in range(self.count)]
+            return self.sign * sum(rolls), rolls, rolls
+        
+        rolls = [self._roll_die(rng) for _ in range(self.count)]
+        kept = rolls
+        if self.keep is not None:
+            kept = sorted(rolls, reverse=self.keep_highest)[:self.keep]
+        return self.sign * sum(kept), rolls, kept
+    
+    def roll_many(self, n: int, rng=random) -> Tuple[Sequence[int], array]:
+        """重复掷这一项n次，返回(每次的带符号小计, 全部骰面)"""
+        if self.is_simple:
+            count = self.count
+            rolls = array('i', rng.choices(self.faces, k=count * n))
+            if count == 1:
+                subtotals = rolls
+            else:
+                subtotals = list(map(sum, zip(*[iter(rolls)] * count)))
+            if self.sign < 0:
+                subtotals = [-s for s in subtotals]
+            return subtotals, rolls
+        
+        subtotals = []
+        rolls = array('i')
+        for _ in range(n):
+            subtotal, term_rolls, _kept = self.roll(rng)
+            subtotals.append(subtotal)
+            rolls.extend(term_rolls)
+        return subtotals, rolls
+    
+    def to_notation(self) -> str:
+        """还原为规范化的表达式文本"""
+        text = f"{self.count}d{self.sides}"
+        if self.reroll:
+            text += ("ro" if self.reroll_once else "r") + _faces_to_notation(self.reroll, self.sides)
+        if self.explode:
+            text += "!" + ("" if self.explode == {self.sides} else _faces_to_notation(self.explode, self.sides))
+        if self.keep is not None:
+            text += ("kh" if self.keep_highest else "kl") + str(self.keep)
+        return text
+
+def _faces_to_notation(faces: FrozenSet[int], sides: int) -> str:
+    """把骰面集合还原为比较条件文本"""
+    low, high = min(faces), max(faces)
+    if len(faces) == 1:
+        return str(low)
+    if low == 1:
+        return f"<{high}"
+    return f">{low}"
+
+class DiceExpression:
+    """编译后的骰子表达式，可以反复求值"""
+    
+    __slots__ = ("notation", "terms", "modifier", "count", "sides", "is_simple")
+    
+    def __init__(self, notation: str, terms: Tuple[DiceTerm, ...], modifier: int):
+        """初始化表达式"""
+        self.notation = notation
+        self.terms = terms
+        self.modifier = modifier
+        self.count = sum(t.count for t in terms)
+        self.sides = terms[0].sides if terms else 0
+        # 单项且无特殊规则时，与旧版NdM±K的结果格式完全一致
+        self.is_simple = len(terms) == 1 and terms[0].is_simple and terms[0].sign > 0
+    
+    def roll(self, rng=random) -> Tuple[int, List[int]]:
+        """求值一次，返回(总计, 全部骰子)"""
+        if self.is_simple:
+            subtotal, rolls, _kept = self.terms[0].roll(rng)
+            return subtotal + self.modifier, rolls
+        
+        total = self.modifier
+        all_rolls = []
+        for term in self.terms:
+            subtotal, rolls, _kept = term.roll(rng)
+            total += subtotal
+            all_rolls.extend(rolls)
+        return total, all_rolls
+    
+    def roll_detail(self, rng=random) -> Dict:
+        """求值一次，并返回每一项的明细"""
+        total = self.modifier
+        all_rolls = []
+        details = []
+        for term in self.terms:
+            subtotal, rolls, kept = term.roll(rng)
+            total += subtotal
+            all_rolls.extend(rolls)
+            details.append({
+                "notation": term.to_notation(),
+                "rolls": rolls,
+                "kept": kept,
+                "subtotal": subtotal
+            })
+        return {"total": total, "rolls": all_rolls, "terms": details}
+    
+    def roll_many(self, n: int, rng=random) -> Tuple[array, List[array]]:
+        """重复求值n次，返回(每次的总计, 每个骰子项的全部骰面)"""
+        totals = None
+        term_rolls = []
+        for term in self.terms:
+            subtotals, rolls = term.roll_many(n, rng)
+            totals = subtotals if totals is None else list(map(int.__add__, totals, subtotals))
+            term_rolls.append(rolls)
+        
+        modifier = self.modifier
+        if totals is None:
+            totals = [modifier] * n
+        elif modifier:
+            totals = [t + modifier for t in totals]
+        return array('i', totals), term_rolls
+    
+    def __repr__(self) -> str:
+        return f"DiceExpression({self.notation!r})"
+
+def _parse(notation: str) -> DiceExpression:
+    """解析骰子表达式文本"""
+    text = notation.lower().replace(" ", "")
+    if not text:
+        raise ValueError(f"无效的骰子表达式: {notation}")
+    
+    terms = []
+    modifier = 0
+    pos = 0
+    while pos < len(text):
+        match = _TERM_PATTERN.match(text, pos)
+        if not match or match.end() == pos or (pos > 0 and not match.group(1)):
+            raise ValueError(f"无效的骰子表达式: {notation}")
+        pos = match.end()
+        sign = -1 if match.group(1) == "-" else 1
+        
+        if match.group(5) is not None:
+            # 常数修正值
+            modifier += sign * int(match.group(5))
+            continue
+        
+        count = int(match.group(2)) if match.group(2) else 1
+        sides = 100 if match.group(3) == "%" else int(match.group(3))
+        if count < 1 or sides < 1:
+            raise ValueError(f"无效的骰子表达式: {notation}")
+        if count > MAX_DICE or sides > MAX_SIDES:
+            raise ValueError(f"骰子数量或面数过大(最多{MAX_DICE}颗、{MAX_SIDES}面): {notation}")
+        
+        options = {}
+        for name, comparison, value in _MODIFIER_PATTERN.findall(match.group(4) or ""):
+            if name in ("kh", "k", "kl"):
+                options["keep"] = int(value)
+                options["keep_highest"] = name != "kl"
+            elif name in ("dh", "dl"):
+                # 丢弃最高/最低N颗等价于保留另一端的 count-N 颗
+                options["keep"] = max(count - int(value), 0)
+                options["keep_highest"] = name == "dl"
+            elif name in ("r", "ro"):
+                options["reroll"] = _face_set(sides, comparison, int(value))
+                options["reroll_once"] = name == "ro"
+            else:
+                threshold = int(value) if value else sides
+                options["explode"] = _face_set(sides, comparison or "=", threshold)
+        
+        term = DiceTerm(count, sides, sign, **options)
+        if len(term.reroll) >= sides and not term.reroll_once:
+            raise ValueError(f"重骰条件覆盖了所有骰面: {notation}")
+        if len(term.explode) >= sides:
+            raise ValueError(f"爆骰条件覆盖了所有骰面: {notation}")
+        terms.append(term)
+    
+    return DiceExpression(notation, tuple(terms), modifier)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def compile_expression(notation: str) -> DiceExpression:
+    """编译骰子表达式，结果按原始文本缓存在有界LRU缓存中"""
+    return _parse(notation)
+
+def cache_info():
+    """获取编译缓存的命中统计"""
+    return compile_expression.cache_info()
@@ -0,0 +1,306 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 骰子概率引擎
+通过卷积精确计算骰子表达式的概率分布，以及攻击的命中、重击和期望伤害
+所有分布都用整数权重和公共分母表示，不做任何抽样
+"""
+
+from functools import lru_cache
+from math import factorial, gcd
+from typing import Dict, List, Tuple
+
+from rules.dice_expression import MAX_EXPLOSIONS, DiceExpression, DiceTerm, compile_expression
+
+# 已计算结果缓存的容量
+CACHE_SIZE = 4096
+# 精确计算允许的估算工作量(约为卷积中的乘法次数，上限时耗时约1秒)；
+# 表达式解析器允许的骰子(如1000d10000)掷骰很快，但精确分布的卷积代价与取值范围的平方成正比
+MAX_PMF_WORK = 30000000
+# 保留最高/最低的动态规划每单位估算工作量比卷积慢的倍数
+KEEP_WORK_FACTOR = 5
+
+def _lcm(a: int, b: int) -> int:
+    """最小公倍数(兼容Python 3.7)"""
+    return a // gcd(a, b) * b
+
+def _comb(n: int, k: int) -> int:
+    """组合数(兼容Python 3.7)"""
+    return factorial(n) // (factorial(k) * factorial(n - k))
+
+class DicePMF:
+    """离散概率分布: P(offset + i) = weights[i] / denominator"""
+    
+    __slots__ = ("offset", "weights", "denominator")
+    
+    def __init__(self, offset: int, weights: List[int], denominator: int):
+        """初始化分布，并去掉两端的零权重"""
+        start = 0
+        while start < len(weights) - 1 and weights[start] == 0:
+            start += 1
+        end = len(weights)
+        while end > start + 1 and weights[end - 1] == 0:
+            end -= 1
+        self.offset = offset + start
+        self.weights = weights[start:end]
+        self.denominator = denominator
+    
+    @classmethod
+    def constant(cls, value: int) -> "DicePMF":
+        """确定值的分布"""
+        return cls(value, [1], 1)
+    
+    @classmethod
+    def from_pairs(cls, pairs: Dict[int, int], denominator: int) -> "DicePMF":
+        """由{取值: 权重}构造分布"""
+        low, high = min(pairs), max(pairs)
+        weights = [0] * (high - low + 1)
+        for value, weight in pairs.items():
+            weights[value - low] += weight
+        return cls(low, weights, denominator)
+    
+    @property
+    def min_value(self) -> int:
+        """最小可能取值"""
+        return self.offset
+    
+    @property
+    def max_value(self) -> int:
+        """最大可能取值"""
+        return self.offset + len(self.weights) - 1
+    
+    def items(self) -> List[Tuple[int, int]]:
+        """所有(取值, 权重)对，忽略零权重"""
+        return [(self.offset + i, w) for i, w in enumerate(self.weights) if w]
+    
+    def probability(self, value: int) -> float:
+        """取值恰好为value的概率"""
+        index = value - self.offset
+        if 0 <= index < len(self.weights):
+            return self.weights[index] / self.denominator
+        return 0.0
+    
+    def probability_at_least(self, value: int) -> float:
+        """取值不小于value的概率"""
+        index = max(value - self.offset, 0)
+        return sum(self.weights[index:]) / self.denominator
+    
+    def mean(self) -> float:
+        """期望值"""
+        total = sum((self.offset + i) * w for i, w in enumerate(self.weights))
+        return total / self.denominator
+    
+    def variance(self) -> float:
+        """方差"""
+        mean = self.mean()
+        total = sum(((self.offset + i) - mean) ** 2 * w for i, w in enumerate(self.weights))
+        return total / self.denominator
+    
+    def to_dict(self) -> Dict[int, float]:
+        """转换为{取值: 概率}"""
+        return {value: weight / self.denominator for value, weight in self.items()}
+    
+    def shift(self, amount: int) -> "DicePMF":
+        """所有取值加上常数"""
+        return DicePMF(self.offset + amount, self.weights, self.denominator)
+    
+    def negate(self) -> "DicePMF":
+        """取相反数"""
+        return DicePMF(-self.max_value, self.weights[::-1], self.denominator)
+    
+    def scale(self, factor: int) -> "DicePMF":
+        """所有取值乘以正整数(用于重击伤害翻倍)"""
+        weights = [0] * ((len(self.weights) - 1) * factor + 1)
+        for i, w in enumerate(self.weights):
+            weights[i * factor] = w
+        return DicePMF(self.offset * factor, weights, self.denominator)
+    
+    def convolve(self, other: "DicePMF") -> "DicePMF":
+        """两个独立随机变量之和的分布"""
+        weights = [0] * (len(self.weights) + len(other.weights) - 1)
+        for i, a in enumerate(self.weights):
+            if a:
+                for j, b in enumerate(other.weights):
+                    weights[i + j] += a * b
+        return DicePMF(self.offset + other.offset, weights, self.denominator * other.denominator)
+    
+    def __add__(self, other: "DicePMF") -> "DicePMF":
+        return self.convolve(other)
+    
+    def __repr__(self) -> str:
+        return f"DicePMF({self.min_value}..{self.max_value}, mean={self.mean():.3f})"
+
+def mixture(components: List[Tuple[int, DicePMF]]) -> DicePMF:
+    """按整数权重混合多个分布"""
+    common = 1
+    for _, pmf in components:
+        common = _lcm(common, pmf.denominator)
+    total_weight = sum(weight for weight, _ in components)
+    pairs = {}
+    for weight, pmf in components:
+        factor = weight * (common // pmf.denominator)
+        for value, w in pmf.items():
+            pairs[value] = pairs.get(value, 0) + w * factor
+    return DicePMF.from_pairs(pairs, total_weight * common)
+
+def _die_pmf(term: DiceTerm) -> DicePMF:
+    """单颗骰子(含重骰和爆骰规则)的分布，与DiceTerm._roll_die的行为一致"""
+    sides = term.sides
+    faces = range(1, sides + 1)
+    
+    if term.reroll and term.reroll_once:
+        # 第一次落在重骰面上时重骰一次，第二次结果直接采用
+        rerolled = len(term.reroll)
+        first = {f: (0 if f in term.reroll else sides) + rerolled for f in faces}
+        first_denominator = sides * sides
+    elif term.reroll:
+        first = {f: 1 for f in faces if f not in term.reroll}
+        first_denominator = len(first)
+    else:
+        first = {f: 1 for f in faces}
+        first_denominator = sides
+    
+    if not term.explode:
+        return DicePMF.from_pairs(first, first_denominator)
+    
+    # 爆骰后续的掷骰不再重骰，从最后一次允许的爆骰往前递推
+    chain = DicePMF.from_pairs({f: 1 for f in faces}, sides)
+    for _ in range(MAX_EXPLOSIONS - 1):
+        chain = mixture([(1, chain.shift(f) if f in term.explode else DicePMF.constant(f)) for f in faces])
+    return mixture([
+        (weight, chain.shift(f) if f in term.explode else DicePMF.constant(f))
+        for f, weight in first.items()
+    ])
+
+def _keep_pmf(die: DicePMF, count: int, keep: int, highest: bool) -> DicePMF:
+    """count颗同分布骰子中保留最高(或最低)keep颗之和的分布
+
+    按取值从高到低(或从低到高)依次决定有几颗骰子落在该值上，
+    前keep个名额依次被填满，状态为(已分配骰子数, 保留部分之和)
+    """
+    keep = min(keep, count)
+    values = sorted(die.items(), reverse=highest)
+    states = {(0, 0): 1}
+    for value, weight in values:
+        next_states = {}
+        for (assigned, kept_sum), ways in states.items():
+            remaining = count - assigned
+            slots = max(keep - assigned, 0)
+            for c in range(remaining + 1):
+                key = (assigned + c, kept_sum + min(c, slots) * value)
+                next_states[key] = next_states.get(key, 0) + ways * _comb(remaining, c) * weight ** c
+        states = next_states
+    
+    pairs = {kept_sum: ways for (assigned, kept_sum), ways in states.items() if assigned == count}
+    return DicePMF.from_pairs(pairs, die.denominator ** count)
+
+def _term_pmf(term: DiceTerm) -> DicePMF:
+    """单个骰子项的分布"""
+    die = _die_pmf(term)
+    if term.keep is not None and term.keep < term.count:
+        pmf = _keep_pmf(die, term.count, term.keep, term.keep_highest)
+    else:
+        # 二分累加，减少卷积次数
+        pmf = DicePMF.constant(0)
+        power = die
+        count = term.count
+        while count:
+            if count & 1:
+                pmf = pmf + power
+            count >>= 1
+            if count:
+                power = power + power
+    return pmf.negate() if term.sign < 0 else pmf
+
+def _estimated_work(expression: DiceExpression) -> int:
+    """估算精确计算表达式分布的工作量(按各骰子项取值范围估算，不做实际计算)"""
+    work = 0
+    total_support = 0
+    for term in expression.terms:
+        die_support = term.sides * (MAX_EXPLOSIONS if term.explode else 1)
+        if term.explode:
+            work += term.sides * die_support
+        if term.keep is not None and term.keep < term.count:
+            support = term.keep * die_support
+            work += KEEP_WORK_FACTOR * die_support * term.count * term.count * support
+        else:
+            support = term.count * die_support
+        total_support += support
+    # 各项自身的二分累加和项之间的卷积，都不超过总取值范围的平方
+    return work + total_support * total_support
+
+@lru_cache(maxsize=CACHE_SIZE)
+def expression_pmf(dice_notation: str) -> DicePMF:
+    """骰子表达式的精确概率分布，估算工作量超过MAX_PMF_WORK时抛出ValueError"""
+    expression = compile_expression(dice_notation)
+    if _estimated_work(expression) > MAX_PMF_WORK:
+        raise ValueError(f"骰子表达式过大，无法精确计算概率分布: {dice_notation}")
+    pmf = DicePMF.constant(expression.modifier)
+    for term in expression.terms:
+        pmf = pmf + _term_pmf(term)
+    return pmf
+
+def d20_pmf(advantage: str = "none") -> DicePMF:
+    """d20保留结果的分布，支持优势/劣势"""
+    if advantage == "advantage":
+        return DicePMF(1, [2 * v - 1 for v in range(1, 21)], 400)
+    if advantage == "disadvantage":
+        return DicePMF(1, [41 - 2 * v for v in range(1, 21)], 400)
+    return DicePMF(1, [1] * 20, 20)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def _attack_weights(attack_bonus: int, target_ac: int, advantage: str) -> Tuple[int, int, int]:
+    """攻击检定结果的整数权重: (普通命中, 重击, 分母)"""
+    d20 = d20_pmf(advantage)
+    hit = crit = 0
+    for face, weight in d20.items():
+        if face == 20:
+            crit += weight
+        elif face != 1 and face + attack_bonus >= target_ac:
+            hit += weight
+    return hit, crit, d20.denominator
+
+def attack_odds(attack_bonus: int, target_ac: int, advantage: str = "none") -> Dict:
+    """攻击检定的精确命中概率，规则与DiceRoller.roll_attack一致
+
+    天然20必定命中且为重击，天然1必定失手，其余按 d20+加值 >= AC 判定
+    """
+    normal, crit, denominator = _attack_weights(attack_bonus, target_ac, advantage)
+    return {
+        "hit_chance": (normal + crit) / denominator,
+        "critical_chance": crit / denominator,
+        "normal_hit_chance": normal / denominator,
+        "miss_chance": 1 - (normal + crit) / denominator,
+        "critical_failure_chance": d20_pmf(advantage).probability(1)
+    }
+
+@lru_cache(maxsize=CACHE_SIZE)
+def attack_damage_pmf(attack_bonus: int, target_ac: int, weapon_damage: str,
+                      advantage: str = "none") -> DicePMF:
+    """单次攻击造成伤害的分布(未命中为0，重击时伤害总值翻倍)"""
+    normal, crit, denominator = _attack_weights(attack_bonus, target_ac, advantage)
+    damage = expression_pmf(weapon_damage)
+    components = [(denominator - normal - crit, DicePMF.constant(0))]
+    if normal:
+        components.append((normal, damage))
+    if crit:
+        components.append((crit, damage.scale(2)))
+    return mixture(components)
+
+@lru_cache(maxsize=CACHE_SIZE)
+def expected_attack(attack_bonus: int, target_ac: int, weapon_damage: str,
+                    advantage: str = "none") -> Dict:
+    """单次攻击的命中率、重击率和期望伤害"""
+    odds = attack_odds(attack_bonus, target_ac, advantage)
+    damage_mean = expression_pmf(weapon_damage).mean()
+    expected_damage = odds["normal_hit_chance"] * damage_mean + odds["critical_chance"] * 2 * damage_mean
+    return {
+        "attack_bonus": attack_bonus,
+        "target_ac": target_ac,
+        "advantage": advantage,
+        "weapon_damage": weapon_damage,
+        "hit_chance": odds["hit_chance"],
+        "critical_chance": odds["critical_chance"],
+        "average_damage_on_hit": damage_mean,
+        "expected_damage": expected_damage
+    }
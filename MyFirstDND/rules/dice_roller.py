@@ -5,46 +5,95 @@ DND跑团库 - 骰子系统
 提供各种骰子功能和随机数生成
 """
 
+import argparse
 import random
-import re
-from typing import Dict
+import sys
+import threading
+import weakref
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, TextIO, Tuple, Union
 import json
+from rules.dice_expression import compile_expression
+from rules.rng_streams import SeedSequence, as_seed_sequence
+from rules.roll_history import (DEFAULT_CAPACITY, FLAG_CRITICAL, FLAG_CRITICAL_FAILURE, FLAG_HIT,
+                                FLAG_SUCCESS, TYPE_ABILITY_CHECK, TYPE_ATTACK, TYPE_D20, TYPE_DICE,
+                                RollCounters, RollHistory)
+
+# 批量掷d20时复用的骰面元组，元组索引比range更快
+_D20_FACES = tuple(range(1, 21))
+
+# 优势/劣势批量掷骰时，把两颗d20编码为0-399的一个索引，一次抽样后查表还原
+_D20_PAIRS = tuple(range(400))
+_PAIR_FIRST = tuple(i // 20 + 1 for i in _D20_PAIRS)
+_PAIR_SECOND = tuple(i % 20 + 1 for i in _D20_PAIRS)
+_PAIR_MAX = tuple(map(max, _PAIR_FIRST, _PAIR_SECOND))
+_PAIR_MIN = tuple(map(min, _PAIR_FIRST, _PAIR_SECOND))
 
 class DiceRoller:
     """骰子系统主类"""
     
-    def __init__(self):
-        """初始化骰子系统"""
-        self.roll_history = []
-        self.critical_hits = 0
-        self.critical_failures = 0
-        
+    def __init__(self, history_capacity: int = DEFAULT_CAPACITY, history_export_path: str = None,
+                 seed: Union[None, int, Dict, SeedSequence] = None, rng: random.Random = None):
+        """初始化骰子系统
+
+        history_capacity: 内存中保留的最近掷骰条数，超出后覆盖最旧的记录
+        history_export_path: 可选，把完整掷骰历史追加写入该JSONL文件
+        seed: 整数、种子记录或SeedSequence，相同种子得到完全相同的掷骰序列
+        rng: 可选，直接指定随机数生成器(此时seed只用于记录)
+        """
+        self.roll_history = RollHistory(history_capacity, history_export_path)
+        self.counters = self.roll_history.counters
+        self.seed_sequence = as_seed_sequence(seed)
+        self.rng = rng if rng is not None else self.seed_sequence.generator()
+    
+    @classmethod
+    def from_seed_record(cls, seed_record: Dict, **kwargs) -> "DiceRoller":
+        """用战斗记录中保存的种子重建骰子系统，用于逐位重放"""
+        return cls(seed=SeedSequence.from_dict(seed_record), **kwargs)
+    
+    def seed_record(self) -> Dict:
+        """获取可写入JSON的种子记录"""
+        return self.seed_sequence.to_dict()
+    
+    def spawn(self, n: int = 1, **kwargs) -> List["DiceRoller"]:
+        """派生n个随机数流互相独立的子骰子系统(每场战斗/每个工作进程/每个批次)"""
+        return [DiceRoller(seed=child, **kwargs) for child in self.seed_sequence.spawn(n)]
+    
+    @property
+    def critical_hits(self) -> int:
+        """累计重击次数"""
+        return self.counters.critical_hits
+    
+    @property
+    def critical_failures(self) -> int:
+        """累计大失败次数"""
+        return self.counters.critical_failures
+    
     def roll_dice(self, dice_notation: str) -> Dict:
         """解析骰子表达式并掷骰"""
         try:
-            pattern = r'^(\d*)d(\d+)([+-]\d+)?$'
-            match = re.match(pattern, dice_notation.lower())
-            
-            if not match:
-                raise ValueError(f"无效的骰子表达式: {dice_notation}")
+            # 表达式只在第一次出现时解析，之后直接命中编译缓存
+            expression = compile_expression(dice_notation)
             
-            count = int(match.group(1)) if match.group(1) else 1
-            sides = int(match.group(2))
-            modifier = int(match.group(3)) if match.group(3) else 0
-            
-            rolls = [random.randint(1, sides) for _ in range(count)]
-            total = sum(rolls) + modifier
+            if expression.is_simple:
+                total, rolls = expression.roll(self.rng)
+                terms = None
+            else:
+                detail = expression.roll_detail(self.rng)
+                total, rolls, terms = detail["total"], detail["rolls"], detail["terms"]
             
             result = {
                 "notation": dice_notation,
-                "count": count,
-                "sides": sides,
-                "modifier": modifier,
+                "count": expression.count,
+                "sides": expression.sides,
+                "modifier": expression.modifier,
                 "rolls": rolls,
                 "total": total
             }
+            if terms is not None:
+                result["terms"] = terms
             
-            self.roll_history.append(result)
+            self.roll_history.record(TYPE_DICE, total)
             return result
             
         except Exception as e:
@@ -53,30 +102,26 @@ class DiceRoller:
     def roll_d20(self, advantage: str = "none") -> Dict:
         """掷d20，支持优势/劣势"""
         if advantage == "advantage":
-            roll1 = random.randint(1, 20)
-            roll2 = random.randint(1, 20)
+            roll1 = self.rng.randint(1, 20)
+            roll2 = self.rng.randint(1, 20)
             rolls = [roll1, roll2]
             total = max(rolls)
             advantage_type = "优势"
         elif advantage == "disadvantage":
-            roll1 = random.randint(1, 20)
-            roll2 = random.randint(1, 20)
+            roll1 = self.rng.randint(1, 20)
+            roll2 = self.rng.randint(1, 20)
             rolls = [roll1, roll2]
             total = min(rolls)
             advantage_type = "劣势"
         else:
-            roll1 = random.randint(1, 20)
+            roll1 = self.rng.randint(1, 20)
             rolls = [roll1]
             total = roll1
             advantage_type = "无"
         
-        is_critical = roll1 == 20
-        is_critical_failure = roll1 == 1
-        
-        if is_critical:
-            self.critical_hits += 1
-        if is_critical_failure:
-            self.critical_failures += 1
+        # 优势/劣势以保留的那颗骰子判定重击和大失败
+        is_critical = total == 20
+        is_critical_failure = total == 1
         
         result = {
             "type": "d20",
@@ -87,7 +132,8 @@ class DiceRoller:
             "is_critical_failure": is_critical_failure
         }
         
-        self.roll_history.append(result)
+        flags = (FLAG_CRITICAL if is_critical else 0) | (FLAG_CRITICAL_FAILURE if is_critical_failure else 0)
+        self.roll_history.record(TYPE_D20, total, total, flags)
         return result
     
     def roll_ability_check(self, ability_modifier: int, proficiency_bonus: int = 0, 
@@ -114,7 +160,8 @@ class DiceRoller:
             "success": success
         }
         
-        self.roll_history.append(result)
+        flags = FLAG_SUCCESS if success else 0
+        self.roll_history.record(TYPE_ABILITY_CHECK, total, d20_result["total"], flags)
         return result
     
     def roll_attack(self, attack_bonus: int, target_ac: int, 
@@ -146,34 +193,402 @@ class DiceRoller:
             "damage": damage_result
         }
         
-        self.roll_history.append(result)
+        flags = FLAG_HIT if hit else 0
+        if d20_result["is_critical"]:
+            flags |= FLAG_CRITICAL
+        self.roll_history.record(TYPE_ATTACK, attack_total, d20_result["total"], flags)
         return result
     
-    def get_statistics(self) -> Dict:
-        """获取骰子统计信息"""
-        if not self.roll_history:
-            return {"message": "暂无掷骰记录"}
+    def roll_many(self, dice_notation: str, n: int) -> Dict:
+        """批量掷骰：同一表达式重复掷n次，结果以数组按列返回"""
+        expression = compile_expression(dice_notation)
+        
+        # 一次性生成全部骰面，避免逐次掷骰和构造字典
+        totals, term_rolls = expression.roll_many(n, self.rng)
+        
+        self.roll_history.record_batch(TYPE_DICE, n)
+        
+        return {
+            "type": "dice_batch",
+            "notation": dice_notation,
+            "n": n,
+            "count": expression.count,
+            "sides": expression.sides,
+            "modifier": expression.modifier,
+            "rolls": term_rolls[0] if len(term_rolls) == 1 else None,
+            "term_rolls": term_rolls,
+            "totals": totals
+        }
+    
+    def roll_d20_many(self, n: int, advantage: str = "none") -> Dict:
+        """批量掷d20，支持优势/劣势，返回骰面、结果和重击/大失败掩码"""
+        if advantage in ("advantage", "disadvantage"):
+            pairs = self.rng.choices(_D20_PAIRS, k=n)
+            first = array('i', map(_PAIR_FIRST.__getitem__, pairs))
+            second = array('i', map(_PAIR_SECOND.__getitem__, pairs))
+            if advantage == "advantage":
+                totals = array('i', map(_PAIR_MAX.__getitem__, pairs))
+                advantage_type = "优势"
+            else:
+                totals = array('i', map(_PAIR_MIN.__getitem__, pairs))
+                advantage_type = "劣势"
+        else:
+            first = array('i', self.rng.choices(_D20_FACES, k=n))
+            second = None
+            totals = first
+            advantage_type = "无"
+        
+        # 掩码中1表示命中条件成立
+        is_critical = bytearray(map((20).__eq__, totals))
+        is_critical_failure = bytearray(map((1).__eq__, totals))
+        critical_hits = is_critical.count(1)
+        critical_failures = is_critical_failure.count(1)
         
-        total_rolls = len(self.roll_history)
-        d20_rolls = [r for r in self.roll_history if r.get("type") == "d20" or "d20" in str(r.get("type"))]
+        self.roll_history.record_batch(TYPE_D20, n, critical_hits, critical_failures)
         
-        stats = {
-            "total_rolls": total_rolls,
-            "d20_rolls": len(d20_rolls),
-            "critical_hits": self.critical_hits,
-            "critical_failures": self.critical_failures,
-            "critical_rate": self.critical_hits / max(len(d20_rolls), 1)
+        return {
+            "type": "d20_batch",
+            "advantage": advantage_type,
+            "n": n,
+            "rolls": first,
+            "second_rolls": second,
+            "totals": totals,
+            "is_critical": is_critical,
+            "is_critical_failure": is_critical_failure,
+            "critical_hits": critical_hits,
+            "critical_failures": critical_failures
         }
+    
+    def roll_attack_many(self, attack_bonuses: Union[int, Sequence[int]],
+                         target_acs: Union[int, Sequence[int]],
+                         advantage: str = "none", weapon_damage: str = None,
+                         n: int = None) -> Dict:
+        """批量攻击检定，攻击加值和目标AC可以是整数或等长序列"""
+        scalar = isinstance(attack_bonuses, int) and isinstance(target_acs, int)
+        if n is None:
+            lengths = [len(v) for v in (attack_bonuses, target_acs) if not isinstance(v, int)]
+            if not lengths:
+                raise ValueError("攻击加值和目标AC都是整数时必须指定n")
+            n = lengths[0]
+        if scalar:
+            # 加值和AC固定时，命中只取决于d20结果，可以预先算好20个面的命中表
+            needed = target_acs - attack_bonuses
+            hit_table = tuple(face == 20 or (face != 1 and face >= needed) for face in range(21))
+        if isinstance(attack_bonuses, int):
+            attack_bonuses = [attack_bonuses] * n
+        if isinstance(target_acs, int):
+            target_acs = [target_acs] * n
+        if len(attack_bonuses) != n or len(target_acs) != n:
+            raise ValueError("攻击加值和目标AC的长度必须一致")
+        
+        d20_result = self.roll_d20_many(n, advantage)
+        attack_totals = array('i', map(int.__add__, d20_result["totals"], attack_bonuses))
+        
+        # 天然20必中，天然1必失，其余比较AC
+        if scalar:
+            hit = bytearray(map(hit_table.__getitem__, d20_result["totals"]))
+        else:
+            hit = bytearray(
+                crit or (not fumble and total >= ac)
+                for total, ac, crit, fumble in zip(attack_totals, target_acs,
+                                                   d20_result["is_critical"],
+                                                   d20_result["is_critical_failure"])
+            )
+        
+        damage = array('i', [0]) * n
+        if weapon_damage:
+            hit_indexes = [i for i, h in enumerate(hit) if h]
+            damage_result = self.roll_many(weapon_damage, len(hit_indexes))
+            is_critical = d20_result["is_critical"]
+            for i, total in zip(hit_indexes, damage_result["totals"]):
+                damage[i] = total * 2 if is_critical[i] else total
+        
+        self.roll_history.record_batch(TYPE_ATTACK, n)
+        
+        return {
+            "type": "attack_batch",
+            "n": n,
+            "d20_result": d20_result,
+            "attack_totals": attack_totals,
+            "target_acs": array('i', target_acs),
+            "hit": hit,
+            "hits": hit.count(1),
+            "damage": damage
+        }
+    
+    def get_statistics(self) -> Dict:
+        """获取骰子统计信息(基于累计计数器，耗时与历史长度无关)"""
+        if not self.counters.total_rolls:
+            return {"message": "暂无掷骰记录"}
+        
+        return self.counters.to_dict()
+    
+    def export_history(self, path: str) -> int:
+        """把内存中的最近掷骰记录导出为JSONL文件"""
+        return self.roll_history.export(path)
+
+class RollerRegistry:
+    """进程级骰子系统注册表
+
+    每个线程第一次掷骰时从根种子派生一个独立的DiceRoller，之后只在本线程使用，
+    掷骰和计数都不需要加锁；全局统计在查询时才把各线程的计数器汇总。
+    线程结束、骰子系统被回收后，它的计数并入已退役计数，不会丢失。
+    """
+    
+    def __init__(self, seed: Union[None, int, Dict, SeedSequence] = None,
+                 history_capacity: int = DEFAULT_CAPACITY):
+        """初始化注册表"""
+        self.seed_sequence = as_seed_sequence(seed)
+        self.history_capacity = history_capacity
+        self._local = threading.local()
+        # 只在注册、注销和汇总时加锁；回收回调可能在任意线程触发，用可重入锁
+        self._lock = threading.RLock()
+        self._live = {}
+        self._retired = RollCounters()
+    
+    def get_roller(self) -> DiceRoller:
+        """获取当前线程专属的骰子系统"""
+        roller = getattr(self._local, "roller", None)
+        if roller is None:
+            with self._lock:
+                child = self.seed_sequence.spawn(1)[0]
+            roller = self.register(DiceRoller(self.history_capacity, seed=child))
+            self._local.roller = roller
+        return roller
+    
+    def register(self, roller: DiceRoller) -> DiceRoller:
+        """把外部创建的骰子系统纳入全局统计"""
+        counters = roller.counters
+        key = id(counters)
+        with self._lock:
+            if key in self._live:
+                return roller
+            self._live[key] = counters
+        weakref.finalize(roller, self._retire, key)
+        return roller
+    
+    def _retire(self, key: int):
+        """骰子系统被回收时，把它的计数并入已退役计数"""
+        with self._lock:
+            counters = self._live.pop(key, None)
+            if counters is not None:
+                self._retired.merge(counters)
+    
+    def aggregate(self) -> RollCounters:
+        """汇总所有线程(含已退役)的计数器"""
+        total = RollCounters()
+        with self._lock:
+            total.merge(self._retired)
+            for counters in list(self._live.values()):
+                total.merge(counters)
+        return total
+    
+    def get_statistics(self) -> Dict:
+        """获取全局骰子统计信息"""
+        counters = self.aggregate()
+        if not counters.total_rolls:
+            return {"message": "暂无掷骰记录"}
         
-        return stats
+        statistics = counters.to_dict()
+        statistics["active_rollers"] = len(self._live)
+        return statistics
+
+_registry = RollerRegistry()
+
+def get_registry() -> RollerRegistry:
+    """获取进程级骰子系统注册表"""
+    return _registry
+
+def configure_registry(seed: Union[None, int, Dict, SeedSequence] = None,
+                       history_capacity: int = DEFAULT_CAPACITY) -> RollerRegistry:
+    """用新的根种子重建注册表，之后各线程的掷骰序列可以复现"""
+    global _registry
+    _registry = RollerRegistry(seed, history_capacity)
+    return _registry
+
+def get_roller() -> DiceRoller:
+    """获取当前线程共享的骰子系统"""
+    return _registry.get_roller()
 
 # 便捷函数
 def roll(dice_notation: str) -> Dict:
     """快速掷骰函数"""
-    roller = DiceRoller()
-    return roller.roll_dice(dice_notation)
+    return get_roller().roll_dice(dice_notation)
 
 def roll_d20(advantage: str = "none") -> Dict:
     """快速掷d20函数"""
-    roller = DiceRoller()
-    return roller.roll_d20(advantage)
+    return get_roller().roll_d20(advantage)
+
+def get_global_statistics() -> Dict:
+    """快速获取全局骰子统计"""
+    return _registry.get_statistics()
+
+# 命令行
+_ADVANTAGE_ALIASES = {
+    "adv": "advantage", "advantage": "advantage", "优势": "advantage",
+    "dis": "disadvantage", "disadvantage": "disadvantage", "劣势": "disadvantage"
+}
+
+def _parse_cli_line(line: str) -> Tuple[str, Dict]:
+    """解析一行输入，返回(请求类型, 参数)
+
+    支持的格式:
+        2d6+3                              骰子表达式
+        d20 [adv|dis]                      d20检定
+        attack 5 15 [1d8+3] [adv|dis]      攻击: 加值 目标AC [伤害] [优势/劣势]，AC前可写vs
+        {"notation": "2d6+3"}              JSON对象，字段同上(attack_bonus/target_ac/weapon_damage/advantage)
+    """
+    if line.startswith("{"):
+        request = json.loads(line)
+        if "notation" in request:
+            return "dice", {"dice_notation": request["notation"]}
+        if "attack_bonus" in request:
+            return "attack", {
+                "attack_bonus": int(request["attack_bonus"]),
+                "target_ac": int(request["target_ac"]),
+                "weapon_damage": request.get("weapon_damage"),
+                "advantage": _ADVANTAGE_ALIASES.get(request.get("advantage", "none"), "none")
+            }
+        return "d20", {"advantage": _ADVANTAGE_ALIASES.get(request.get("advantage", "none"), "none")}
+    
+    words = line.split()
+    head = words[0].lower()
+    advantage = "none"
+    if words[-1].lower() in _ADVANTAGE_ALIASES and len(words) > 1:
+        advantage = _ADVANTAGE_ALIASES[words.pop().lower()]
+    
+    if head == "d20" and len(words) == 1:
+        return "d20", {"advantage": advantage}
+    if head == "attack":
+        args = [w for w in words[1:] if w.lower() != "vs"]
+        if len(args) not in (2, 3):
+            raise ValueError(f"无效的攻击格式: {line}")
+        return "attack", {
+            "attack_bonus": int(args[0]),
+            "target_ac": int(args[1]),
+            "weapon_damage": args[2] if len(args) == 3 else None,
+            "advantage": advantage
+        }
+    if advantage != "none":
+        raise ValueError(f"只有d20和攻击支持优势/劣势: {line}")
+    return "dice", {"dice_notation": line}
+
+def _summarize(values: Sequence[int]) -> Dict:
+    """批量结果的平均值、最小值和最大值"""
+    n = len(values)
+    if not n:
+        return {"mean": None, "min": None, "max": None}
+    return {"mean": sum(values) / n, "min": min(values), "max": max(values)}
+
+def _run_cli_line(roller: DiceRoller, kind: str, params: Dict, count: int, summary_only: bool) -> Dict:
+    """执行一行请求，count大于1时使用批量掷骰"""
+    if count == 1:
+        if kind == "dice":
+            return roller.roll_dice(**params)
+        if kind == "d20":
+            return roller.roll_d20(**params)
+        return roller.roll_attack(**params)
+    
+    if kind == "dice":
+        batch = roller.roll_many(params["dice_notation"], count)
+        result = {"type": "dice_batch", "notation": batch["notation"], "n": count}
+        result.update(_summarize(batch["totals"]))
+        if not summary_only:
+            result["totals"] = batch["totals"].tolist()
+        return result
+    
+    if kind == "d20":
+        batch = roller.roll_d20_many(count, params["advantage"])
+        result = {
+            "type": "d20_batch",
+            "advantage": batch["advantage"],
+            "n": count,
+            "critical_hits": batch["critical_hits"],
+            "critical_failures": batch["critical_failures"]
+        }
+        result.update(_summarize(batch["totals"]))
+        if not summary_only:
+            result["totals"] = batch["totals"].tolist()
+        return result
+    
+    batch = roller.roll_attack_many(params["attack_bonus"], params["target_ac"], params["advantage"],
+                                    params["weapon_damage"], n=count)
+    damage = batch["damage"]
+    result = {
+        "type": "attack_batch",
+        "attack_bonus": params["attack_bonus"],
+        "target_ac": params["target_ac"],
+        "weapon_damage": params["weapon_damage"],
+        "advantage": batch["d20_result"]["advantage"],
+        "n": count,
+        "hits": batch["hits"],
+        "hit_rate": batch["hits"] / count,
+        "critical_hits": batch["d20_result"]["critical_hits"],
+        "mean_damage": sum(damage) / count
+    }
+    if not summary_only:
+        result["hit"] = list(batch["hit"])
+        result["damage"] = damage.tolist()
+    return result
+
+def run_cli(lines: Iterable[str], output: TextIO, roller: Optional[DiceRoller] = None,
+            count: int = 1, summary_only: bool = False) -> int:
+    """逐行处理输入并把JSONL结果写入output，返回出错的行数"""
+    roller = roller or get_roller()
+    dumps = json.JSONEncoder(ensure_ascii=False, separators=(',', ':')).encode
+    write = output.write
+    errors = 0
+    
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith("#"):
+            continue
+        try:
+            kind, params = _parse_cli_line(line)
+            result = _run_cli_line(roller, kind, params, count, summary_only)
+        except Exception as e:
+            result = {"error": str(e)}
+        if "error" in result:
+            result["input"] = line
+            errors += 1
+        write(dumps(result) + "\n")
+    
+    return errors
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """dnd-dice 命令行入口：从标准输入或文件逐行读取请求，以JSONL格式输出结果"""
+    parser = argparse.ArgumentParser(
+        prog="dnd-dice",
+        description="批量掷骰：每行一个骰子表达式(2d6+3)、d20检定(d20 adv)或攻击(attack 5 15 1d8+3)",
+    )
+    parser.add_argument("input", nargs="?", default="-", help="输入文件，省略或为-时读取标准输入")
+    parser.add_argument("-e", "--expr", action="append", help="直接指定请求，可重复使用，指定后不读取输入")
+    parser.add_argument("-n", "--count", type=int, default=1, help="每个请求重复掷骰次数(批量模式)")
+    parser.add_argument("--seed", type=int, help="随机种子，相同种子和输入得到相同结果")
+    parser.add_argument("--summary-only", action="store_true", help="批量模式只输出汇总，不输出逐次结果")
+    parser.add_argument("--stats", action="store_true", help="结束时向标准错误输出掷骰统计")
+    args = parser.parse_args(argv)
+    
+    if args.count < 1:
+        parser.error("--count 必须大于0")
+    
+    roller = DiceRoller(seed=args.seed) if args.seed is not None else get_roller()
+    
+    if args.expr:
+        errors = run_cli(args.expr, sys.stdout, roller, args.count, args.summary_only)
+    elif args.input == "-":
+        errors = run_cli(sys.stdin, sys.stdout, roller, args.count, args.summary_only)
+    else:
+        with open(args.input, 'r', encoding='utf-8') as f:
+            errors = run_cli(f, sys.stdout, roller, args.count, args.summary_only)
+    sys.stdout.flush()
+    
+    if args.stats:
+        statistics = roller.get_statistics()
+        statistics["errors"] = errors
+        print(json.dumps(statistics, ensure_ascii=False), file=sys.stderr)
+    
+    return 1 if errors else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,69 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 可复现、可拆分的随机数流
+用法参照NumPy的SeedSequence，但只依赖标准库:
+
+    root = SeedSequence(12345)                  # 整个模拟的根种子
+    workers = root.spawn(4)                     # 每个工作进程一个独立子流
+    batches = workers[0].spawn(10)              # 工作进程内每个批次再拆分
+    roller = DiceRoller(seed=batches[0])        # 用子流创建骰子系统
+
+子流由 (熵, 派生路径) 经哈希得到，互不重叠；
+把 to_dict() 的结果记录下来，就能用 SeedSequence.from_dict() 逐位重放同一场战斗
+"""
+
+import hashlib
+import random
+import secrets
+from typing import Dict, List, Optional, Tuple, Union
+
+class SeedSequence:
+    """可派生独立子流的种子序列"""
+    
+    __slots__ = ("entropy", "spawn_key", "n_children_spawned")
+    
+    def __init__(self, entropy: Optional[int] = None, spawn_key: Tuple[int, ...] = ()):
+        """初始化种子序列，未指定熵时从系统随机源获取128位熵"""
+        if entropy is None:
+            entropy = secrets.randbits(128)
+        if entropy < 0:
+            raise ValueError("种子必须是非负整数")
+        self.entropy = entropy
+        self.spawn_key = tuple(spawn_key)
+        self.n_children_spawned = 0
+    
+    def spawn(self, n: int) -> List["SeedSequence"]:
+        """派生n个互相独立的子序列，多次调用不会重复"""
+        start = self.n_children_spawned
+        self.n_children_spawned += n
+        return [SeedSequence(self.entropy, self.spawn_key + (i,)) for i in range(start, start + n)]
+    
+    def generate_state(self) -> int:
+        """由熵和派生路径哈希得到256位状态"""
+        material = f"{self.entropy}:{','.join(map(str, self.spawn_key))}".encode("ascii")
+        return int.from_bytes(hashlib.blake2b(material, digest_size=32).digest(), "big")
+    
+    def generator(self) -> random.Random:
+        """创建以该序列为种子的独立随机数生成器"""
+        return random.Random(self.generate_state())
+    
+    def to_dict(self) -> Dict:
+        """转换为可写入JSON的记录"""
+        return {"entropy": str(self.entropy), "spawn_key": list(self.spawn_key)}
+    
+    @classmethod
+    def from_dict(cls, record: Dict) -> "SeedSequence":
+        """从记录恢复种子序列"""
+        return cls(int(record["entropy"]), tuple(record.get("spawn_key", ())))
+    
+    def __repr__(self) -> str:
+        return f"SeedSequence(entropy={self.entropy}, spawn_key={self.spawn_key})"
+
+def as_seed_sequence(seed: Union[None, int, Dict, SeedSequence]) -> SeedSequence:
+    """把整数、记录字典或SeedSequence统一转换为SeedSequence"""
+    if isinstance(seed, SeedSequence):
+        return seed
+    if isinstance(seed, dict):
+        return SeedSequence.from_dict(seed)
+    return SeedSequence(seed)
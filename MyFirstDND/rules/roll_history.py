@@ -0,0 +1,219 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 掷骰历史
+定长环形缓冲区按列保存最近的掷骰记录，并维护累计计数器，统计为O(1)
+"""
+
+import json
+import weakref
+from array import array
+from typing import Dict, Iterator, List, Optional
+
+# 默认保留的最近掷骰条数
+DEFAULT_CAPACITY = 10000
+
+# 记录类型编码
+TYPE_UNKNOWN = 0
+TYPE_DICE = 1
+TYPE_D20 = 2
+TYPE_ABILITY_CHECK = 3
+TYPE_ATTACK = 4
+
+TYPE_NAMES = ("unknown", "dice", "d20", "ability_check", "attack")
+TYPE_CODES = {name: code for code, name in enumerate(TYPE_NAMES)}
+
+# 标志位
+FLAG_CRITICAL = 1
+FLAG_CRITICAL_FAILURE = 2
+FLAG_HIT = 4
+FLAG_SUCCESS = 8
+
+class RollCounters:
+    """掷骰累计计数器，不随环形缓冲区覆盖而丢失"""
+    
+    __slots__ = ("by_type", "critical_hits", "critical_failures")
+    
+    def __init__(self):
+        """初始化计数器"""
+        self.by_type = [0] * len(TYPE_NAMES)
+        self.critical_hits = 0
+        self.critical_failures = 0
+    
+    @property
+    def total_rolls(self) -> int:
+        """累计掷骰次数"""
+        return sum(self.by_type)
+    
+    @property
+    def d20_rolls(self) -> int:
+        """累计d20次数"""
+        return self.by_type[TYPE_D20]
+    
+    def merge(self, other: "RollCounters"):
+        """把另一组计数器累加进来"""
+        self.critical_hits += other.critical_hits
+        self.critical_failures += other.critical_failures
+        for code, count in enumerate(other.by_type):
+            self.by_type[code] += count
+    
+    def to_dict(self) -> Dict:
+        """转换为统计字典"""
+        d20_rolls = self.d20_rolls
+        return {
+            "total_rolls": self.total_rolls,
+            "d20_rolls": d20_rolls,
+            "critical_hits": self.critical_hits,
+            "critical_failures": self.critical_failures,
+            "critical_rate": self.critical_hits / max(d20_rolls, 1),
+            "rolls_by_type": {TYPE_NAMES[code]: count for code, count in enumerate(self.by_type) if count}
+        }
+
+class RollHistory:
+    """环形缓冲区掷骰历史，按列存储类型、结果、d20自然值和标志位"""
+    
+    def __init__(self, capacity: int = DEFAULT_CAPACITY, export_path: Optional[str] = None,
+                 counters: Optional[RollCounters] = None):
+        """初始化历史记录
+
+        capacity: 内存中保留的最近记录条数
+        export_path: 可选，设置后每条记录都会以JSONL格式追加写入该文件，保留完整历史
+        """
+        if capacity < 1:
+            raise ValueError("历史记录容量必须大于0")
+        self.capacity = capacity
+        self.counters = counters or RollCounters()
+        self.types = array('B', [0]) * capacity
+        self.totals = array('i', [0]) * capacity
+        self.naturals = array('b', [0]) * capacity
+        self.flags = array('B', [0]) * capacity
+        self._next = 0
+        self._size = 0
+        self._export_file = None
+        self._export_closer = None
+        self.export_path = None
+        if export_path:
+            self.enable_export(export_path)
+    
+    def record(self, type_code: int, total: int, natural: int = 0, flags: int = 0):
+        """写入一条记录并更新计数器"""
+        index = self._next
+        self.types[index] = type_code
+        self.totals[index] = total
+        self.naturals[index] = natural
+        self.flags[index] = flags
+        index += 1
+        if index == self.capacity:
+            index = 0
+        self._next = index
+        if self._size < self.capacity:
+            self._size += 1
+        
+        counters = self.counters
+        counters.by_type[type_code] += 1
+        if flags and type_code == TYPE_D20:
+            if flags & FLAG_CRITICAL:
+                counters.critical_hits += 1
+            if flags & FLAG_CRITICAL_FAILURE:
+                counters.critical_failures += 1
+        
+        if self._export_file is not None:
+            self._export_file.write(json.dumps(self._row(type_code, total, natural, flags),
+                                               ensure_ascii=False, separators=(',', ':')) + "\n")
+    
+    def append(self, result: Dict):
+        """从掷骰结果字典中提取列数据并写入"""
+        type_code = TYPE_CODES.get(result.get("type", "dice"), TYPE_UNKNOWN)
+        flags = 0
+        natural = 0
+        
+        if type_code == TYPE_D20:
+            d20 = result
+        else:
+            d20 = result.get("d20_result")
+        if d20 is not None:
+            natural = d20["total"]
+            if d20.get("is_critical"):
+                flags |= FLAG_CRITICAL
+            if d20.get("is_critical_failure"):
+                flags |= FLAG_CRITICAL_FAILURE
+        if result.get("hit"):
+            flags |= FLAG_HIT
+        if result.get("success"):
+            flags |= FLAG_SUCCESS
+        
+        total = result.get("attack_total", result.get("total", 0))
+        self.record(type_code, total, natural, flags)
+    
+    def record_batch(self, type_code: int, n: int, critical_hits: int = 0, critical_failures: int = 0):
+        """批量掷骰只累加计数器，不逐条写入缓冲区"""
+        counters = self.counters
+        counters.by_type[type_code] += n
+        counters.critical_hits += critical_hits
+        counters.critical_failures += critical_failures
+    
+    def _row(self, type_code: int, total: int, natural: int, flags: int) -> Dict:
+        """把一条列数据还原为字典"""
+        return {
+            "type": TYPE_NAMES[type_code],
+            "total": total,
+            "natural_d20": natural or None,
+            "is_critical": bool(flags & FLAG_CRITICAL),
+            "is_critical_failure": bool(flags & FLAG_CRITICAL_FAILURE),
+            "hit": bool(flags & FLAG_HIT),
+            "success": bool(flags & FLAG_SUCCESS)
+        }
+    
+    def __len__(self) -> int:
+        return self._size
+    
+    def __iter__(self) -> Iterator[Dict]:
+        """从旧到新遍历缓冲区中的记录"""
+        start = (self._next - self._size) % self.capacity
+        for offset in range(self._size):
+            i = (start + offset) % self.capacity
+            yield self._row(self.types[i], self.totals[i], self.naturals[i], self.flags[i])
+    
+    def recent(self, limit: int = 10) -> List[Dict]:
+        """获取最近的若干条记录"""
+        count = min(limit, self._size) if limit else self._size
+        rows = []
+        for offset in range(count, 0, -1):
+            i = (self._next - offset) % self.capacity
+            rows.append(self._row(self.types[i], self.totals[i], self.naturals[i], self.flags[i]))
+        return rows
+    
+    def clear(self):
+        """清空缓冲区(累计计数器保留)"""
+        self._next = 0
+        self._size = 0
+    
+    def enable_export(self, export_path: str):
+        """开启完整历史导出：之后的每条记录都追加写入JSONL文件"""
+        self.disable_export()
+        self._export_file = open(export_path, 'a', encoding='utf-8')
+        self.export_path = export_path
+        # 历史记录被回收(如注册表中的骰子系统随线程退役)或解释器退出时，写入缓冲并关闭文件
+        self._export_closer = weakref.finalize(self, self._export_file.close)
+    
+    def disable_export(self):
+        """关闭完整历史导出"""
+        if self._export_file is not None:
+            self._export_closer()
+            self._export_closer = None
+            self._export_file = None
+            self.export_path = None
+    
+    def export(self, path: str) -> int:
+        """把缓冲区中现有的记录导出为JSONL文件，返回导出条数"""
+        count = 0
+        with open(path, 'w', encoding='utf-8') as f:
+            for row in self:
+                f.write(json.dumps(row, ensure_ascii=False, separators=(',', ':')) + "\n")
+                count += 1
+        return count
+    
+    def flush(self):
+        """把导出文件的缓冲写入磁盘"""
+        if self._export_file is not None:
+            self._export_file.flush()
@@ -59,6 +59,9 @@ setup(
             "flake8>=3.8",
             "mypy>=0.800",
         ],
+        "fast": [
+            "orjson>=3.6",
+        ],
     },
     entry_points={
         "console_scripts": [
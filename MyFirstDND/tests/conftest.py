@@ -0,0 +1,46 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 测试公共夹具
+每个测试在临时目录中的数据副本上运行，不会修改仓库自带的数据文件
+"""
+
+import json
+import os
+import shutil
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+# 测试需要的数据目录
+DATA_DIRS = ("characters", "combat", "adventures", "items", "monsters", "config")
+
+@pytest.fixture
+def data_path(tmp_path):
+    """复制一份数据目录，返回副本路径"""
+    for name in DATA_DIRS:
+        shutil.copytree(os.path.join(ROOT, name), str(tmp_path / name))
+    return str(tmp_path)
+
+def read_json(data_path: str, relative: str):
+    """直接从磁盘读取数据文件(绕过共享缓存)"""
+    with open(os.path.join(data_path, relative), 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+def write_json(data_path: str, relative: str, document):
+    """直接覆盖数据文件"""
+    with open(os.path.join(data_path, relative), 'w', encoding='utf-8') as f:
+        json.dump(document, f, ensure_ascii=False)
+
+def play_combat(recorder, combat_id: str, enemies=None, rounds: int = 1):
+    """开始一场战斗并记录几回合玩家攻击"""
+    recorder.start_combat(combat_id, enemies or [{"name": "狼"}])
+    for number in range(1, rounds + 1):
+        recorder.record_combat_round({
+            "round": number,
+            "type": "player_action",
+            "player_action": {"type": "attack", "hit": True, "damage": 3}
+        }, combat_id)
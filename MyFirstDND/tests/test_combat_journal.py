@@ -0,0 +1,103 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 战斗日志恢复测试
+重启后 recover() 重放日志：未结束的战斗重新登记，已写入结果的战斗只合并一次
+"""
+
+import os
+
+from conftest import play_combat, read_json
+from utils.combat_recorder import CombatRecorder
+from utils.combat_session import CombatSession
+
+def _total_combats(data_path: str) -> int:
+    """战斗历史中的总场数"""
+    return read_json(data_path, "combat/combat_history.json").get("statistics", {}).get("total_combats", 0)
+
+def _journals(data_path: str):
+    """剩余的战斗日志"""
+    return sorted(os.listdir(os.path.join(data_path, "combat/journal")))
+
+def test_recover_registers_unfinished_combat(data_path):
+    """写入日志的回合在重启后重放，战斗可以继续记录并正常结束"""
+    recorder = CombatRecorder(data_path, flush_every_rounds=1)
+    play_combat(recorder, "c1", rounds=3)
+    before = _total_combats(data_path)
+
+    restarted = CombatRecorder(data_path)
+    assert restarted.current_combat_id == "c1"
+    assert restarted.active_combats() == ["c1"]
+    assert restarted.get_live_stats()["rounds"] == 3
+    assert restarted.get_live_stats()["player_damage_dealt"] == 9
+
+    round_data = {"round": 4, "type": "player_action",
+                  "player_action": {"type": "attack", "hit": True, "damage": 3}}
+    assert restarted.record_combat_round(round_data)
+    assert restarted.end_combat({"victory": True})
+    assert _total_combats(data_path) == before + 1
+    assert len(restarted.storage.query_combats(include_rounds=True)[-1]["rounds"]) == 4
+    assert _journals(data_path) == []
+
+def test_recover_drops_unflushed_rounds_only(data_path):
+    """写入策略之外的积压回合没有落盘，重启后只恢复已写入的回合"""
+    recorder = CombatRecorder(data_path, flush_every_rounds=2, flush_every_seconds=None)
+    play_combat(recorder, "c1", rounds=3)
+    assert recorder.session.pending_rounds == 1
+
+    restarted = CombatRecorder(data_path)
+    assert restarted.get_live_stats("c1")["rounds"] == 2
+
+def test_recover_ignores_truncated_last_line(data_path):
+    """崩溃时写了一半的最后一行被跳过"""
+    recorder = CombatRecorder(data_path, flush_every_rounds=1)
+    play_combat(recorder, "c1", rounds=2)
+    with open(os.path.join(data_path, "combat/journal/c1.jsonl"), 'ab') as f:
+        f.write(b'{"event": "round", "round": {"rou')
+
+    restarted = CombatRecorder(data_path)
+    assert restarted.get_live_stats("c1")["rounds"] == 2
+
+def test_recover_folds_ended_combat_once(data_path):
+    """结果已写入日志但合并前崩溃时，重启补完合并并删除日志，再次重启不重复合并"""
+    recorder = CombatRecorder(data_path)
+    play_combat(recorder, "c1", rounds=2)
+    before = _total_combats(data_path)
+    # 模拟end_combat在写入结果之后、合并之前崩溃
+    recorder.session.finish({"victory": True})
+    assert _total_combats(data_path) == before
+
+    restarted = CombatRecorder(data_path)
+    assert restarted.active_combats() == []
+    assert _total_combats(data_path) == before + 1
+    assert restarted.storage.has_combat("c1")
+    assert _journals(data_path) == []
+
+    CombatRecorder(data_path)
+    assert _total_combats(data_path) == before + 1
+
+def test_recover_skips_already_folded_combat(data_path, monkeypatch):
+    """合并已经提交、只是日志没来得及删除时，重启只删除日志"""
+    recorder = CombatRecorder(data_path)
+    play_combat(recorder, "c1")
+    before = _total_combats(data_path)
+    with monkeypatch.context() as patch:
+        # 模拟合并提交后、删除日志前崩溃
+        patch.setattr(CombatSession, "discard", lambda self: None)
+        assert recorder.end_combat({"victory": True})
+    assert _journals(data_path) == ["c1.jsonl"]
+
+    CombatRecorder(data_path)
+    assert _total_combats(data_path) == before + 1
+    assert _journals(data_path) == []
+
+def test_recover_removes_headerless_journal(data_path):
+    """连头信息都没写完的日志没有可恢复的内容，直接删除"""
+    journal_dir = os.path.join(data_path, "combat/journal")
+    os.makedirs(journal_dir)
+    with open(os.path.join(journal_dir, "c1.jsonl"), 'wb') as f:
+        f.write(b'{"event": "sta')
+
+    recorder = CombatRecorder(data_path)
+    assert recorder.active_combats() == []
+    assert _journals(data_path) == []
@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 战斗记录器测试
+end_combat 在数据文件缺失或只有部分字段时也要一次性提交，批量提交失败时逐场重试
+"""
+
+import asyncio
+import os
+
+import pytest
+
+from conftest import play_combat, read_json, write_json
+from utils.combat_recorder import CombatRecorder
+
+JOURNAL_DIR = "combat/journal"
+
+@pytest.mark.parametrize("missing", [
+    "combat/combat_history.json",
+    "combat/balance_analysis.json",
+    "adventures/adventure_log.json",
+    "characters/player_character.json"
+])
+def test_end_combat_with_missing_document(data_path, missing):
+    """缺少任意一个数据文件时战斗仍能结束，日志被清理"""
+    os.remove(os.path.join(data_path, missing))
+    recorder = CombatRecorder(data_path)
+    play_combat(recorder, "c1")
+
+    assert recorder.end_combat({"victory": True})
+    assert os.listdir(os.path.join(data_path, JOURNAL_DIR)) == []
+    assert recorder.storage.has_combat("c1")
+
+    history = read_json(data_path, "combat/combat_history.json")
+    assert history["statistics"]["total_combats"] >= 1
+    if missing == "characters/player_character.json":
+        # 没有角色卡时不凭空创建
+        assert not os.path.exists(os.path.join(data_path, missing))
+    if missing == "combat/balance_analysis.json":
+        balance = read_json(data_path, missing)
+        assert balance["combat_balance_analysis"]["overall_performance"]["combat_count"] == 1
+
+def test_end_combat_with_partial_documents(data_path):
+    """文档只有最少的字段时按默认值补齐"""
+    write_json(data_path, "combat/combat_history.json", {})
+    write_json(data_path, "combat/balance_analysis.json", {})
+    write_json(data_path, "adventures/adventure_log.json", {})
+    character = read_json(data_path, "characters/player_character.json")
+    for key in ("combat_history", "development_notes"):
+        character.pop(key, None)
+    write_json(data_path, "characters/player_character.json", character)
+
+    recorder = CombatRecorder(data_path)
+    play_combat(recorder, "c1", rounds=2)
+    assert recorder.end_combat({"victory": True, "player_damage_dealt": 6})
+
+    history = read_json(data_path, "combat/combat_history.json")
+    assert history["statistics"]["total_combats"] == 1
+    assert history["statistics"]["total_rounds"] == 2
+    assert [c["combat_id"] for c in history["recent_combats"]] == ["c1"]
+
+    character = read_json(data_path, "characters/player_character.json")
+    assert character["combat_history"]["total_combats"] == 1
+
+    balance = read_json(data_path, "combat/balance_analysis.json")["combat_balance_analysis"]
+    assert balance["overall_performance"]["combat_count"] == 1
+    assert balance["round_analysis"]["round_count_distribution"]
+
+def test_end_combat_twice(data_path):
+    """同一场战斗只合并一次"""
+    recorder = CombatRecorder(data_path)
+    play_combat(recorder, "c1")
+    before = read_json(data_path, "combat/combat_history.json")["statistics"].get("total_combats", 0)
+
+    assert recorder.end_combat({"victory": True}, "c1")
+    assert not recorder.end_combat({"victory": True}, "c1")
+
+    history = read_json(data_path, "combat/combat_history.json")
+    assert history["statistics"]["total_combats"] == before + 1
+
+def test_batched_end_combat_retries_individually(data_path, monkeypatch):
+    """批量提交失败时逐场提交，出错的战斗保留在登记表中，其余战斗正常结束"""
+    recorders = [CombatRecorder(data_path) for _ in range(3)]
+    for index, recorder in enumerate(recorders):
+        play_combat(recorder, f"c{index}")
+
+    apply_combat = CombatRecorder._apply_combat
+
+    def failing_apply(self, transaction, current_combat, combat_result):
+        if combat_result.get("corrupt"):
+            raise KeyError("corrupt")
+        return apply_combat(self, transaction, current_combat, combat_result)
+
+    monkeypatch.setattr(CombatRecorder, "_apply_combat", failing_apply)
+
+    async def end_all():
+        return await asyncio.gather(
+            recorders[0].end_combat_async({"victory": True}, "c0"),
+            recorders[1].end_combat_async({"victory": True, "corrupt": True}, "c1"),
+            recorders[2].end_combat_async({"victory": False}, "c2"))
+
+    assert asyncio.run(end_all()) == [True, False, True]
+    assert "c1" in recorders[1].sessions
+    assert os.listdir(os.path.join(data_path, JOURNAL_DIR)) == ["c1.jsonl"]
+    assert recorders[0].storage.has_combat("c0")
+    assert recorders[0].storage.has_combat("c2")
+    assert not recorders[0].storage.has_combat("c1")
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 多文件事务测试
+提交点(意图文件落盘)之后中断的事务，启动恢复时要补完；提交点之前中断的事务要丢弃
+"""
+
+import json
+import os
+
+from conftest import read_json
+from utils.data_transaction import INTENT_PREFIX, DataTransaction, apply_renames, recover_pending_commit
+from utils.storage_backend import open_storage
+
+HISTORY = "combat/combat_history.json"
+BALANCE = "combat/balance_analysis.json"
+
+def _stage_crashed_commit(data_path: str, renamed: int = 0) -> str:
+    """模拟提交中途崩溃：修改两个文件并写入意图文件，只完成前renamed个重命名，返回意图文件路径"""
+    transaction = DataTransaction(data_path)
+    history_file = os.path.join(data_path, HISTORY)
+    balance_file = os.path.join(data_path, BALANCE)
+    transaction.acquire(history_file, balance_file)
+    transaction.update(history_file)["marker"] = "committed"
+    transaction.update(balance_file)["marker"] = "committed"
+    renames = transaction.stage()
+
+    intent_file = os.path.join(data_path, f"{INTENT_PREFIX}-crashed.json")
+    with open(intent_file, 'w', encoding='utf-8') as f:
+        json.dump({"renames": renames}, f)
+    apply_renames(renames[:renamed])
+    # 进程退出时文件锁随之释放
+    transaction.release()
+    return intent_file
+
+def _leftovers(data_path: str):
+    """数据目录中残留的意图文件和临时文件"""
+    found = []
+    for directory, _dirs, files in os.walk(data_path):
+        found.extend(name for name in files if name.startswith(INTENT_PREFIX) or ".txn-" in name)
+    return found
+
+def test_recover_completes_leftover_intent(data_path):
+    """意图文件已落盘但一个文件都没有重命名时，恢复补完全部重命名"""
+    intent_file = _stage_crashed_commit(data_path)
+    assert "marker" not in read_json(data_path, HISTORY)
+
+    assert recover_pending_commit(data_path)
+    assert read_json(data_path, HISTORY)["marker"] == "committed"
+    assert read_json(data_path, BALANCE)["marker"] == "committed"
+    assert not os.path.exists(intent_file)
+    assert _leftovers(data_path) == []
+
+def test_recover_completes_partially_renamed_commit(data_path):
+    """部分文件已经重命名时，恢复跳过已完成的文件，补完其余文件"""
+    _stage_crashed_commit(data_path, renamed=1)
+
+    assert recover_pending_commit(data_path)
+    assert read_json(data_path, HISTORY)["marker"] == "committed"
+    assert read_json(data_path, BALANCE)["marker"] == "committed"
+    assert _leftovers(data_path) == []
+
+def test_open_storage_recovers_before_reading(data_path):
+    """打开存储后端时先补完中断的提交，读到的是提交后的文档"""
+    _stage_crashed_commit(data_path)
+
+    storage = open_storage(data_path)
+    try:
+        assert storage.load("combat_history")["marker"] == "committed"
+    finally:
+        storage.close()
+    assert _leftovers(data_path) == []
+
+def test_truncated_intent_is_discarded(data_path):
+    """意图文件没有写完说明提交点之前就中断了，恢复时丢弃，原文件不变"""
+    original = read_json(data_path, HISTORY)
+    intent_file = os.path.join(data_path, f"{INTENT_PREFIX}-truncated.json")
+    with open(intent_file, 'w', encoding='utf-8') as f:
+        f.write('{"renames": [["')
+
+    assert not recover_pending_commit(data_path)
+    assert not os.path.exists(intent_file)
+    assert read_json(data_path, HISTORY) == original
+
+def test_rollback_leaves_files_untouched(data_path):
+    """事务中出错时回滚，文件不变也不留下临时文件"""
+    original = read_json(data_path, HISTORY)
+    history_file = os.path.join(data_path, HISTORY)
+    try:
+        with DataTransaction(data_path) as transaction:
+            transaction.update(history_file)["marker"] = "rolled back"
+            raise RuntimeError("abort")
+    except RuntimeError:
+        pass
+
+    assert read_json(data_path, HISTORY) == original
+    assert _leftovers(data_path) == []
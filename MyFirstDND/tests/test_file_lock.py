@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 跨进程文件锁测试
+多个进程共用一个数据目录时，读-改-写不丢失更新，同一场战斗只被一个记录器结束
+"""
+
+import json
+import os
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import pytest
+
+from conftest import play_combat, read_json
+from utils.combat_recorder import CombatRecorder
+from utils.data_transaction import INTENT_PREFIX, DataTransaction, recover_pending_commit
+from utils.file_lock import FileLock, LockTimeout, hold_locks, lock_path
+
+COUNTER = "counter.json"
+
+def _increment(data_path: str, times: int) -> int:
+    """在事务中把计数器加一，重复times次(在工作进程中运行)"""
+    path = os.path.join(data_path, COUNTER)
+    for _ in range(times):
+        with DataTransaction(data_path) as transaction:
+            transaction.update(path, {"value": 0})["value"] += 1
+    return times
+
+def _end_combats(data_path: str, worker: int, count: int) -> int:
+    """在工作进程中开始并结束count场战斗，返回成功结束的场数"""
+    recorder = CombatRecorder(data_path)
+    ended = 0
+    for index in range(count):
+        combat_id = f"w{worker}_{index}"
+        play_combat(recorder, combat_id, [{"name": "哥布林"}])
+        ended += recorder.end_combat({"victory": True}, combat_id)
+    return ended
+
+def test_lock_excludes_other_holders(tmp_path):
+    """同一锁文件同时只能有一个独占持有者，等待超时抛出LockTimeout"""
+    path = str(tmp_path / ".data.json.lock")
+    with FileLock(path):
+        with pytest.raises(LockTimeout):
+            FileLock(path, timeout=0.05).acquire()
+    with FileLock(path, timeout=0.05) as lock:
+        assert lock.locked
+
+def test_hold_locks_releases_on_error(tmp_path):
+    """hold_locks出错退出时释放已经拿到的全部锁"""
+    paths = [str(tmp_path / ".a.lock"), str(tmp_path / ".b.lock")]
+    with pytest.raises(RuntimeError):
+        with hold_locks(paths):
+            raise RuntimeError("abort")
+    with hold_locks(paths, timeout=0.05):
+        pass
+
+def test_concurrent_transactions_do_not_lose_updates(tmp_path):
+    """多个进程和线程同时读-改-写同一文件，每次加一都保留下来"""
+    data_path = str(tmp_path)
+    with ProcessPoolExecutor(max_workers=4) as processes:
+        done = sum(processes.map(_increment, [data_path] * 4, [25] * 4))
+    with ThreadPoolExecutor(max_workers=4) as threads:
+        done += sum(threads.map(_increment, [data_path] * 4, [25] * 4))
+    assert done == 200
+    assert read_json(data_path, COUNTER)["value"] == 200
+
+def test_concurrent_end_combat_across_processes(data_path):
+    """多个进程同时结束各自的战斗，四个文档的统计都不丢失"""
+    before_history = read_json(data_path, "combat/combat_history.json")["statistics"].get("total_combats", 0)
+    before_player = read_json(data_path, "characters/player_character.json")["combat_history"]["total_combats"]
+
+    with ProcessPoolExecutor(max_workers=4) as processes:
+        ended = sum(processes.map(_end_combats, [data_path] * 4, range(4), [5] * 4))
+
+    assert ended == 20
+    assert read_json(data_path, "combat/combat_history.json")["statistics"]["total_combats"] == before_history + 20
+    assert read_json(data_path, "characters/player_character.json")["combat_history"]["total_combats"] == \
+        before_player + 20
+    assert os.listdir(os.path.join(data_path, "combat/journal")) == []
+    assert [name for name in os.listdir(data_path) if name.startswith(INTENT_PREFIX)] == []
+
+def test_combat_ended_by_another_recorder(data_path):
+    """另一个记录器已经结束的战斗不会被再次合并"""
+    first = CombatRecorder(data_path)
+    play_combat(first, "c1")
+    second = CombatRecorder(data_path)
+    assert second.active_combats() == ["c1"]
+    before = read_json(data_path, "combat/combat_history.json")["statistics"].get("total_combats", 0)
+
+    assert first.end_combat({"victory": True}, "c1")
+    assert not second.end_combat({"victory": True}, "c1")
+    assert second.active_combats() == []
+    assert read_json(data_path, "combat/combat_history.json")["statistics"]["total_combats"] == before + 1
+
+def test_same_combat_id_starts_once(data_path):
+    """两个记录器用同一个战斗ID开始战斗，只有先开始的成功"""
+    assert CombatRecorder(data_path).start_combat("c1")
+    assert not CombatRecorder(data_path).start_combat("c1")
+
+def test_recovery_waits_for_committing_transaction(data_path):
+    """正在提交的事务持有意图文件的锁，恢复不会动它"""
+    intent_file = os.path.join(data_path, f"{INTENT_PREFIX}-running.json")
+    with open(intent_file, 'w', encoding='utf-8') as f:
+        json.dump({"renames": []}, f)
+
+    with FileLock(lock_path(intent_file)):
+        with pytest.raises(LockTimeout):
+            recover_pending_commit(data_path, lock_timeout=0.05)
+        assert os.path.exists(intent_file)
+
+    assert recover_pending_commit(data_path)
+    assert not os.path.exists(intent_file)
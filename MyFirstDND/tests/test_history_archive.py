@@ -0,0 +1,92 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 战斗历史归档测试
+轮转进归档分段的战斗仍能按ID查找、按条件查询，也会随迁移进入SQLite
+"""
+
+import os
+
+import pytest
+
+from conftest import play_combat, read_json, write_json
+from utils.combat_recorder import CombatRecorder
+from utils.history_archive import compact_history
+from utils.sqlite_storage import SqliteStorage, migrate_json_to_sqlite
+
+def _configure(data_path: str, **settings):
+    """修改 game_config.json 中的 storage_settings"""
+    config = read_json(data_path, "config/game_config.json")
+    config.setdefault("storage_settings", {}).update(settings)
+    write_json(data_path, "config/game_config.json", config)
+
+def _play(data_path: str, count: int):
+    """依次结束count场战斗，第偶数场的敌人是哥布林，其余是狼"""
+    recorder = CombatRecorder(data_path)
+    for index in range(1, count + 1):
+        enemy = "哥布林" if index % 2 == 0 else "狼"
+        play_combat(recorder, f"c{index}", [{"name": enemy}])
+        assert recorder.end_combat({"victory": True}, f"c{index}")
+    return recorder
+
+@pytest.mark.parametrize("compression", ["gzip", "lzma"])
+def test_rotation_keeps_combats_queryable(data_path, compression):
+    """每满一段就写入归档，热文件只保留不足一段的战斗和有限的最近战斗"""
+    _configure(data_path, recent_combats_window=2, history_segment_size=2, archive_compression=compression)
+    recorder = _play(data_path, 5)
+
+    history = read_json(data_path, "combat/combat_history.json")
+    assert [c["combat_id"] for c in history["combat_sessions"]] == ["c5"]
+    assert [c["combat_id"] for c in history["recent_combats"]] == ["c4", "c5"]
+    assert [entry["combats"] for entry in history["archive_segments"]] == [2, 2]
+    for entry in history["archive_segments"]:
+        assert os.path.exists(os.path.join(data_path, entry["file"]))
+
+    storage = recorder.storage
+    assert all(storage.has_combat(f"c{index}") for index in range(1, 6))
+    assert not storage.has_combat("c6")
+    assert [c["combat_id"] for c in storage.query_combats()] == ["c1", "c2", "c3", "c4", "c5"]
+    assert [c["combat_id"] for c in storage.query_combats(enemy="哥布林")] == ["c2", "c4"]
+
+def test_zero_window_recovery_finds_archived_combat(data_path, monkeypatch):
+    """最近战斗窗口为0时，合并后已进入归档的战斗在恢复时不会被重复合并"""
+    _configure(data_path, recent_combats_window=0, history_segment_size=1)
+    recorder = CombatRecorder(data_path)
+    play_combat(recorder, "c1")
+    with monkeypatch.context() as patch:
+        # 模拟合并提交后、删除日志前崩溃
+        patch.setattr(type(recorder.session), "discard", lambda self: None)
+        assert recorder.end_combat({"victory": True})
+    total = read_json(data_path, "combat/combat_history.json")["statistics"]["total_combats"]
+
+    CombatRecorder(data_path)
+    history = read_json(data_path, "combat/combat_history.json")
+    assert history["statistics"]["total_combats"] == total
+    assert len(history["archive_segments"]) == 1
+    assert os.listdir(os.path.join(data_path, "combat/journal")) == []
+
+def test_compact_existing_history(data_path):
+    """compact把已有的长历史整理成分段，全部战斗仍能查询"""
+    _configure(data_path, recent_combats_window=100, history_segment_size=100)
+    recorder = _play(data_path, 5)
+
+    summary = compact_history(data_path, recent_window=1, segment_size=2, flush_all=True)
+    assert summary["segments_written"] == 3
+    assert summary["combats_in_hot_file"] == 0
+
+    history = read_json(data_path, "combat/combat_history.json")
+    assert [c["combat_id"] for c in history["recent_combats"]] == ["c5"]
+    assert [c["combat_id"] for c in recorder.storage.query_combats()] == ["c1", "c2", "c3", "c4", "c5"]
+
+def test_migration_includes_archived_combats(data_path):
+    """迁移到SQLite时归档分段中的战斗一并导入"""
+    _configure(data_path, recent_combats_window=1, history_segment_size=2)
+    _play(data_path, 3)
+
+    assert migrate_json_to_sqlite(data_path)["combats"] == 3
+    storage = SqliteStorage(data_path)
+    try:
+        assert [c["combat_id"] for c in storage.query_combats()] == ["c1", "c2", "c3"]
+        assert [c["combat_id"] for c in storage.query_combats(enemy="狼")] == ["c1", "c3"]
+    finally:
+        storage.close()
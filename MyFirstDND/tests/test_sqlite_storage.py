@@ -0,0 +1,107 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - SQLite存储后端测试
+把JSON中的历史战斗和会话日志迁移到SQLite后，查询结果与迁移前的JSON后端一致
+"""
+
+import os
+
+import pytest
+
+from conftest import play_combat, read_json
+from utils.combat_recorder import CombatRecorder
+from utils.sqlite_storage import SqliteStorage, main, migrate_json_to_sqlite
+from utils.storage_backend import JsonStorage, open_storage
+
+@pytest.fixture
+def history(data_path):
+    """用JSON后端记录三场战斗：两场对狼(一胜一负)，一场对哥布林"""
+    recorder = CombatRecorder(data_path)
+    for combat_id, enemy, victory in (("c1", "狼", True), ("c2", "哥布林", True), ("c3", "狼", False)):
+        play_combat(recorder, combat_id, [{"name": enemy}], rounds=2)
+        assert recorder.end_combat({"victory": victory}, combat_id)
+    recorder.storage.close()
+    return data_path
+
+def _ids(combats):
+    """按返回顺序列出战斗ID"""
+    return [c["combat_id"] for c in combats]
+
+def test_migrate_then_query(history):
+    """迁移后open_storage自动选用SQLite，按敌人、胜负、时间范围查询与JSON后端结果一致"""
+    json_storage = JsonStorage(history)
+    expected = {
+        "all": _ids(json_storage.query_combats()),
+        "wolf": _ids(json_storage.query_combats(enemy="狼")),
+        "won": _ids(json_storage.query_combats(victory=True)),
+        "limit": _ids(json_storage.query_combats(limit=2))
+    }
+    start_times = [c["start_time"] for c in json_storage.query_combats()]
+    session_logs = len(read_json(history, "adventures/adventure_log.json").get("session_logs", []))
+
+    summary = migrate_json_to_sqlite(history)
+    assert summary["combats"] == 3
+    assert summary["session_logs"] == session_logs
+    assert os.path.exists(os.path.join(history, "combat/combat_history.json.bak"))
+    # JSON文件中的战斗列表已清空，统计数据保留
+    migrated = read_json(history, "combat/combat_history.json")
+    assert migrated["combat_sessions"] == [] and migrated["recent_combats"] == []
+    assert migrated["statistics"]["total_combats"] >= 3
+
+    storage = open_storage(history)
+    try:
+        assert isinstance(storage, SqliteStorage)
+        assert _ids(storage.query_combats()) == expected["all"] == ["c1", "c2", "c3"]
+        assert _ids(storage.query_combats(enemy="狼")) == expected["wolf"] == ["c1", "c3"]
+        assert _ids(storage.query_combats(victory=True)) == expected["won"] == ["c1", "c2"]
+        assert _ids(storage.query_combats(limit=2)) == expected["limit"]
+        assert _ids(storage.query_combats(enemy="狼", since=start_times[1])) == ["c3"]
+        assert _ids(storage.query_combats(until=start_times[1])) == ["c1"]
+        assert _ids(storage.query_combats(latest=2)) == ["c2", "c3"]
+
+        combat = storage.query_combats(enemy="哥布林", include_rounds=True)[0]
+        assert combat["enemies"][0]["name"] == "哥布林"
+        assert len(combat["rounds"]) == 2
+        assert "rounds" not in storage.query_combats(enemy="哥布林")[0]
+
+        assert storage.has_combat("c2")
+        assert _ids(storage.load("combat_history")["recent_combats"]) == ["c1", "c2", "c3"]
+        assert len(storage.load("adventure_log")["session_logs"]) == len(storage.load_session_logs())
+    finally:
+        storage.close()
+
+def test_combats_after_migration_go_to_sqlite(history):
+    """迁移后结束的战斗写入数据库，JSON文件中不再保存战斗列表"""
+    migrate_json_to_sqlite(history, keep_backup=False)
+
+    recorder = CombatRecorder(history)
+    assert isinstance(recorder.storage, SqliteStorage)
+    play_combat(recorder, "c4", [{"name": "狼"}])
+    assert recorder.end_combat({"victory": True})
+
+    assert _ids(recorder.storage.query_combats(enemy="狼")) == ["c1", "c3", "c4"]
+    assert read_json(history, "combat/combat_history.json")["combat_sessions"] == []
+    recorder.storage.close()
+
+def test_migrate_twice_keeps_combats_once(history):
+    """重复迁移不会重复导入战斗"""
+    migrate_json_to_sqlite(history)
+    summary = migrate_json_to_sqlite(history)
+    assert summary["combats"] == 0
+
+    storage = SqliteStorage(history)
+    try:
+        assert _ids(storage.query_combats()) == ["c1", "c2", "c3"]
+    finally:
+        storage.close()
+
+def test_command_line_migrate_and_query(history, capsys):
+    """命令行迁移后按敌人查询，每行输出一场战斗"""
+    assert main(["--data-path", history, "migrate"]) == 0
+    capsys.readouterr()
+
+    assert main(["--data-path", history, "query", "--enemy", "狼", "--victory", "no"]) == 0
+    lines = capsys.readouterr().out.splitlines()
+    assert len(lines) == 1
+    assert '"combat_id":"c3"' in lines[0].replace(" ", "")
@@ -5,16 +5,17 @@ DND跑团库 - AI指令加载器
 让AI自动获取系统指令和配置
 """
 
-import json
-import os
-from typing import Dict, List
+import copy
+from typing import Dict, List, Optional
+from .storage_backend import StorageBackend, open_storage
 
 class AIInstructionLoader:
     """AI指令加载器 - 为AI提供系统指令"""
     
-    def __init__(self, data_path: str = "."):
-        """初始化加载器"""
+    def __init__(self, data_path: str = ".", storage: Optional[StorageBackend] = None):
+        """初始化加载器(storage不指定时按数据目录自动选择存储后端)"""
         self.data_path = data_path
+        self.storage = storage or open_storage(data_path)
         
     def get_system_instructions(self) -> str:
         """获取系统指令"""
@@ -63,10 +64,10 @@ class AIInstructionLoader:
     def get_character_data(self) -> Dict:
         """获取角色数据"""
         try:
-            character_file = os.path.join(self.data_path, "characters/player_character.json")
-            if os.path.exists(character_file):
-                with open(character_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            document = self.storage.load("player_character")
+            if document is not None:
+                # 共享缓存中的文档不能交给调用方修改，返回独立的副本
+                return copy.deepcopy(document)
             else:
                 return {"error": "角色文件未找到"}
         except Exception as e:
@@ -75,10 +76,10 @@ class AIInstructionLoader:
     def get_combat_history(self) -> Dict:
         """获取战斗历史"""
         try:
-            combat_file = os.path.join(self.data_path, "combat/combat_history.json")
-            if os.path.exists(combat_file):
-                with open(combat_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            document = self.storage.load("combat_history")
+            if document is not None:
+                # 共享缓存中的文档不能交给调用方修改，返回独立的副本
+                return copy.deepcopy(document)
             else:
                 return {"error": "战斗历史文件未找到"}
         except Exception as e:
@@ -87,10 +88,10 @@ class AIInstructionLoader:
     def get_equipment_database(self) -> Dict:
         """获取装备数据库"""
         try:
-            equipment_file = os.path.join(self.data_path, "items/equipment_database.json")
-            if os.path.exists(equipment_file):
-                with open(equipment_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            document = self.storage.load("equipment_database")
+            if document is not None:
+                # 共享缓存中的文档不能交给调用方修改，返回独立的副本
+                return copy.deepcopy(document)
             else:
                 return {"error": "装备数据库文件未找到"}
         except Exception as e:
@@ -99,10 +100,10 @@ class AIInstructionLoader:
     def get_monster_manual(self) -> Dict:
         """获取怪物图鉴"""
         try:
-            monster_file = os.path.join(self.data_path, "monsters/monster_manual.json")
-            if os.path.exists(monster_file):
-                with open(monster_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            document = self.storage.load("monster_manual")
+            if document is not None:
+                # 共享缓存中的文档不能交给调用方修改，返回独立的副本
+                return copy.deepcopy(document)
             else:
                 return {"error": "怪物图鉴文件未找到"}
         except Exception as e:
@@ -111,10 +112,10 @@ class AIInstructionLoader:
     def get_adventure_log(self) -> Dict:
         """获取冒险日志"""
         try:
-            adventure_file = os.path.join(self.data_path, "adventures/adventure_log.json")
-            if os.path.exists(adventure_file):
-                with open(adventure_file, 'r', encoding='utf-8') as f:
-                    return json.load(f)
+            document = self.storage.load("adventure_log")
+            if document is not None:
+                # 共享缓存中的文档不能交给调用方修改，返回独立的副本
+                return copy.deepcopy(document)
             else:
                 return {"error": "冒险日志文件未找到"}
         except Exception as e:
@@ -122,31 +123,21 @@ class AIInstructionLoader:
     
     def get_system_status(self) -> Dict:
         """获取系统状态摘要"""
-        status = {
-            "character_loaded": False,
-            "combat_history_loaded": False,
-            "equipment_loaded": False,
-            "monsters_loaded": False,
-            "adventure_loaded": False
+        # 检查各个组件(只检查能否读取，不复制文档)
+        return {
+            "character_loaded": self._loaded("player_character"),
+            "combat_history_loaded": self._loaded("combat_history"),
+            "equipment_loaded": self._loaded("equipment_database"),
+            "monsters_loaded": self._loaded("monster_manual"),
+            "adventure_loaded": self._loaded("adventure_log")
         }
-        
-        # 检查各个组件
-        if not self.get_character_data().get("error"):
-            status["character_loaded"] = True
-        
-        if not self.get_combat_history().get("error"):
-            status["combat_history_loaded"] = True
-        
-        if not self.get_equipment_database().get("error"):
-            status["equipment_loaded"] = True
-        
-        if not self.get_monster_manual().get("error"):
-            status["monsters_loaded"] = True
-        
-        if not self.get_adventure_log().get("error"):
-            status["adventure_loaded"] = True
-        
-        return status
+    
+    def _loaded(self, name: str) -> bool:
+        """文档能否正常读取"""
+        try:
+            return self.storage.load(name) is not None
+        except Exception:
+            return False
     
     def format_options_with_numbers(self, options: List[str]) -> str:
         """格式化选项，添加序号"""
@@ -0,0 +1,93 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 异步I/O支持
+供异步服务调用的阻塞磁盘操作统一交给有界线程池执行，
+同一文件的并发写入合并成一批，由一个执行器任务一次写完
+"""
+
+import asyncio
+import functools
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Hashable, List, Optional
+
+# 默认的磁盘I/O线程数
+DEFAULT_MAX_WORKERS = 4
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor() -> ThreadPoolExecutor:
+    """获取共享的I/O线程池(按需创建)"""
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=DEFAULT_MAX_WORKERS, thread_name_prefix="dnd-io")
+    return _executor
+
+def configure_executor(max_workers: int = DEFAULT_MAX_WORKERS) -> ThreadPoolExecutor:
+    """替换共享的I/O线程池(已提交的任务在旧线程池中执行完)"""
+    global _executor
+    with _executor_lock:
+        previous = _executor
+        _executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="dnd-io")
+    if previous is not None:
+        previous.shutdown(wait=False)
+    return _executor
+
+async def run_blocking(func: Callable, *args, **kwargs) -> Any:
+    """在共享线程池中执行阻塞函数，不占用事件循环线程"""
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), functools.partial(func, *args, **kwargs))
+
+class WriteCoalescer:
+    """按键(通常是文件)合并并发写入
+
+    同一个键同时只有一个执行器任务；任务执行期间到达的请求排队，
+    下一轮作为一批交给batch_func一次处理。batch_func接收请求列表，返回等长的结果列表
+    """
+    
+    def __init__(self):
+        """初始化合并器(只在事件循环线程中使用)"""
+        self._pending = {}
+        self._running = set()
+    
+    async def submit(self, key: Hashable, batch_func: Callable[[List[Any]], List[Any]], item: Any) -> Any:
+        """提交一个写入请求，返回batch_func为它给出的结果"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.setdefault(key, []).append((batch_func, item, future))
+        if key not in self._running:
+            self._running.add(key)
+            loop.create_task(self._drain(key))
+        return await future
+    
+    async def _drain(self, key: Hashable):
+        """逐批处理某个键的积压请求，直到没有新请求"""
+        try:
+            while self._pending.get(key):
+                batch = self._pending.pop(key)
+                batch_func = batch[0][0]
+                try:
+                    results = await run_blocking(batch_func, [item for _func, item, _future in batch])
+                except Exception as e:
+                    for _func, _item, future in batch:
+                        if not future.done():
+                            future.set_exception(e)
+                    continue
+                for (_func, _item, future), result in zip(batch, results):
+                    if not future.done():
+                        future.set_result(result)
+        finally:
+            self._running.discard(key)
+    
+    def pending(self, key: Optional[Hashable] = None) -> int:
+        """排队中的请求数"""
+        if key is not None:
+            return len(self._pending.get(key, []))
+        return sum(len(batch) for batch in self._pending.values())
+
+# 进程内共享的合并器：不同对象写同一文件时也合并到同一批
+write_coalescer = WriteCoalescer()
@@ -5,48 +5,79 @@ DND跑团库 - 自动化战斗系统
 整合战斗记录器和战利品管理器，提供完整的自动化战斗体验
 """
 
-import json
 import os
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, List, Optional, Union
+from .async_io import run_blocking
 from .combat_recorder import CombatRecorder
+from .data_store import derived
+from .encounter_simulator import EncounterSimulator
 from .loot_manager import LootManager
-from rules.dice_roller import DiceRoller
+from .models import Character, CombatAction, CombatRound
+from .storage_backend import open_storage
+from rules.dice_roller import DiceRoller, get_registry
+from rules.rng_streams import SeedSequence, as_seed_sequence
 
 class AutoCombatSystem:
     """自动化战斗系统 - 整合所有战斗相关功能"""
     
-    def __init__(self, data_path: str = "."):
-        """初始化系统"""
+    def __init__(self, data_path: str = ".", seed: Union[None, int, Dict, SeedSequence] = None):
+        """初始化系统
+
+        seed: 可选的根种子；每场战斗从中派生独立的随机数流，种子会写入战斗记录
+        """
         self.data_path = data_path
-        self.combat_recorder = CombatRecorder(data_path)
-        self.loot_manager = LootManager(data_path)
-        self.dice_roller = DiceRoller()
+        self.storage = open_storage(data_path)
+        self.combat_recorder = CombatRecorder(data_path, storage=self.storage)
+        self.loot_manager = LootManager(data_path, storage=self.storage)
+        self.encounter_simulator = EncounterSimulator(data_path)
+        self.seed_sequence = as_seed_sequence(seed)
+        self.dice_roller = get_registry().register(DiceRoller(seed=self.seed_sequence))
+        # 进行中战斗各自的骰子系统(combat_id -> DiceRoller)，多场战斗交替进行时随机数流互不干扰
+        self.combat_rollers = {}
         
     def start_combat(self, enemies: List[Dict], environment: Dict = None) -> str:
-        """开始新战斗"""
+        """开始新战斗，返回战斗ID(同时进行多场战斗时，后续调用用它指定战斗)"""
         try:
             # 创建战斗记录
-            combat_id = f"combat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+            combat_id = f"combat_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+            
+            # 每场战斗使用独立派生的随机数流，记录种子以便重放
+            roller = get_registry().register(DiceRoller(seed=self.seed_sequence.spawn(1)[0]))
+            self.dice_roller = roller
+            rng_seed = roller.seed_record()
+            player_hp = self._get_player_hp()
+            
+            # 敌人没有给出生命值时从怪物图鉴补全，便于会话跟踪双方生命值；
+            # 图鉴中没有的敌人(自定义NPC)不编造生命值，会话按未知生命值跟踪
+            tracked_enemies = []
+            for enemy in enemies:
+                enemy = dict(enemy)
+                if "hit_points" not in enemy:
+                    monster = self.encounter_simulator.find_monster_model(enemy.get("id", enemy.get("name", "")))
+                    if monster is not None:
+                        enemy["hit_points"] = monster.hit_points
+                tracked_enemies.append(enemy)
+            if not self.combat_recorder.start_combat(combat_id, tracked_enemies, rng_seed, player_hp):
+                return None
+            self.combat_rollers[combat_id] = roller
             
             # 初始化战斗数据
             combat_data = {
                 "combat_id": combat_id,
                 "start_time": datetime.now().isoformat(),
+                "rng_seed": rng_seed,
                 "enemies": enemies,
                 "environment": environment or {},
                 "rounds": [],
                 "current_round": 0,
-                "player_hp_start": self._get_player_hp(),
-                "player_hp_current": self._get_player_hp()
+                "player_hp_start": player_hp,
+                "player_hp_current": player_hp
             }
             
             # 记录战斗开始
-            self.combat_recorder.record_combat_round({
-                "round": 0,
-                "type": "combat_start",
-                "data": combat_data
-            })
+            self.combat_recorder.record_combat_round(
+                CombatRound(0, "combat_start", extra={"data": combat_data}), combat_id)
             
             return combat_id
             
@@ -54,101 +85,101 @@ class AutoCombatSystem:
             print(f"开始战斗时出错: {e}")
             return None
     
-    def record_player_action(self, action: Dict) -> bool:
-        """记录玩家行动"""
+    def record_player_action(self, action: Dict, combat_id: Optional[str] = None) -> bool:
+        """记录玩家行动(不指定combat_id时记录到最近开始的战斗)"""
         try:
-            round_data = {
-                "round": action.get("round", 1),
-                "type": "player_action",
-                "player_action": action,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            return self.combat_recorder.record_combat_round(round_data)
+            return self.combat_recorder.record_combat_round(self._player_round(action), combat_id)
             
         except Exception as e:
             print(f"记录玩家行动时出错: {e}")
             return False
     
-    def record_enemy_action(self, enemy_name: str, action: Dict) -> bool:
-        """记录敌人行动"""
+    def record_enemy_action(self, enemy_name: str, action: Dict, combat_id: Optional[str] = None) -> bool:
+        """记录敌人行动(不指定combat_id时记录到最近开始的战斗)"""
         try:
-            round_data = {
-                "round": action.get("round", 1),
-                "type": "enemy_action",
-                "enemy_name": enemy_name,
-                "enemy_action": action,
-                "timestamp": datetime.now().isoformat()
-            }
-            
-            return self.combat_recorder.record_combat_round(round_data)
+            return self.combat_recorder.record_combat_round(self._enemy_round(enemy_name, action), combat_id)
             
         except Exception as e:
             print(f"记录敌人行动时出错: {e}")
             return False
     
-    def end_combat(self, result: Dict) -> bool:
-        """结束战斗"""
+    def end_combat(self, result: Dict, combat_id: Optional[str] = None) -> bool:
+        """结束战斗(不指定combat_id时结束最近开始的战斗)"""
         try:
             # 计算最终统计数据
-            final_result = self._calculate_combat_result(result)
+            final_result = self._calculate_combat_result(result, combat_id)
+            self.combat_rollers.pop(final_result.get("combat_id"), None)
             
             # 记录战斗结束
-            self.combat_recorder.record_combat_round({
-                "round": result.get("final_round", 1),
-                "type": "combat_end",
-                "result": final_result,
-                "timestamp": datetime.now().isoformat()
-            })
+            self.combat_recorder.record_combat_round(self._end_round(result, final_result), combat_id)
             
             # 结束战斗并更新所有相关数据
-            return self.combat_recorder.end_combat(final_result)
+            return self.combat_recorder.end_combat(final_result, combat_id)
             
         except Exception as e:
             print(f"结束战斗时出错: {e}")
             return False
     
-    def _calculate_combat_result(self, result: Dict) -> Dict:
-        """计算战斗结果统计"""
+    def _player_round(self, action: Dict) -> CombatRound:
+        """玩家行动的回合记录"""
+        return CombatRound(action.get("round", 1), "player_action", CombatAction.from_dict(action),
+                           timestamp=datetime.now().isoformat())
+    
+    def _enemy_round(self, enemy_name: str, action: Dict) -> CombatRound:
+        """敌人行动的回合记录"""
+        return CombatRound(action.get("round", 1), "enemy_action", CombatAction.from_dict(action),
+                           enemy_name=enemy_name, timestamp=datetime.now().isoformat())
+    
+    def _end_round(self, result: Dict, final_result: Dict) -> CombatRound:
+        """战斗结束的回合记录"""
+        return CombatRound(result.get("final_round", 1), "combat_end", timestamp=datetime.now().isoformat(),
+                           extra={"result": final_result})
+    
+    async def start_combat_async(self, enemies: List[Dict], environment: Dict = None) -> str:
+        """start_combat的异步版本(读取角色数据和写日志头在线程池中执行)"""
+        return await run_blocking(self.start_combat, enemies, environment)
+    
+    async def record_player_action_async(self, action: Dict, combat_id: Optional[str] = None) -> bool:
+        """record_player_action的异步版本"""
+        return await self.combat_recorder.record_combat_round_async(self._player_round(action), combat_id)
+    
+    async def record_enemy_action_async(self, enemy_name: str, action: Dict, combat_id: Optional[str] = None) -> bool:
+        """record_enemy_action的异步版本"""
+        return await self.combat_recorder.record_combat_round_async(self._enemy_round(enemy_name, action),
+                                                                     combat_id)
+    
+    async def end_combat_async(self, result: Dict, combat_id: Optional[str] = None) -> bool:
+        """end_combat的异步版本：并发结束的战斗合并成一次提交，不阻塞事件循环"""
         try:
-            # 获取战斗数据
-            combat_history = self.combat_recorder.combat_history_file
-            if os.path.exists(combat_history):
-                with open(combat_history, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                    current_combat = data.get("current_combat", {})
-            else:
-                current_combat = {}
-            
-            rounds = current_combat.get("rounds", [])
-            
-            # 计算统计数据
-            player_damage_dealt = 0
-            enemy_damage_dealt = 0
-            total_rounds = len([r for r in rounds if r.get("type") in ["player_action", "enemy_action"]])
+            final_result = self._calculate_combat_result(result, combat_id)
+            self.combat_rollers.pop(final_result.get("combat_id"), None)
+            await self.combat_recorder.record_combat_round_async(self._end_round(result, final_result), combat_id)
+            return await self.combat_recorder.end_combat_async(final_result, combat_id)
             
-            # 分析每回合数据
-            for round_data in rounds:
-                if round_data.get("type") == "player_action":
-                    action = round_data.get("player_action", {})
-                    if action.get("type") == "attack" and action.get("hit"):
-                        player_damage_dealt += action.get("damage", 0)
-                        
-                elif round_data.get("type") == "enemy_action":
-                    action = round_data.get("enemy_action", {})
-                    if action.get("type") == "attack" and action.get("hit"):
-                        enemy_damage_dealt += action.get("damage", 0)
+        except Exception as e:
+            print(f"结束战斗时出错: {e}")
+            return False
+    
+    async def add_loot_async(self, loot_items: List[Dict]) -> bool:
+        """把战利品加入角色装备(异步，并发请求合并写入)"""
+        return await self.loot_manager.add_loot_async(loot_items)
+    
+    def _calculate_combat_result(self, result: Dict, combat_id: Optional[str] = None) -> Dict:
+        """计算战斗结果统计"""
+        try:
+            # 战斗中逐个行动累计的统计，无需重新扫描回合
+            stats = self.combat_recorder.get_live_stats(combat_id) or {}
             
             # 构建结果
             final_result = {
                 "victory": result.get("victory", False),
-                "rounds": total_rounds,
-                "player_damage_dealt": player_damage_dealt,
-                "enemy_damage_dealt": enemy_damage_dealt,
+                "total_actions": stats.get("total_actions", 0),
+                "player_damage_dealt": stats.get("player_damage_dealt", 0),
+                "enemy_damage_dealt": stats.get("enemy_damage_dealt", 0),
                 "enemies_defeated": result.get("enemies_defeated", []),
                 "loot_gained": result.get("loot_gained", []),
                 "summary": result.get("summary", ""),
-                "combat_id": current_combat.get("combat_id", "unknown")
+                "combat_id": stats.get("combat_id", "unknown")
             }
             
             return final_result
@@ -157,15 +188,30 @@ class AutoCombatSystem:
             print(f"计算战斗结果时出错: {e}")
             return result
     
-    def _get_player_hp(self) -> int:
-        """获取玩家当前生命值"""
+    def get_combat_stats(self, combat_id: Optional[str] = None) -> Optional[Dict]:
+        """进行中战斗的实时统计(伤害、命中、重击、回合和双方生命值)，供实时面板和AI提示使用"""
+        return self.combat_recorder.get_live_stats(combat_id)
+    
+    def replay_roller(self, combat_data: Dict) -> DiceRoller:
+        """根据战斗记录中的种子重建该场战斗的骰子系统"""
+        return DiceRoller.from_seed_record(combat_data["rng_seed"])
+    
+    def _get_player_hp(self, combat_id: Optional[str] = None) -> int:
+        """获取玩家当前生命值(战斗中直接取内存会话中的实时值)"""
+        recorder = self.combat_recorder
+        session = recorder.sessions.get(combat_id if combat_id is not None else recorder.current_combat_id)
+        if session is not None and session.player_hp is not None:
+            return session.player_hp
         try:
-            with open(self.combat_recorder.player_character_file, 'r', encoding='utf-8') as f:
-                player_data = json.load(f)
-                return player_data.get("combat_stats", {}).get("hit_points", {}).get("current", 12)
+            hit_points = self._player().hit_points
+            return hit_points if hit_points is not None else 12
         except:
             return 12
     
+    def _player(self) -> Character:
+        """角色数据的只读模型(角色文件未变化时不重建)"""
+        return derived(self.storage.load("player_character", {}), Character.from_dict)
+    
     def auto_loot_distribution(self, combat_performance: Dict, player_level: int) -> List[Dict]:
         """自动战利品分配"""
         try:
@@ -232,24 +278,37 @@ class AutoCombatSystem:
             # 记录玩家行动
             for i, action in enumerate(player_actions, 1):
                 action["round"] = i
-                self.record_player_action(action)
+                self.record_player_action(action, combat_id)
             
             # 模拟敌人行动
+            player_ac = self._get_player_ac()
+            player_hp = self._get_player_hp(combat_id)
+            damage_taken = 0
             for i, enemy in enumerate(enemies):
-                enemy_action = self._simulate_enemy_action(enemy, i+1)
-                self.record_enemy_action(enemy["name"], enemy_action)
+                enemy_action = self._simulate_enemy_action(enemy, i+1, player_ac, combat_id)
+                damage_taken += enemy_action["damage"]
+                self.record_enemy_action(enemy["name"], enemy_action, combat_id)
             
-            # 计算结果
+            # 计算结果(取会话中累计的统计)
+            stats = self.get_combat_stats(combat_id) or {}
+            attacks = stats.get("player_attacks", 0)
+            performance = {
+                "round_count": len(player_actions),
+                "player_damage_dealt": stats.get("player_damage_dealt", 0),
+                "player_damage_taken": damage_taken,
+                "hit_rate": stats.get("player_hits", 0) / attacks if attacks else 0.0
+            }
+            victory = player_hp > damage_taken
             result = {
-                "victory": True,  # 简化版本，假设玩家获胜
+                "victory": victory,
                 "final_round": len(player_actions),
-                "enemies_defeated": [e["name"] for e in enemies],
-                "loot_gained": self.auto_loot_distribution({"round_count": len(player_actions)}, 1),
-                "summary": f"击败了{len(enemies)}个敌人"
+                "enemies_defeated": [e["name"] for e in enemies] if victory else [],
+                "loot_gained": self.auto_loot_distribution(performance, 1) if victory else [],
+                "summary": f"击败了{len(enemies)}个敌人" if victory else f"被{len(enemies)}个敌人击倒"
             }
             
             # 结束战斗
-            self.end_combat(result)
+            self.end_combat(result, combat_id)
             
             return result
             
@@ -257,17 +316,34 @@ class AutoCombatSystem:
             print(f"快速战斗时出错: {e}")
             return {"error": str(e)}
     
-    def _simulate_enemy_action(self, enemy: Dict, round_num: int) -> Dict:
-        """模拟敌人行动"""
-        # 简化的敌人AI
+    def _simulate_enemy_action(self, enemy: Dict, round_num: int, player_ac: int,
+                               combat_id: Optional[str] = None) -> Dict:
+        """模拟敌人行动：使用怪物图鉴中的攻击加值和伤害进行真实的攻击检定"""
+        combatant = self.encounter_simulator.enemy_combatant(enemy, player_ac)
+        roller = self.combat_rollers.get(combat_id, self.dice_roller)
+        attack = roller.roll_attack(combatant["attack_bonus"], player_ac,
+                                    combatant.get("advantage", "none"), combatant["damage"])
         return {
             "round": round_num,
             "type": "attack",
             "target": "player",
-            "attack_roll": self.dice_roller.roll_d20(),
-            "damage": 0,  # 简化版本
-            "hit": False
+            "action": combatant["action"],
+            "attack_roll": attack["d20_result"],
+            "attack_total": attack["attack_total"],
+            "damage": attack["damage"]["total"] if attack["damage"] else 0,
+            "hit": attack["hit"]
         }
+    
+    def _get_player_ac(self) -> int:
+        """获取玩家护甲等级"""
+        try:
+            return self._player().armor_class
+        except:
+            return 10
+    
+    def simulate_encounter(self, enemies: List[Union[str, Dict]], n: int = 10000) -> Dict:
+        """在开战前用蒙特卡洛模拟评估遭遇战，随机数流从本系统的种子派生"""
+        return self.encounter_simulator.simulate(enemies, n, seed=self.seed_sequence.spawn(1)[0])
 
 # 便捷函数
 def start_combat(enemies: List[Dict]) -> str:
@@ -275,15 +351,18 @@ def start_combat(enemies: List[Dict]) -> str:
     system = AutoCombatSystem()
     return system.start_combat(enemies)
 
-def record_player_action(action: Dict) -> bool:
-    """记录玩家行动"""
+def record_player_action(action: Dict, combat_id: Optional[str] = None) -> bool:
+    """记录玩家行动(不指定combat_id时记录到最近开始的战斗)"""
     system = AutoCombatSystem()
-    return system.record_player_action(action)
+    recorded = system.record_player_action(action, combat_id)
+    # 临时系统不会再被使用，立即写入日志
+    system.combat_recorder.flush(combat_id=combat_id)
+    return recorded
 
-def end_combat(result: Dict) -> bool:
-    """结束战斗"""
+def end_combat(result: Dict, combat_id: Optional[str] = None) -> bool:
+    """结束战斗(不指定combat_id时结束最近开始的战斗)"""
     system = AutoCombatSystem()
-    return system.end_combat(result)
+    return system.end_combat(result, combat_id)
 
 def quick_combat(enemies: List[Dict], player_actions: List[Dict]) -> Dict:
     """快速战斗模式"""
@@ -8,6 +8,7 @@ DND跑团库 - 平衡性调整器
 import json
 import os
 from typing import Dict, List
+from .models import Monster
 
 class BalanceAdjuster:
     """平衡性调整器"""
@@ -179,6 +180,58 @@ class BalanceAdjuster:
         
         return modifications
     
+    def estimate_encounter_difficulty(self, player: Dict, enemies: List[Dict]) -> Dict:
+        """用精确期望伤害估算遭遇战难度，无需蒙特卡洛模拟
+        
+        player: {"armor_class", "hit_points", "attack_bonus", "damage", "advantage"}
+        enemies: [{"name", "armor_class", "hit_points", "attack_bonus", "damage", "advantage"}]
+        玩家按顺序逐个击倒敌人，存活的敌人每回合都会攻击玩家
+        """
+        from rules.dice_probability import expected_attack
+        
+        player_ac = player.get("armor_class", 10)
+        player_hp = max(Monster.parse_hit_points(player.get("hit_points", 1))[0], 1)
+        
+        estimates = []
+        for enemy in enemies:
+            player_attack = expected_attack(player.get("attack_bonus", 0), enemy.get("armor_class", 10),
+                                            player.get("damage", "1d4"), player.get("advantage", "none"))
+            enemy_attack = expected_attack(enemy.get("attack_bonus", 0), player_ac,
+                                           enemy.get("damage", "1d4"), enemy.get("advantage", "none"))
+            hit_points = Monster.parse_hit_points(enemy.get("hit_points", 1))[0]
+            estimates.append({
+                "name": enemy.get("name", "未知敌人"),
+                "rounds_to_defeat": hit_points / max(player_attack["expected_damage"], 0.01),
+                "damage_per_round": enemy_attack["expected_damage"],
+                "player_hit_chance": player_attack["hit_chance"],
+                "enemy_hit_chance": enemy_attack["hit_chance"]
+            })
+        
+        expected_rounds = 0.0
+        expected_damage_taken = 0.0
+        for i, estimate in enumerate(estimates):
+            alive_damage = sum(e["damage_per_round"] for e in estimates[i:])
+            expected_rounds += estimate["rounds_to_defeat"]
+            expected_damage_taken += estimate["rounds_to_defeat"] * alive_damage
+        
+        damage_ratio = expected_damage_taken / player_hp
+        if damage_ratio < 0.3:
+            difficulty = "easy"
+        elif damage_ratio < 0.6:
+            difficulty = "normal"
+        elif damage_ratio < 1.0:
+            difficulty = "hard"
+        else:
+            difficulty = "deadly"
+        
+        return {
+            "expected_rounds": expected_rounds,
+            "expected_damage_taken": expected_damage_taken,
+            "hp_fraction_lost": damage_ratio,
+            "estimated_difficulty": difficulty,
+            "enemies": estimates
+        }
+    
     def generate_balance_report(self, combat_data: List[Dict]) -> str:
         """生成平衡性报告"""
         if not combat_data:
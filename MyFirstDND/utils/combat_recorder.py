@@ -5,102 +5,393 @@ DND跑团库 - 战斗记录器
 自动记录战斗数据并更新相关文件
 """
 
-import json
 import os
+import threading
 from datetime import datetime
-from typing import Dict, List
+from typing import Dict, List, Optional, Union
 from rules.dice_roller import DiceRoller
+from .async_io import run_blocking, write_coalescer
+from .combat_session import DEFAULT_FLUSH_ROUNDS, DEFAULT_FLUSH_SECONDS, CombatSession
+from .file_lock import FileLock, hold_locks, record_lock, record_lock_path
+from .history_archive import storage_settings
+from .models import CombatRound
+from .storage_backend import StorageBackend, StorageTransaction, open_storage
 
 class CombatRecorder:
     """战斗记录器 - 自动记录和更新战斗数据"""
     
-    def __init__(self, data_path: str = "."):
-        """初始化记录器"""
+    def __init__(self, data_path: str = ".", flush_every_rounds: int = DEFAULT_FLUSH_ROUNDS,
+                 flush_every_seconds: Optional[float] = DEFAULT_FLUSH_SECONDS,
+                 storage: Optional[StorageBackend] = None):
+        """初始化记录器
+
+        flush_every_rounds / flush_every_seconds: 进行中的战斗写入日志的策略，
+        战斗结束时总是强制写入并同步到磁盘
+        storage: 存储后端，不指定时按数据目录自动选择(见 open_storage)
+        """
         self.data_path = data_path
-        self.combat_history_file = os.path.join(data_path, "combat/combat_history.json")
-        self.player_character_file = os.path.join(data_path, "characters/player_character.json")
-        self.balance_analysis_file = os.path.join(data_path, "combat/balance_analysis.json")
-        self.adventure_log_file = os.path.join(data_path, "adventures/adventure_log.json")
-        
-    def record_combat_round(self, round_data: Dict) -> bool:
-        """记录单回合战斗数据"""
+        # open_storage 会先补完上次中断的提交，之后才能按战斗历史判断哪些战斗已经合并
+        self.storage = storage or open_storage(data_path)
+        # 进行中的战斗保存在内存会话中，按策略追加到 combat/journal/<combat_id>.jsonl，结束时才合并进历史
+        self.journal_dir = os.path.join(data_path, "combat/journal")
+        self.flush_policy = {"flush_every_rounds": flush_every_rounds, "flush_every_seconds": flush_every_seconds}
+        # 开始、结束和恢复一场战斗时持有它的记录锁，多个进程不会重复合并同一场战斗
+        self.lock_timeout = storage_settings(data_path)["lock_timeout"]
+        # 战斗登记表：combat_id -> 进行中的会话，每场战斗有独立的日志文件和锁，可以在不同线程中并行记录
+        self.sessions = {}
+        self._current_id = None
+        self._registry_lock = threading.Lock()
+        self.recover()
+    
+    @property
+    def current_combat_id(self) -> Optional[str]:
+        """最近开始的进行中战斗的ID(调用时不指定combat_id就作用于这场战斗)"""
+        return self._current_id
+    
+    @property
+    def session(self) -> Optional[CombatSession]:
+        """最近开始的进行中战斗的会话"""
+        return self.sessions.get(self._current_id) if self._current_id is not None else None
+    
+    def active_combats(self) -> List[str]:
+        """全部进行中战斗的ID(按开始顺序)"""
+        with self._registry_lock:
+            return list(self.sessions)
+    
+    def get_session(self, combat_id: Optional[str] = None) -> Optional[CombatSession]:
+        """按战斗ID取进行中的会话，不指定时取最近开始的战斗
+
+        登记表中没有的战斗(由其他记录器或进程开始)从它的日志载入
+        """
+        with self._registry_lock:
+            if combat_id is None:
+                combat_id = self._current_id
+                if combat_id is None:
+                    return None
+            session = self.sessions.get(combat_id)
+            if session is None:
+                path = self._journal_path(combat_id)
+                if os.path.exists(path):
+                    session = CombatSession.load(path, **self.flush_policy)
+                    if session is None or session.result is not None:
+                        return None
+                    self.sessions[combat_id] = session
+            return session
+    
+    def _combat_lock(self, combat_id: str) -> FileLock:
+        """单场战斗的跨进程记录锁"""
+        return record_lock(self.data_path, "combat", combat_id, self.lock_timeout)
+    
+    def _release(self, session: CombatSession):
+        """把已结束的战斗移出登记表"""
+        with self._registry_lock:
+            if self.sessions.get(session.combat_id) is session:
+                del self.sessions[session.combat_id]
+            if self._current_id == session.combat_id:
+                # 回到仍在进行的最近一场战斗
+                self._current_id = next(reversed(list(self.sessions)), None)
+    
+    def _restore(self, session: CombatSession):
+        """提交失败时把战斗放回登记表，调用方可以重试结束(不抢占期间开始的新战斗)"""
+        with self._registry_lock:
+            self.sessions.setdefault(session.combat_id, session)
+            if self._current_id is None:
+                self._current_id = session.combat_id
+    
+    def start_combat(self, combat_id: str, enemies: List[Dict] = None, rng_seed: Dict = None,
+                     player_hp: int = None) -> bool:
+        """开始新战斗，记录战斗ID和随机数种子(用于逐位重放)
+
+        已有的进行中战斗不受影响，各自按战斗ID继续记录
+        """
         try:
-            # 加载战斗历史
-            if os.path.exists(self.combat_history_file):
-                with open(self.combat_history_file, 'r', encoding='utf-8') as f:
-                    combat_history = json.load(f)
-            else:
-                combat_history = {"combat_sessions": [], "statistics": {}}
-            
-            # 添加回合数据
-            if "current_combat" not in combat_history:
-                combat_history["current_combat"] = {
-                    "combat_id": f"combat_{datetime.now().strftime('%Y%m%d_%H%M%S')}",
-                    "start_time": datetime.now().isoformat(),
-                    "rounds": [],
-                    "enemies": [],
-                    "loot_gained": []
-                }
+            with self._combat_lock(combat_id), self._registry_lock:
+                if combat_id in self.sessions:
+                    raise ValueError(f"战斗已存在: {combat_id}")
+                # 日志文件独占创建，其他进程已开始同ID的战斗时失败
+                self.sessions[combat_id] = CombatSession.create(combat_id, self._journal_path(combat_id), enemies,
+                                                                rng_seed, player_hp, **self.flush_policy)
+                self._current_id = combat_id
+            return True
             
-            combat_history["current_combat"]["rounds"].append(round_data)
+        except Exception as e:
+            print(f"开始战斗时出错: {e}")
+            return False
+    
+    def _session_for_round(self, combat_id: Optional[str]) -> Optional[CombatSession]:
+        """取要记录回合的会话，战斗不存在时自动创建(未指定ID时生成新ID)"""
+        session = self.get_session(combat_id)
+        if session is None:
+            if combat_id is None:
+                combat_id = f"combat_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+            if self.start_combat(combat_id):
+                session = self.sessions.get(combat_id)
+        return session
+    
+    def record_combat_round(self, round_data: Union[Dict, CombatRound], combat_id: Optional[str] = None) -> bool:
+        """记录单回合战斗数据(只写入内存会话，按策略批量写入日志)
+
+        round_data: 回合字典或CombatRound模型，会话中统一保存为模型
+        combat_id: 要记录的战斗，不指定时记录到最近开始的战斗
+        """
+        try:
+            session = self._session_for_round(combat_id)
+            if session is None:
+                return False
             
-            # 保存战斗历史
-            with open(self.combat_history_file, 'w', encoding='utf-8') as f:
-                json.dump(combat_history, f, ensure_ascii=False, indent=2)
+            session.add_round(round_data)
+            return True
             
+        except Exception as e:
+            print(f"记录战斗回合时出错: {e}")
+            return False
+    
+    async def start_combat_async(self, combat_id: str, enemies: List[Dict] = None, rng_seed: Dict = None,
+                                 player_hp: int = None) -> bool:
+        """start_combat的异步版本(写日志头在线程池中执行)"""
+        return await run_blocking(self.start_combat, combat_id, enemies, rng_seed, player_hp)
+    
+    async def record_combat_round_async(self, round_data: Union[Dict, CombatRound],
+                                        combat_id: Optional[str] = None) -> bool:
+        """record_combat_round的异步版本：回合立即进入内存，达到写入策略时在线程池中写日志"""
+        session = self.sessions.get(combat_id if combat_id is not None else self._current_id)
+        if session is None:
+            # 新建战斗或从日志载入要读写文件，交给线程池
+            session = await run_blocking(self._session_for_round, combat_id)
+            if session is None:
+                return False
+        
+        try:
+            session.add_round(round_data, flush=False)
+            if session.flush_due:
+                await run_blocking(session.flush)
             return True
             
         except Exception as e:
             print(f"记录战斗回合时出错: {e}")
             return False
     
-    def end_combat(self, combat_result: Dict) -> bool:
-        """结束战斗并更新统计数据"""
+    def flush(self, durable: bool = False, combat_id: Optional[str] = None):
+        """立即把积压的回合写入日志，不指定combat_id时写入全部进行中的战斗"""
+        if combat_id is not None:
+            sessions = [self.sessions[combat_id]] if combat_id in self.sessions else []
+        else:
+            with self._registry_lock:
+                sessions = list(self.sessions.values())
+        for session in sessions:
+            session.flush(durable)
+    
+    def load_current_combat(self, combat_id: Optional[str] = None) -> Optional[Dict]:
+        """获取进行中的战斗(头信息+全部回合)，不指定combat_id时取最近开始的战斗"""
+        session = self.get_session(combat_id)
+        if session is None:
+            return None
+        return session.to_dict()
+    
+    def get_live_stats(self, combat_id: Optional[str] = None) -> Optional[Dict]:
+        """进行中战斗的累计统计和双方生命值(O(1)，不读取文件)"""
+        session = self.get_session(combat_id)
+        if session is None:
+            return None
+        return session.snapshot()
+    
+    def end_combat(self, combat_result: Dict, combat_id: Optional[str] = None) -> bool:
+        """结束战斗：把战斗合并进历史并更新统计数据
+
+        combat_id: 要结束的战斗，不指定时结束最近开始的战斗
+        """
         try:
-            # 加载战斗历史
-            with open(self.combat_history_file, 'r', encoding='utf-8') as f:
-                combat_history = json.load(f)
+            session = self.get_session(combat_id)
+            if session is None:
+                return False
             
-            if "current_combat" in combat_history:
-                # 完成当前战斗
-                current_combat = combat_history["current_combat"]
-                current_combat.update(combat_result)
-                current_combat["end_time"] = datetime.now().isoformat()
-                
-                # 移动到已完成战斗列表
-                combat_history["combat_sessions"].append(current_combat)
-                combat_history["recent_combats"].append(current_combat)
-                
-                # 更新统计数据
-                self._update_combat_statistics(combat_history, current_combat)
-                
-                # 清理当前战斗
-                del combat_history["current_combat"]
-                
-                # 保存更新
-                with open(self.combat_history_file, 'w', encoding='utf-8') as f:
-                    json.dump(combat_history, f, ensure_ascii=False, indent=2)
-                
-                # 更新角色数据
-                self._update_player_character(current_combat)
-                
-                # 更新平衡性分析
-                self._update_balance_analysis(current_combat)
+            with self._combat_lock(session.combat_id):
+                # 日志已被删除时这场战斗已由其他进程结束
+                live = os.path.exists(session.journal_path)
+                if live:
+                    # 先把积压回合和结果写入日志并同步，合并中途崩溃时可以在启动恢复时补完
+                    session.finish(combat_result)
+                    
+                    self._fold_combat(session.to_dict(), combat_result)
+                    
+                    session.discard()
+            self._release(session)
+            return live
+            
+        except Exception as e:
+            print(f"结束战斗时出错: {e}")
+            return False
+    
+    async def end_combat_async(self, combat_result: Dict, combat_id: Optional[str] = None) -> bool:
+        """end_combat的异步版本
+
+        同一数据目录下并发结束的战斗(可以来自不同的记录器)合并成一个事务，在线程池中一次提交
+        """
+        session = self.sessions.get(combat_id if combat_id is not None else self._current_id)
+        if session is None:
+            session = await run_blocking(self.get_session, combat_id)
+            if session is None:
+                return False
+        # 立即移出登记表，这张桌子可以马上开始下一场战斗
+        self._release(session)
+        key = ("end_combat", os.path.abspath(self.data_path))
+        ended = await write_coalescer.submit(key, CombatRecorder._end_combats, (self, session, combat_result))
+        if not ended and os.path.exists(session.journal_path):
+            # 日志还在说明不是被其他进程结束的，而是合并失败
+            self._restore(session)
+        return ended
+    
+    @staticmethod
+    def _end_combats(batch: List) -> List[bool]:
+        """在一个事务中结束一批战斗，batch中每项为(记录器, 会话, 战斗结果)
+
+        整批提交失败时逐场单独合并，一场战斗的数据有问题不会连累同一批的其他战斗
+        """
+        try:
+            recorder = batch[0][0]
+            locks = [record_lock_path(recorder.data_path, "combat", session.combat_id) for _r, session, _res in batch]
+            with hold_locks(locks, timeout=recorder.lock_timeout):
+                # 日志已被删除的战斗已由其他进程结束，跳过
+                live = [os.path.exists(session.journal_path) for _recorder, session, _result in batch]
+                ending = [entry for entry, alive in zip(batch, live) if alive]
+                for _recorder, session, combat_result in ending:
+                    session.finish(combat_result)
                 
-                # 更新冒险日志
-                self._update_adventure_log(current_combat)
+                try:
+                    with recorder.storage.transaction() as transaction:
+                        for _recorder, session, combat_result in ending:
+                            recorder._apply_combat(transaction, session.to_dict(), combat_result)
+                    folded = [True] * len(ending)
+                except Exception as e:
+                    if len(ending) <= 1:
+                        raise
+                    print(f"批量结束战斗时出错，改为逐场提交: {e}")
+                    folded = CombatRecorder._fold_each(ending)
                 
-                return True
+                for (_recorder, session, _result), ok in zip(ending, folded):
+                    if ok:
+                        session.discard()
             
-            return False
+            results = iter(folded)
+            return [alive and next(results) for alive in live]
             
         except Exception as e:
             print(f"结束战斗时出错: {e}")
-            return False
+            return [False] * len(batch)
+    
+    @staticmethod
+    def _fold_each(ending: List) -> List[bool]:
+        """逐场单独提交(调用方持有这些战斗的记录锁)，返回每场是否成功"""
+        folded = []
+        for recorder, session, combat_result in ending:
+            try:
+                recorder._fold_combat(session.to_dict(), combat_result)
+                folded.append(True)
+            except Exception as e:
+                print(f"结束战斗 {session.combat_id} 时出错: {e}")
+                folded.append(False)
+        return folded
+    
+    def _fold_combat(self, current_combat: Dict, combat_result: Dict):
+        """把已结束的战斗合并进战斗历史，并更新角色、平衡性分析和冒险日志
+
+        四个文档各只读取一次，全部修改在内存中完成后作为一个事务提交，
+        崩溃时要么全部生效，要么全部不生效
+        """
+        # 一次性提交全部修改，出错时回滚并释放文件锁
+        with self.storage.transaction() as transaction:
+            self._apply_combat(transaction, current_combat, combat_result)
+    
+    def _apply_combat(self, transaction: StorageTransaction, current_combat: Dict, combat_result: Dict):
+        """在事务中登记一场已结束的战斗并更新各文档(只修改内存，不提交)"""
+        # 先一次性锁住全部四个文档，与其他事务按同一顺序加锁
+        transaction.lock("combat_history", "player_character", "balance_analysis", "adventure_log")
+        
+        # 加载战斗历史(文件缺失时新建)
+        combat_history = transaction.update("combat_history", {})
+        
+        # 完成当前战斗
+        current_combat.update(combat_result)
+        current_combat["end_time"] = datetime.now().isoformat()
+        
+        # 移动到已完成战斗列表
+        transaction.add_combat(current_combat)
+        
+        # 更新统计数据
+        self._update_combat_statistics(combat_history, current_combat)
+        
+        # 旧版本把进行中的战斗保存在历史文件里，合并时一并清理
+        combat_history.pop("current_combat", None)
+        
+        # 更新角色数据(没有角色卡时跳过，不凭空创建)
+        player_data = transaction.update("player_character")
+        if player_data is not None:
+            self._update_player_character(player_data, current_combat)
+        
+        # 更新平衡性分析
+        self._update_balance_analysis(
+            transaction.update("balance_analysis", {"combat_balance_analysis": {}}), current_combat)
+        
+        # 更新冒险日志
+        self._update_adventure_log(transaction.update("adventure_log", {"session_logs": []}), current_combat)
+    
+    def _journal_path(self, combat_id: str) -> str:
+        """战斗日志文件路径"""
+        return os.path.join(self.journal_dir, f"{combat_id}.jsonl")
+    
+    def recover(self) -> Optional[str]:
+        """启动时恢复战斗日志：补完合并中断的战斗，未结束的战斗全部登记为进行中
+
+        返回最近一场未结束战斗的ID，没有未结束的战斗时返回None
+        """
+        if not os.path.isdir(self.journal_dir):
+            return None
+        
+        journals = []
+        for name in os.listdir(self.journal_dir):
+            if not name.endswith(".jsonl"):
+                continue
+            path = os.path.join(self.journal_dir, name)
+            try:
+                journals.append((os.path.getmtime(path), path))
+            except FileNotFoundError:
+                # 列出目录后其他进程结束了这场战斗并删除了日志
+                continue
+        journals.sort()
+        
+        for _mtime, path in journals:
+            try:
+                # 正在开始或结束这场战斗的进程持有记录锁，等它完成后再检查
+                with self._combat_lock(os.path.basename(path)[:-len(".jsonl")]):
+                    self._recover_journal(path)
+            except Exception as e:
+                print(f"恢复战斗日志时出错: {e}")
+        
+        return self.current_combat_id
+    
+    def _recover_journal(self, path: str):
+        """恢复单个战斗日志(调用方持有这场战斗的记录锁)"""
+        if not os.path.exists(path):
+            return
+        session = CombatSession.load(path, **self.flush_policy)
+        if session is None:
+            # 连头信息都没有写完的日志没有可恢复的内容
+            os.remove(path)
+            return
+        if session.result is None:
+            with self._registry_lock:
+                self.sessions[session.combat_id] = session
+                self._current_id = session.combat_id
+            return
+        
+        # 结果已写入日志但合并可能没有完成，按战斗ID检查后补完
+        if not self.storage.has_combat(session.combat_id, session.header.get("start_time")):
+            self._fold_combat(session.to_dict(), session.result)
+        session.discard()
     
     def _update_combat_statistics(self, combat_history: Dict, combat_data: Dict):
         """更新战斗统计数据"""
-        stats = combat_history.get("statistics", {})
+        stats = combat_history.setdefault("statistics", {})
         
         # 基础统计
         stats["total_combats"] = stats.get("total_combats", 0) + 1
@@ -123,127 +414,100 @@ class CombatRecorder:
         stats["total_damage_dealt"] = stats.get("total_damage_dealt", 0) + player_damage
         stats["total_damage_taken"] = stats.get("total_damage_taken", 0) + enemy_damage
         
+        # 攻击/命中/重击统计(取会话中增量累计的结果，不再逐回合扫描)
+        live_stats = combat_data.get("stats", {})
+        for key in ("player_attacks", "player_hits", "player_crits", "enemy_attacks", "enemy_hits", "enemy_crits"):
+            stats[f"total_{key}"] = stats.get(f"total_{key}", 0) + live_stats.get(key, 0)
+        
         # 计算战斗效率
         if enemy_damage > 0:
             stats["combat_efficiency"] = player_damage / enemy_damage
         else:
             stats["combat_efficiency"] = player_damage
     
-    def _update_player_character(self, combat_data: Dict):
-        """更新角色数据"""
-        try:
-            with open(self.player_character_file, 'r', encoding='utf-8') as f:
-                player_data = json.load(f)
-            
-            # 更新战斗历史统计
-            combat_history = player_data.get("combat_history", {})
-            combat_history["total_combats"] = combat_history.get("total_combats", 0) + 1
-            
-            if combat_data.get("victory", False):
-                combat_history["victories"] = combat_history.get("victories", 0) + 1
-            else:
-                combat_history["defeats"] = combat_history.get("defeats", 0) + 1
-            
-            # 更新伤害统计
-            combat_history["total_damage_dealt"] = combat_history.get("total_damage_dealt", 0) + combat_data.get("player_damage_dealt", 0)
-            combat_history["total_damage_taken"] = combat_history.get("total_damage_taken", 0) + combat_data.get("enemy_damage_dealt", 0)
-            
-            # 计算平均回合数
-            rounds = len(combat_data.get("rounds", []))
-            total_rounds = combat_history.get("total_rounds", 0) + rounds
-            combat_history["total_rounds"] = total_rounds
-            if combat_history["total_combats"] > 0:
-                combat_history["average_rounds"] = total_rounds / combat_history["total_combats"]
-            
-            # 更新发展记录
-            player_data["development_notes"]["last_updated"] = datetime.now().strftime("%Y-%m-%d")
-            player_data["development_notes"]["notes"] = f"完成第{combat_history['total_combats']}场战斗！{combat_data.get('summary', '')}"
-            
-            # 保存更新
-            with open(self.player_character_file, 'w', encoding='utf-8') as f:
-                json.dump(player_data, f, ensure_ascii=False, indent=2)
-                
-        except Exception as e:
-            print(f"更新角色数据时出错: {e}")
+    def _update_player_character(self, player_data: Dict, combat_data: Dict):
+        """更新角色数据(在内存中修改，由事务统一保存)"""
+        # 更新战斗历史统计
+        combat_history = player_data.setdefault("combat_history", {})
+        combat_history["total_combats"] = combat_history.get("total_combats", 0) + 1
+        
+        if combat_data.get("victory", False):
+            combat_history["victories"] = combat_history.get("victories", 0) + 1
+        else:
+            combat_history["defeats"] = combat_history.get("defeats", 0) + 1
+        
+        # 更新伤害统计
+        combat_history["total_damage_dealt"] = combat_history.get("total_damage_dealt", 0) + combat_data.get("player_damage_dealt", 0)
+        combat_history["total_damage_taken"] = combat_history.get("total_damage_taken", 0) + combat_data.get("enemy_damage_dealt", 0)
+        
+        # 计算平均回合数
+        rounds = len(combat_data.get("rounds", []))
+        total_rounds = combat_history.get("total_rounds", 0) + rounds
+        combat_history["total_rounds"] = total_rounds
+        if combat_history["total_combats"] > 0:
+            combat_history["average_rounds"] = total_rounds / combat_history["total_combats"]
+        
+        # 更新发展记录
+        development_notes = player_data.setdefault("development_notes", {})
+        development_notes["last_updated"] = datetime.now().strftime("%Y-%m-%d")
+        development_notes["notes"] = f"完成第{combat_history['total_combats']}场战斗！{combat_data.get('summary', '')}"
     
-    def _update_balance_analysis(self, combat_data: Dict):
-        """更新平衡性分析"""
-        try:
-            if os.path.exists(self.balance_analysis_file):
-                with open(self.balance_analysis_file, 'r', encoding='utf-8') as f:
-                    balance_data = json.load(f)
-            else:
-                balance_data = {"combat_balance_analysis": {}}
-            
-            # 更新战斗计数
-            overall = balance_data["combat_balance_analysis"].get("overall_performance", {})
-            overall["combat_count"] = overall.get("combat_count", 0) + 1
-            
-            # 更新回合分析
-            round_count = len(combat_data.get("rounds", []))
-            round_analysis = balance_data["combat_balance_analysis"].get("round_analysis", {})
-            
-            if round_count <= 3:
-                round_analysis["round_count_distribution"]["1-3_rounds"] = round_analysis["round_count_distribution"].get("1-3_rounds", 0) + 1
-            elif round_count <= 6:
-                round_analysis["round_count_distribution"]["4-6_rounds"] = round_analysis["round_count_distribution"].get("4-6_rounds", 0) + 1
-            elif round_count <= 9:
-                round_analysis["round_count_distribution"]["7-9_rounds"] = round_analysis["round_count_distribution"].get("7-9_rounds", 0) + 1
-            else:
-                round_analysis["round_count_distribution"]["10+_rounds"] = round_analysis["round_count_distribution"].get("10+_rounds", 0) + 1
-            
-            # 保存更新
-            with open(self.balance_analysis_file, 'w', encoding='utf-8') as f:
-                json.dump(balance_data, f, ensure_ascii=False, indent=2)
-                
-        except Exception as e:
-            print(f"更新平衡性分析时出错: {e}")
+    def _update_balance_analysis(self, balance_data: Dict, combat_data: Dict):
+        """更新平衡性分析(在内存中修改，由事务统一保存)"""
+        # 更新战斗计数(文件缺失或不完整时补上对应的部分)
+        analysis = balance_data.setdefault("combat_balance_analysis", {})
+        overall = analysis.setdefault("overall_performance", {})
+        overall["combat_count"] = overall.get("combat_count", 0) + 1
+        
+        # 更新回合分析
+        round_count = len(combat_data.get("rounds", []))
+        distribution = analysis.setdefault("round_analysis", {}).setdefault("round_count_distribution", {})
+        
+        if round_count <= 3:
+            bucket = "1-3_rounds"
+        elif round_count <= 6:
+            bucket = "4-6_rounds"
+        elif round_count <= 9:
+            bucket = "7-9_rounds"
+        else:
+            bucket = "10+_rounds"
+        distribution[bucket] = distribution.get(bucket, 0) + 1
     
-    def _update_adventure_log(self, combat_data: Dict):
-        """更新冒险日志"""
-        try:
-            if os.path.exists(self.adventure_log_file):
-                with open(self.adventure_log_file, 'r', encoding='utf-8') as f:
-                    adventure_data = json.load(f)
-            else:
-                adventure_data = {"session_logs": []}
+    def _update_adventure_log(self, adventure_data: Dict, combat_data: Dict):
+        """更新冒险日志(在内存中修改，由事务统一保存)"""
+        # 添加战斗记录到当前会话
+        if adventure_data.get("session_logs"):
+            current_session = adventure_data["session_logs"][-1]
+            if "combat_encounters" not in current_session:
+                current_session["combat_encounters"] = []
             
-            # 添加战斗记录到当前会话
-            if adventure_data["session_logs"]:
-                current_session = adventure_data["session_logs"][-1]
-                if "combat_encounters" not in current_session:
-                    current_session["combat_encounters"] = []
-                
-                current_session["combat_encounters"].append({
-                    "enemies": combat_data.get("enemies", []),
-                    "result": "victory" if combat_data.get("victory", False) else "defeat",
-                    "rounds": len(combat_data.get("rounds", [])),
-                    "loot_gained": combat_data.get("loot_gained", [])
-                })
-                
-                # 更新会话时间
-                current_session["duration"] = "进行中"
-                
-                # 保存更新
-                with open(self.adventure_log_file, 'w', encoding='utf-8') as f:
-                    json.dump(adventure_data, f, ensure_ascii=False, indent=2)
-                    
-        except Exception as e:
-            print(f"更新冒险日志时出错: {e}")
+            current_session["combat_encounters"].append({
+                "enemies": combat_data.get("enemies", []),
+                "result": "victory" if combat_data.get("victory", False) else "defeat",
+                "rounds": len(combat_data.get("rounds", [])),
+                "loot_gained": combat_data.get("loot_gained", [])
+            })
+            
+            # 更新会话时间
+            current_session["duration"] = "进行中"
 
 # 便捷函数
 def start_combat(enemies: List[Dict]) -> str:
     """开始新战斗"""
     recorder = CombatRecorder()
-    combat_id = f"combat_{datetime.now().strftime('%Y%m%d_%H%M%S')}"
+    combat_id = f"combat_{datetime.now().strftime('%Y%m%d_%H%M%S_%f')}"
+    recorder.start_combat(combat_id, enemies)
     return combat_id
 
-def record_round(round_data: Dict) -> bool:
-    """记录战斗回合"""
+def record_round(round_data: Dict, combat_id: Optional[str] = None) -> bool:
+    """记录战斗回合(不指定combat_id时记录到最近开始的战斗)"""
     recorder = CombatRecorder()
-    return recorder.record_combat_round(round_data)
+    recorded = recorder.record_combat_round(round_data, combat_id)
+    # 临时记录器不会再被使用，立即写入日志
+    recorder.flush(combat_id=combat_id)
+    return recorded
 
-def end_combat(combat_result: Dict) -> bool:
-    """结束战斗"""
+def end_combat(combat_result: Dict, combat_id: Optional[str] = None) -> bool:
+    """结束战斗(不指定combat_id时结束最近开始的战斗)"""
     recorder = CombatRecorder()
-    return recorder.end_combat(combat_result)
+    return recorder.end_combat(combat_result, combat_id)
@@ -0,0 +1,304 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 进行中的战斗会话
+回合、敌人和生命值保存在内存中，按策略(每N回合/每T秒/战斗结束)批量追加到战斗日志
+"""
+
+import atexit
+import os
+import threading
+import time
+import weakref
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple, Union
+from .models import CombatAction, CombatRound, Monster
+from .serialization import dumps, loads
+
+# 默认每积累多少回合写一次日志
+DEFAULT_FLUSH_ROUNDS = 10
+# 默认未写入的回合最多在内存中停留的秒数
+DEFAULT_FLUSH_SECONDS = 5.0
+
+# 后台线程检查积压回合的间隔(秒)
+FLUSH_CHECK_INTERVAL = 0.5
+
+# 所有进行中的会话，供后台定时写入和进程退出时写入
+_live_sessions = weakref.WeakSet()
+_flusher_lock = threading.Lock()
+_flusher = None
+
+def _flush_loop():
+    """后台线程：把积压时间超过各自策略的会话写入日志"""
+    while True:
+        time.sleep(FLUSH_CHECK_INTERVAL)
+        now = time.monotonic()
+        for session in list(_live_sessions):
+            try:
+                session.flush_if_due(now)
+            except Exception as e:
+                print(f"写入战斗日志时出错: {e}")
+
+def _ensure_flusher():
+    """按需启动唯一的后台写入线程"""
+    global _flusher
+    if _flusher is None:
+        with _flusher_lock:
+            if _flusher is None:
+                _flusher = threading.Thread(target=_flush_loop, name="combat-session-flusher", daemon=True)
+                _flusher.start()
+
+def _flush_all_sessions():
+    """进程退出前写入全部会话"""
+    for session in list(_live_sessions):
+        try:
+            session.flush(durable=True)
+        except Exception as e:
+            print(f"写入战斗日志时出错: {e}")
+
+atexit.register(_flush_all_sessions)
+
+def encode_entry(entry: Dict) -> bytes:
+    """把日志条目编码为一行紧凑JSON"""
+    return dumps(entry) + b"\n"
+
+def read_journal(path: str) -> Tuple[Optional[Dict], Optional[Dict]]:
+    """读取战斗日志，返回(战斗数据, 结束结果)；尚未结束时结果为None"""
+    combat = None
+    result = None
+    rounds = []
+    with open(path, 'rb') as f:
+        for line in f:
+            try:
+                entry = loads(line)
+            except ValueError:
+                # 崩溃时最后一行可能只写了一半
+                continue
+            event = entry.get("event")
+            if event == "start":
+                combat = entry["combat"]
+            elif event == "round":
+                rounds.append(entry["round"])
+            elif event == "end":
+                result = entry["result"]
+    if combat is not None:
+        combat["rounds"] = rounds
+    return combat, result
+
+def new_combat_stats() -> Dict:
+    """新战斗的累计统计(随每个行动增量更新)"""
+    return {
+        "total_actions": 0,
+        "rounds": 0,
+        "player_attacks": 0,
+        "player_hits": 0,
+        "player_crits": 0,
+        "player_damage_dealt": 0,
+        "enemy_attacks": 0,
+        "enemy_hits": 0,
+        "enemy_crits": 0,
+        "enemy_damage_dealt": 0
+    }
+
+# 行动回合缺少行动数据时按空行动统计
+_NO_ACTION = CombatAction()
+
+def _hit_points(value) -> Optional[int]:
+    """解析生命值，兼容怪物图鉴中 "7 (2d6)" 的写法"""
+    if value is None:
+        return None
+    return Monster.parse_hit_points(value)[0]
+
+class CombatSession:
+    """内存中的进行中战斗"""
+    
+    def __init__(self, combat: Dict, journal_path: str,
+                 flush_every_rounds: int = DEFAULT_FLUSH_ROUNDS,
+                 flush_every_seconds: Optional[float] = DEFAULT_FLUSH_SECONDS):
+        """由战斗头信息(可带已记录的回合)构建会话，不写入任何文件
+
+        flush_every_rounds: 积累多少回合写一次日志，1表示每回合都写
+        flush_every_seconds: 未写入的回合最多停留的秒数，None表示不按时间写入
+        """
+        self.combat_id = combat["combat_id"]
+        self.header = {k: v for k, v in combat.items() if k != "rounds"}
+        self.journal_path = journal_path
+        self.flush_every_rounds = max(flush_every_rounds, 1)
+        self.flush_every_seconds = flush_every_seconds
+        self.result = None
+        
+        self.player_hp = _hit_points(combat.get("player_hp_start"))
+        self.enemy_hp = [_hit_points(e.get("hit_points")) if isinstance(e, dict) else None
+                         for e in combat.get("enemies", [])]
+        # 回合以CombatRound模型保存，比原始字典省约40%内存
+        self.rounds = []
+        self.stats = new_combat_stats()
+        for round_data in combat.get("rounds", []):
+            self._apply(CombatRound.from_dict(round_data))
+        
+        self._pending = []
+        self._pending_since = None
+        self._lock = threading.Lock()
+        _live_sessions.add(self)
+        if flush_every_seconds is not None:
+            _ensure_flusher()
+    
+    @classmethod
+    def create(cls, combat_id: str, journal_path: str, enemies: List[Dict] = None,
+               rng_seed: Dict = None, player_hp: int = None, **policy) -> "CombatSession":
+        """开始新会话，头信息立即写入日志，其他进程和重启后都能找到这场战斗"""
+        header = {
+            "combat_id": combat_id,
+            "start_time": datetime.now().isoformat(),
+            "rng_seed": rng_seed,
+            "enemies": enemies or [],
+            "loot_gained": []
+        }
+        if player_hp is not None:
+            header["player_hp_start"] = player_hp
+        
+        os.makedirs(os.path.dirname(journal_path), exist_ok=True)
+        # 独占创建：同一战斗ID的日志已存在时失败
+        with open(journal_path, 'xb') as f:
+            f.write(encode_entry({"event": "start", "combat": header}))
+        return cls(header, journal_path, **policy)
+    
+    @classmethod
+    def load(cls, journal_path: str, **policy) -> Optional["CombatSession"]:
+        """从战斗日志恢复会话，日志没有头信息时返回None"""
+        combat, result = read_journal(journal_path)
+        if combat is None:
+            return None
+        session = cls(combat, journal_path, **policy)
+        session.result = result
+        return session
+    
+    def _apply(self, round_data: CombatRound):
+        """把一回合加入内存，并更新生命值和累计统计"""
+        self.rounds.append(round_data)
+        round_type = round_data.type
+        if round_type == "enemy_action":
+            action = round_data.action or _NO_ACTION
+            if action.hit and self.player_hp is not None:
+                self.player_hp -= action.damage or 0
+            self._count_action("enemy", round_data, action)
+        elif round_type == "player_action":
+            action = round_data.action or _NO_ACTION
+            if action.hit:
+                self._damage_enemy(action.target, action.damage or 0)
+            self._count_action("player", round_data, action)
+    
+    def _count_action(self, side: str, round_data: CombatRound, action: CombatAction):
+        """累计一次行动的攻击、命中、重击和伤害"""
+        stats = self.stats
+        stats["total_actions"] += 1
+        round_number = round_data.round
+        if isinstance(round_number, int) and round_number > stats["rounds"]:
+            stats["rounds"] = round_number
+        if action.type != "attack":
+            return
+        stats[f"{side}_attacks"] += 1
+        if action.hit:
+            stats[f"{side}_hits"] += 1
+            stats[f"{side}_damage_dealt"] += action.damage or 0
+            if action.critical:
+                stats[f"{side}_crits"] += 1
+    
+    def _damage_enemy(self, target, damage: int):
+        """对目标敌人造成伤害，未指定目标时打击第一个存活的敌人"""
+        for i, hp in enumerate(self.enemy_hp):
+            if hp is None or hp <= 0:
+                continue
+            enemy = self.header["enemies"][i]
+            if target is None or target == i or (isinstance(enemy, dict) and enemy.get("name") == target):
+                self.enemy_hp[i] = hp - damage
+                return
+    
+    def add_round(self, round_data: Union[Dict, CombatRound], flush: bool = True):
+        """记录一回合(字典或CombatRound)，达到写入策略时把积压的回合写入日志
+
+        flush为False时只加入内存，由调用方根据flush_due决定何时写入(异步调用时交给线程池)
+        """
+        if isinstance(round_data, CombatRound):
+            model = round_data
+            round_data = model.to_dict()
+        else:
+            model = CombatRound.from_dict(round_data)
+        line = encode_entry({"event": "round", "round": round_data})
+        with self._lock:
+            # 每场战斗一把锁：同一战斗的回合按顺序进入内存，不同战斗之间互不等待
+            self._apply(model)
+            self._pending.append(line)
+            pending = len(self._pending)
+            if pending == 1:
+                self._pending_since = time.monotonic()
+        if flush and pending >= self.flush_every_rounds:
+            self.flush()
+    
+    @property
+    def flush_due(self) -> bool:
+        """积压回合数是否已达到写入策略"""
+        return len(self._pending) >= self.flush_every_rounds
+    
+    def flush_if_due(self, now: float):
+        """积压时间超过flush_every_seconds时写入日志(由后台线程调用)"""
+        since = self._pending_since
+        if since is not None and self.flush_every_seconds is not None and now - since >= self.flush_every_seconds:
+            self.flush()
+    
+    def flush(self, durable: bool = False):
+        """把积压的回合追加写入日志；durable为True时同步到磁盘"""
+        with self._lock:
+            lines = self._pending
+            self._pending = []
+            self._pending_since = None
+            if not lines and not durable:
+                return
+            try:
+                # 不带O_CREAT打开：日志已被删除(战斗已在别处结束)时不再重新创建
+                fd = os.open(self.journal_path, os.O_WRONLY | os.O_APPEND | getattr(os, "O_BINARY", 0))
+            except FileNotFoundError:
+                # 积压的回合没有可写入的日志，丢弃它们，后台写入也不再处理这个会话
+                _live_sessions.discard(self)
+                return
+            with open(fd, 'ab') as f:
+                f.writelines(lines)
+                if durable:
+                    f.flush()
+                    os.fsync(f.fileno())
+    
+    def finish(self, result: Dict):
+        """写入全部积压回合和结束结果，并强制同步到磁盘"""
+        with self._lock:
+            self._pending.append(encode_entry({"event": "end", "result": result}))
+        self.flush(durable=True)
+        self.result = result
+    
+    def discard(self):
+        """战斗已合并进历史后删除日志"""
+        with self._lock:
+            self._pending = []
+            self._pending_since = None
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        _live_sessions.discard(self)
+    
+    @property
+    def pending_rounds(self) -> int:
+        """尚未写入日志的回合数"""
+        return len(self._pending)
+    
+    def snapshot(self) -> Dict:
+        """进行中战斗的实时状态：累计统计和双方生命值，不读取任何文件"""
+        snapshot = dict(self.stats)
+        snapshot["combat_id"] = self.combat_id
+        snapshot["player_hp"] = self.player_hp
+        snapshot["enemy_hp"] = list(self.enemy_hp)
+        return snapshot
+    
+    def to_dict(self) -> Dict:
+        """转换为战斗记录(头信息+全部回合+累计统计)"""
+        combat = dict(self.header)
+        combat["rounds"] = [r.to_dict() for r in self.rounds]
+        combat["stats"] = dict(self.stats)
+        return combat
@@ -0,0 +1,102 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 共享文档缓存
+进程内所有模块通过同一个 DataStore 读取数据文件：解析结果按路径缓存，
+每次读取只做一次 stat，文件的 inode、修改时间或大小变化(包括其他进程的原子替换)时才重新解析，
+本进程写入文件后立即作废对应的缓存
+"""
+
+import os
+import threading
+from typing import Any, Callable, Dict, Optional, Tuple
+from .serialization import load_file
+
+# 文件签名：(inode, 修改时间纳秒, 大小)
+Signature = Tuple[int, int, int]
+
+def file_signature(path: str) -> Optional[Signature]:
+    """文件签名，文件不存在时返回None"""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+class DataStore:
+    """按路径缓存已解析的JSON文档
+
+    read返回的是缓存中的文档对象本身：同一文件的所有调用方拿到同一个可变对象，它既不是副本也没有写保护，
+    调用方只能读取，不能原地修改(否则修改会出现在之后所有的读取结果中，直到文件变化)；
+    需要修改文档时通过存储事务读取独立的副本，把文档交给外部调用方的公开接口先复制一份
+    """
+    
+    def __init__(self):
+        """初始化空缓存"""
+        self._entries = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.parses = 0
+    
+    def read(self, path: str, default: Any = None) -> Any:
+        """读取缓存中的共享文档(调用方不得修改)，文件不存在时返回default"""
+        key = os.path.abspath(path)
+        signature = file_signature(key)
+        if signature is None:
+            return default
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] == signature:
+                self.hits += 1
+                return entry[1]
+        
+        document = load_file(key)
+        # 解析期间文件可能又被替换，以解析前的签名登记，下次读取时会发现变化
+        with self._lock:
+            self._entries[key] = (signature, document)
+            self.parses += 1
+        return document
+    
+    def exists(self, path: str) -> bool:
+        """文件是否存在(不解析)"""
+        return file_signature(path) is not None
+    
+    def invalidate(self, path: Optional[str] = None):
+        """作废单个文件的缓存，不指定path时清空全部缓存"""
+        with self._lock:
+            if path is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(os.path.abspath(path), None)
+    
+    def stats(self) -> Dict:
+        """缓存命中和解析次数"""
+        with self._lock:
+            return {"cached_files": len(self._entries), "hits": self.hits, "parses": self.parses}
+
+# 进程内共享的文档缓存
+data_store = DataStore()
+
+def read_document(path: str, default: Any = None) -> Any:
+    """通过共享缓存读取文档(返回共享对象，调用方不得修改)"""
+    return data_store.read(path, default)
+
+# 由文档构建的派生数据(如查询索引)：与文档对象绑定，文件变化后缓存返回新对象，派生数据随之重建
+_derived = {}
+_derived_lock = threading.Lock()
+# 最多保留的派生数据条数(旧版本文档的派生数据不会再被使用)
+MAX_DERIVED = 32
+
+def derived(document: Any, builder: Callable[[Any], Any]) -> Any:
+    """取由文档构建的派生数据，同一个文档对象对同一个builder只构建一次"""
+    key = (id(document), builder)
+    with _derived_lock:
+        entry = _derived.get(key)
+        if entry is not None and entry[0] is document:
+            return entry[1]
+    value = builder(document)
+    with _derived_lock:
+        if len(_derived) >= MAX_DERIVED:
+            _derived.clear()
+        _derived[key] = (document, value)
+    return value
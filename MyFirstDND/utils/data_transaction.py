@@ -0,0 +1,262 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 多文件事务提交
+一次性加载需要修改的数据文件，在内存中完成全部修改后统一提交：
+先写临时文件并同步到磁盘，再写提交意图文件，最后逐个重命名覆盖原文件。
+提交中途崩溃时，启动恢复会根据意图文件补完重命名，或丢弃未提交的临时文件。
+事务读取的每个文件从读取时起加跨进程独占锁，提交或回滚后立即释放，多个进程修改同一文件时不会丢失更新
+"""
+
+import json
+import os
+import uuid
+from typing import Any, List, Optional, Union
+from .data_store import data_store
+from .file_lock import DEFAULT_LOCK_TIMEOUT, FileLock, hold_locks, lock_path
+from .serialization import dumps, load_file
+
+# 提交意图文件名前缀(位于数据目录下，每个事务一个：.commit_intent-<事务ID>.json)
+INTENT_PREFIX = ".commit_intent"
+# 临时文件后缀
+TEMP_SUFFIX = ".txn-"
+
+def _fsync_directory(path: str):
+    """同步目录项，保证重命名本身落盘(不支持的平台上忽略)"""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _write_synced(path: str, content: Union[str, bytes]):
+    """写入文件并同步到磁盘"""
+    if isinstance(content, bytes):
+        f = open(path, 'wb')
+    else:
+        f = open(path, 'w', encoding='utf-8')
+    with f:
+        f.write(content)
+        f.flush()
+        os.fsync(f.fileno())
+
+def _remove_lock_file(intent_file: str):
+    """意图文件删除后清理它的锁文件(此后不会再有人等待这个锁)"""
+    try:
+        os.remove(lock_path(intent_file))
+    except FileNotFoundError:
+        pass
+
+def atomic_write_json(path: str, data: Any, readable: bool = False,
+                      lock_timeout: Optional[float] = DEFAULT_LOCK_TIMEOUT):
+    """单个文件的原子写入：临时文件 + fsync + 重命名(只在重命名时持有文件锁)"""
+    temp_path = f"{path}{TEMP_SUFFIX}{uuid.uuid4().hex}"
+    _write_synced(temp_path, dumps(data, readable))
+    try:
+        with FileLock(lock_path(path), timeout=lock_timeout):
+            os.replace(temp_path, path)
+    except Exception:
+        discard_staged([[temp_path, path]])
+        raise
+    data_store.invalidate(path)
+    _fsync_directory(os.path.dirname(path) or ".")
+
+class DataTransaction:
+    """数据文件事务：每个文件只解析一次，提交时一次性写入全部修改过的文件"""
+    
+    def __init__(self, data_path: str = ".", readable: bool = False,
+                 lock_timeout: Optional[float] = DEFAULT_LOCK_TIMEOUT):
+        """初始化事务(readable为True时文档带缩进写入，否则使用紧凑格式)
+
+        lock_timeout: 等待其他进程释放文件锁的秒数，超时抛出LockTimeout
+        """
+        self.data_path = data_path
+        self.readable = readable
+        self.lock_timeout = lock_timeout
+        self.documents = {}
+        self.payloads = {}
+        self.dirty = set()
+        self.locks = {}
+    
+    def acquire(self, *paths: str):
+        """对文件加独占锁，持有到提交或回滚
+
+        同一次调用中的路径按排序加锁；load/update 在第一次读取时才单独加锁，锁的顺序取决于读取顺序。
+        要修改多个文件的事务应先用一次 acquire 锁住全部文件，不同进程之间才不会交叉等待
+        """
+        for path in sorted(set(paths) - set(self.locks)):
+            lock = FileLock(lock_path(path), timeout=self.lock_timeout)
+            lock.acquire()
+            self.locks[path] = lock
+    
+    def release(self):
+        """释放事务持有的全部文件锁"""
+        for lock in self.locks.values():
+            lock.release()
+        self.locks.clear()
+    
+    def load(self, path: str, default: Any = None) -> Any:
+        """加锁后读取文档(同一事务内只解析一次)；文件不存在时返回default
+
+        尚未加锁的文件在这里单独加锁(见acquire)。事务要原地修改文档，所以直接解析文件得到独立的副本，不使用共享缓存
+        """
+        if path not in self.documents:
+            self.acquire(path)
+            if os.path.exists(path):
+                self.documents[path] = load_file(path)
+            else:
+                self.documents[path] = default
+        return self.documents[path]
+    
+    def update(self, path: str, default: Any = None) -> Any:
+        """读取文档并标记为待写入，返回的对象可以直接原地修改"""
+        document = self.load(path, default)
+        if document is not None:
+            self.dirty.add(path)
+        return document
+    
+    def put(self, path: str, document: Any):
+        """整体替换文档"""
+        self.acquire(path)
+        self.documents[path] = document
+        self.dirty.add(path)
+    
+    def put_bytes(self, path: str, payload: bytes):
+        """写入一个二进制文件(如压缩的归档分段)，与其他文档一起提交"""
+        self.acquire(path)
+        self.payloads[path] = payload
+        self.dirty.add(path)
+    
+    def stage(self) -> List[List[str]]:
+        """第一阶段：把修改过的文档写入临时文件并同步，返回[临时文件, 目标文件]列表
+
+        调用方负责在自己的提交点之后执行apply_renames，出错时已写的临时文件会被删除
+        """
+        txid = uuid.uuid4().hex
+        renames = []
+        try:
+            for path in sorted(self.dirty):
+                temp_path = f"{path}{TEMP_SUFFIX}{txid}"
+                if path in self.payloads:
+                    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+                    _write_synced(temp_path, self.payloads[path])
+                else:
+                    _write_synced(temp_path, dumps(self.documents[path], self.readable))
+                renames.append([temp_path, path])
+        except Exception:
+            discard_staged(renames)
+            raise
+        return renames
+    
+    def commit(self) -> List[str]:
+        """提交全部修改并释放文件锁，返回写入的文件列表"""
+        try:
+            if not self.dirty:
+                return []
+            
+            renames = self.stage()
+            if len(renames) == 1:
+                # 单个文件的重命名本身是原子的，不需要意图文件
+                apply_renames(renames)
+            else:
+                self._commit_with_intent(renames)
+            
+            written = [path for _temp, path in renames]
+            self.payloads.clear()
+            self.dirty.clear()
+            return written
+        finally:
+            self.release()
+    
+    def _commit_with_intent(self, renames: List[List[str]]):
+        """多文件提交：写入意图文件后再逐个重命名"""
+        intent_file = os.path.join(self.data_path, f"{INTENT_PREFIX}-{uuid.uuid4().hex}.json")
+        # 意图文件从写入到删除一直加锁，启动恢复不会动正在提交的事务
+        with FileLock(lock_path(intent_file), timeout=self.lock_timeout):
+            # 提交点：意图文件落盘后，这次事务就一定会被完整应用
+            _write_synced(intent_file, json.dumps({"renames": renames}))
+            _fsync_directory(self.data_path)
+            
+            # 第二阶段：重命名覆盖原文件
+            apply_renames(renames)
+            os.remove(intent_file)
+            _fsync_directory(self.data_path)
+        _remove_lock_file(intent_file)
+    
+    def rollback(self):
+        """放弃全部未提交的修改并释放文件锁"""
+        self.documents.clear()
+        self.payloads.clear()
+        self.dirty.clear()
+        self.release()
+    
+    def __enter__(self) -> "DataTransaction":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+def apply_renames(renames: List[List[str]]):
+    """第二阶段：把临时文件重命名覆盖目标文件，已经完成的跳过，并作废这些文件的共享缓存"""
+    directories = set()
+    for temp_path, path in renames:
+        try:
+            os.replace(temp_path, path)
+        except FileNotFoundError:
+            # 已经由提交方或其他进程的恢复完成
+            pass
+        data_store.invalidate(path)
+        directories.add(os.path.dirname(path) or ".")
+    for directory in directories:
+        _fsync_directory(directory)
+
+def discard_staged(renames: List[List[str]]):
+    """删除未提交的临时文件"""
+    for temp_path, _path in renames:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+
+def recover_pending_commit(data_path: str = ".", lock_timeout: Optional[float] = DEFAULT_LOCK_TIMEOUT) -> bool:
+    """启动时检查是否有中断的提交：有意图文件则补完重命名，返回是否做了恢复
+
+    正在提交的事务持有意图文件的锁，恢复会等它完成后发现意图文件已删除而跳过
+    """
+    recovered = False
+    for name in sorted(os.listdir(data_path or ".")):
+        if not (name.startswith(INTENT_PREFIX) and name.endswith(".json")):
+            continue
+        intent_file = os.path.join(data_path, name)
+        with FileLock(lock_path(intent_file), timeout=lock_timeout):
+            if _recover_intent(intent_file, data_path, lock_timeout):
+                recovered = True
+        _remove_lock_file(intent_file)
+    return recovered
+
+def _recover_intent(intent_file: str, data_path: str, lock_timeout: Optional[float]) -> bool:
+    """按一个意图文件补完重命名(调用方持有意图文件的锁)"""
+    if not os.path.exists(intent_file):
+        return False
+    try:
+        with open(intent_file, 'r', encoding='utf-8') as f:
+            intent = json.load(f)
+    except ValueError:
+        # 意图文件本身没写完，说明提交点之前就中断了，临时文件作废
+        os.remove(intent_file)
+        return False
+    
+    renames = intent.get("renames", [])
+    # 等待仍在读写这些文件的事务结束后再补完
+    with hold_locks([lock_path(path) for _temp, path in renames], timeout=lock_timeout):
+        apply_renames(renames)
+    os.remove(intent_file)
+    _fsync_directory(data_path)
+    return True
@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 难度扫描
+枚举敌人组合、数量和玩家等级的网格，用多进程批量模拟，结果逐行写入JSONL文件
+用于按实际模拟数据校准 combat_templates 中的 expected_rounds
+"""
+
+import argparse
+import copy
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from itertools import combinations_with_replacement
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from rules.rng_streams import as_seed_sequence
+from utils.data_store import read_document
+from utils.encounter_simulator import EncounterSimulator
+from utils.storage_backend import open_storage
+
+# 每个网格点默认模拟的战斗场数
+DEFAULT_FIGHTS = 20000
+# 默认扫描的玩家等级(与encounter_builder中的等级指引一致)
+DEFAULT_LEVELS = (1, 2, 3, 4)
+
+# 工作进程内复用的模拟器，避免每个任务都重新加载数据文件
+_worker_simulators = {}
+
+def _run_task(data_path: str, enemies: Tuple[str, ...], level: int, fights: int, seed_record: Dict) -> Dict:
+    """在工作进程中模拟一个网格点，返回汇总结果"""
+    simulator = _worker_simulators.get(data_path)
+    if simulator is None:
+        simulator = _worker_simulators[data_path] = EncounterSimulator(data_path)
+    
+    report = simulator.simulate(list(enemies), fights, simulator.player_combatant(level=level),
+                                seed=seed_record)
+    challenge_ratings = [simulator.find_monster(e).get("challenge_rating", 0) for e in enemies]
+    return {
+        "key": task_key(enemies, level),
+        "enemies": list(enemies),
+        "enemy_count": len(enemies),
+        "enemy_cr": max(challenge_ratings),
+        "total_cr": sum(challenge_ratings),
+        "player_level": level,
+        "fights": fights,
+        "seed": report["seed"],
+        "win_rate": report["win_rate"],
+        "loss_rate": report["loss_rate"],
+        "stalemate_rate": report["stalemate_rate"],
+        "mean_rounds": report["rounds"]["mean"],
+        "rounds_distribution": report["rounds"]["distribution"],
+        "mean_hp_remaining": report["player_hp_remaining"]["mean"],
+        "hp_fraction_remaining": (report["player_hp_remaining"]["mean"] or 0) / report["player_hp_remaining"]["maximum"],
+        "elapsed_seconds": report["elapsed_seconds"]
+    }
+
+def task_key(enemies: Iterable[str], level: int) -> str:
+    """网格点的唯一标识，用于断点续跑"""
+    return f"L{level}:" + "+".join(enemies)
+
+class DifficultySweep:
+    """多进程遭遇战难度扫描"""
+    
+    def __init__(self, data_path: str = "."):
+        """初始化扫描器"""
+        self.data_path = data_path
+        self.combat_history_file = os.path.join(data_path, "combat/combat_history.json")
+        self.simulator = EncounterSimulator(data_path)
+    
+    def load_templates(self) -> Dict:
+        """读取战斗历史中的战斗模板(返回副本，修改不会影响共享缓存)"""
+        return copy.deepcopy(read_document(self.combat_history_file, {}).get("combat_templates", {}))
+    
+    def build_grid(self, monsters: List[str] = None, counts: List[int] = None,
+                   levels: List[int] = None) -> List[Tuple[Tuple[str, ...], int]]:
+        """枚举(敌人组合, 玩家等级)网格，同一组合不区分顺序"""
+        monsters = sorted(monsters or self.simulator.monsters.keys())
+        if counts is None:
+            counts = sorted({t["enemy_count"] for t in self.load_templates().values()})
+        levels = levels or list(DEFAULT_LEVELS)
+        
+        grid = []
+        for level in levels:
+            for count in counts:
+                for enemies in combinations_with_replacement(monsters, count):
+                    grid.append((enemies, level))
+        return grid
+    
+    def _completed_keys(self, output_path: str) -> set:
+        """读取结果文件中已经完成的网格点"""
+        keys = set()
+        if os.path.exists(output_path):
+            with open(output_path, 'r', encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        keys.add(json.loads(line)["key"])
+                    except (ValueError, KeyError):
+                        # 中断时可能留下半行，跳过后重新计算
+                        continue
+        return keys
+    
+    def run(self, grid: List[Tuple[Tuple[str, ...], int]], output_path: str,
+            fights: int = DEFAULT_FIGHTS, workers: int = None, seed=None,
+            resume: bool = True, progress: bool = True) -> int:
+        """把网格分发到进程池，每完成一个网格点就追加写入一行结果，返回本次完成的数量
+
+        每个网格点使用从根种子按网格顺序派生的独立随机数流，
+        同样的种子和网格得到相同的结果，与进程数和完成顺序无关
+        """
+        root = as_seed_sequence(seed)
+        streams = root.spawn(len(grid))
+        done = self._completed_keys(output_path) if resume else set()
+        pending = [(task, stream) for task, stream in zip(grid, streams) if task_key(*task) not in done]
+        
+        started = time.perf_counter()
+        completed = 0
+        with open(output_path, 'a' if resume else 'w', encoding='utf-8') as out, \
+                ProcessPoolExecutor(max_workers=workers) as executor:
+            futures = [
+                executor.submit(_run_task, self.data_path, enemies, level, fights, stream.to_dict())
+                for (enemies, level), stream in pending
+            ]
+            for future in as_completed(futures):
+                out.write(json.dumps(future.result(), ensure_ascii=False) + "\n")
+                out.flush()
+                completed += 1
+                if progress:
+                    elapsed = time.perf_counter() - started
+                    print(f"\r已完成 {completed}/{len(pending)} 个网格点，用时 {elapsed:.1f} 秒", end="", flush=True)
+        if progress and pending:
+            print()
+        return completed
+    
+    def load_results(self, output_path: str) -> List[Dict]:
+        """读取结果文件"""
+        results = []
+        with open(output_path, 'r', encoding='utf-8') as f:
+            for line in f:
+                try:
+                    results.append(json.loads(line))
+                except ValueError:
+                    continue
+        return results
+    
+    def calibrate_templates(self, results: List[Dict], level: int = 1) -> Dict:
+        """按模拟结果为每个战斗模板估计expected_rounds
+
+        匹配条件: 敌人数量与模板一致，且组合中最高CR不超过模板的enemy_cr；
+        图鉴中没有该CR的怪物时，使用数量一致的全部组合
+        """
+        calibration = {}
+        for name, template in self.load_templates().items():
+            same_count = [r for r in results
+                          if r["enemy_count"] == template["enemy_count"] and r["player_level"] == level]
+            matched = [r for r in same_count if r["enemy_cr"] <= template["enemy_cr"]] or same_count
+            matched = [r for r in matched if r["mean_rounds"] is not None]
+            if not matched:
+                continue
+            mean_rounds = sum(r["mean_rounds"] for r in matched) / len(matched)
+            calibration[name] = {
+                "player_level": level,
+                "matched_encounters": len(matched),
+                "current_expected_rounds": template.get("expected_rounds"),
+                "simulated_rounds": mean_rounds,
+                "suggested_expected_rounds": max(int(round(mean_rounds)), 1),
+                "win_rate": sum(r["win_rate"] for r in matched) / len(matched),
+                "hp_fraction_remaining": sum(r["hp_fraction_remaining"] for r in matched) / len(matched)
+            }
+        return calibration
+    
+    def apply_calibration(self, calibration: Dict) -> bool:
+        """把建议的expected_rounds写回combat_history.json"""
+        try:
+            storage = open_storage(self.data_path)
+            try:
+                # 在事务中读-改-写，与战斗记录器的并发写入互不覆盖
+                with storage.transaction() as transaction:
+                    data = transaction.update("combat_history")
+                    for name, result in calibration.items():
+                        if name in data.get("combat_templates", {}):
+                            data["combat_templates"][name]["expected_rounds"] = result["suggested_expected_rounds"]
+            finally:
+                storage.close()
+            return True
+        except Exception as e:
+            print(f"写入战斗模板时出错: {e}")
+            return False
+
+def main(argv: Optional[List[str]] = None):
+    """命令行入口: python -m utils.difficulty_sweep --workers 8 -n 20000"""
+    parser = argparse.ArgumentParser(description="多进程遭遇战难度扫描")
+    parser.add_argument("--data-path", default=".", help="数据目录")
+    parser.add_argument("-o", "--output", default="combat/difficulty_sweep.jsonl", help="结果文件(JSONL)")
+    parser.add_argument("-n", "--fights", type=int, default=DEFAULT_FIGHTS, help="每个网格点的模拟场数")
+    parser.add_argument("--monsters", nargs="+", help="参与组合的怪物图鉴键，默认全部")
+    parser.add_argument("--counts", nargs="+", type=int, help="敌人数量，默认取战斗模板中的enemy_count")
+    parser.add_argument("--levels", nargs="+", type=int, help="玩家等级，默认1-4")
+    parser.add_argument("--workers", type=int, help="进程数，默认CPU核数")
+    parser.add_argument("--seed", type=int, help="根种子")
+    parser.add_argument("--restart", action="store_true", help="忽略已有结果，从头开始")
+    parser.add_argument("--apply", action="store_true", help="把建议的expected_rounds写回combat_history.json")
+    args = parser.parse_args(argv)
+    
+    sweep = DifficultySweep(args.data_path)
+    output = os.path.join(args.data_path, args.output)
+    grid = sweep.build_grid(args.monsters, args.counts, args.levels)
+    print(f"网格点: {len(grid)}，每点 {args.fights} 场")
+    sweep.run(grid, output, args.fights, args.workers, args.seed, resume=not args.restart)
+    
+    calibration = sweep.calibrate_templates(sweep.load_results(output))
+    print(json.dumps(calibration, ensure_ascii=False, indent=2))
+    if args.apply and sweep.apply_calibration(calibration):
+        print("已更新 combat_templates 的 expected_rounds")
+
+if __name__ == "__main__":
+    main()
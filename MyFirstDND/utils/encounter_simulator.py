@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 遭遇战模拟器
+用玩家角色卡和怪物图鉴批量模拟完整战斗，统计胜率、回合数分布和剩余生命值分布
+每回合对所有进行中的战斗统一结算，伤害直接从精确伤害分布中按批抽样
+"""
+
+import argparse
+import json
+import os
+import time
+from collections import Counter
+from typing import Dict, List, Optional, Union
+
+from rules.dice_expression import compile_expression
+from rules.dice_probability import DicePMF, attack_damage_pmf, expected_attack
+from rules.rng_streams import SeedSequence, as_seed_sequence
+from utils.data_store import derived, read_document
+from utils.models import Character, Monster, Weapon, monsters_from_manual
+
+# 单场战斗的最大回合数，超过视为僵持
+MAX_ROUNDS = 50
+
+_D20_FACES = tuple(range(1, 21))
+
+# 角色卡没有武器时使用
+_UNARMED = Weapon("徒手", damage="1", attack_bonus=0)
+# 图鉴中找不到的敌人
+_UNKNOWN_MONSTER = Monster.from_dict({})
+
+class DamageSampler:
+    """按伤害分布批量抽样"""
+    
+    __slots__ = ("values", "cum_weights")
+    
+    def __init__(self, pmf: DicePMF):
+        """预先计算累计概率"""
+        values = []
+        cum_weights = []
+        running = 0
+        for value, weight in pmf.items():
+            running += weight
+            values.append(value)
+            cum_weights.append(running / pmf.denominator)
+        self.values = tuple(values)
+        self.cum_weights = tuple(cum_weights)
+    
+    def sample(self, rng, k: int) -> List[int]:
+        """抽取k个伤害值"""
+        return rng.choices(self.values, cum_weights=self.cum_weights, k=k)
+
+def _proficiency_bonus(level: int) -> int:
+    """等级对应的熟练加值"""
+    return 2 + (max(level, 1) - 1) // 4
+
+class EncounterSimulator:
+    """蒙特卡洛遭遇战模拟器"""
+    
+    def __init__(self, data_path: str = ".", seed: Union[None, int, Dict, SeedSequence] = None):
+        """初始化模拟器
+
+        seed: 可选的根种子；每次模拟从中派生独立的随机数流
+        """
+        self.data_path = data_path
+        self.player_character_file = os.path.join(data_path, "characters/player_character.json")
+        self.monster_manual_file = os.path.join(data_path, "monsters/monster_manual.json")
+        self.seed_sequence = as_seed_sequence(seed)
+        self._monsters = None
+        self._monster_models = None
+    
+    def _load_json(self, path: str) -> Dict:
+        """加载JSON文件(共享缓存中的对象，只读取不修改)"""
+        document = read_document(path)
+        if document is None:
+            raise FileNotFoundError(path)
+        return document
+    
+    @property
+    def monsters(self) -> Dict:
+        """怪物图鉴(首次使用时加载)"""
+        if self._monsters is None:
+            self._monsters = self._load_json(self.monster_manual_file).get("monsters", {})
+        return self._monsters
+    
+    def find_monster(self, key: str) -> Optional[Dict]:
+        """按图鉴键(goblin)或名称(哥布林)查找怪物"""
+        if key in self.monsters:
+            return self.monsters[key]
+        for monster in self.monsters.values():
+            if monster.get("name") == key:
+                return monster
+        return None
+    
+    def find_monster_model(self, key: str) -> Optional[Monster]:
+        """按图鉴键或名称查找怪物模型"""
+        if self._monster_models is None:
+            self._monster_models = derived(self._load_json(self.monster_manual_file), monsters_from_manual)
+        if key in self._monster_models:
+            return self._monster_models[key]
+        for monster in self._monster_models.values():
+            if monster.name == key:
+                return monster
+        return None
+    
+    def player_combatant(self, weapon: str = None, level: int = None) -> Dict:
+        """从角色卡构建玩家的战斗数据，默认使用第一把武器
+
+        指定level时按生命骰平均值和熟练加值把角色卡换算到该等级，并以满生命值开战
+        """
+        player = derived(self._load_json(self.player_character_file), Character.from_dict)
+        weapons = player.weapons or []
+        chosen = weapons[0] if weapons else _UNARMED
+        for item in weapons:
+            if item.name == weapon:
+                chosen = item
+        
+        damage = chosen.damage or "1d4"
+        damage_bonus = chosen.damage_bonus or 0
+        if damage_bonus:
+            damage = f"{damage}{damage_bonus:+d}"
+        
+        maximum_hp = player.max_hit_points
+        current_hp = player.hit_points
+        if current_hp is None:
+            current_hp = maximum_hp if maximum_hp is not None else 1
+        attack_bonus = chosen.attack_bonus or 0
+        
+        sheet_level = player.level
+        if level is not None and level != sheet_level:
+            hit_die = max((int(k.lstrip("d")) for k in player.hit_dice or {"d8": 1}), default=8)
+            per_level = max(hit_die // 2 + 1 + player.constitution_modifier, 1)
+            base_hp = maximum_hp if maximum_hp is not None else current_hp
+            current_hp = max(base_hp + (level - sheet_level) * per_level, 1)
+            attack_bonus += _proficiency_bonus(level) - _proficiency_bonus(sheet_level)
+        
+        return {
+            "name": player.name or "玩家",
+            "level": level or sheet_level,
+            "armor_class": player.armor_class,
+            "hit_points": current_hp,
+            "attack_bonus": attack_bonus,
+            "damage": damage,
+            "action": chosen.name or "攻击",
+            "initiative": player.initiative,
+            "advantage": "none"
+        }
+    
+    def enemy_combatant(self, enemy: Union[str, Dict], target_ac: int) -> Dict:
+        """构建敌人的战斗数据
+
+        enemy可以是图鉴键/名称，或带name的字典；字典中已有attack_bonus和damage时直接使用，
+        否则从图鉴中选取对target_ac期望伤害最高的动作
+        """
+        if isinstance(enemy, str):
+            enemy = {"id": enemy}
+        monster = self.find_monster_model(enemy.get("id", enemy.get("name", ""))) or _UNKNOWN_MONSTER
+        
+        combatant = {
+            "name": monster.name or enemy.get("name", "未知敌人"),
+            "armor_class": monster.armor_class,
+            "initiative": monster.initiative,
+            "advantage": "none",
+            "hit_points": monster.hit_points,
+            "hit_dice": monster.hit_dice
+        }
+        
+        best = None
+        for action in monster.attacks():
+            estimate = expected_attack(action["attack_bonus"], target_ac, action["damage"])
+            if best is None or estimate["expected_damage"] > best[0]:
+                best = (estimate["expected_damage"], action)
+        if best is not None:
+            combatant.update({"attack_bonus": best[1]["attack_bonus"], "damage": best[1]["damage"],
+                              "action": best[1].get("name", "攻击")})
+        else:
+            combatant.update({"attack_bonus": 0, "damage": "1d4", "action": "攻击"})
+        
+        combatant.update({k: v for k, v in enemy.items() if k != "hit_points"})
+        if "hit_points" in enemy:
+            combatant["hit_points"], combatant["hit_dice"] = Monster.parse_hit_points(enemy["hit_points"])
+        return combatant
+    
+    def simulate(self, enemies: List[Union[str, Dict]], n: int = 10000, player: Dict = None,
+                 roll_hit_points: bool = True, max_rounds: int = MAX_ROUNDS,
+                 seed: Union[None, int, Dict, SeedSequence] = None) -> Dict:
+        """模拟n场完整战斗
+
+        规则: 双方按先攻顺序行动(平局玩家先手)；玩家每回合攻击一次，集中攻击最前面的存活敌人；
+        存活的敌人每回合各攻击一次；玩家生命值归零即失败，max_rounds回合内未分胜负记为僵持
+        """
+        started = time.perf_counter()
+        seed_sequence = as_seed_sequence(seed) if seed is not None else self.seed_sequence.spawn(1)[0]
+        rng = seed_sequence.generator()
+        
+        player = player or self.player_combatant()
+        player_ac = player["armor_class"]
+        enemies = [self.enemy_combatant(enemy, player_ac) for enemy in enemies]
+        m = len(enemies)
+        if not m:
+            raise ValueError("至少需要一个敌人")
+        
+        # 玩家对每个敌人的单次攻击伤害分布
+        player_attacks = [
+            DamageSampler(attack_damage_pmf(player["attack_bonus"], enemy["armor_class"],
+                                            player["damage"], player.get("advantage", "none")))
+            for enemy in enemies
+        ]
+        # 敌人按顺序被击倒，存活的总是第j个之后的全部敌人，预先卷积出它们一回合的合计伤害
+        enemy_attacks = [None] * m
+        combined = DicePMF.constant(0)
+        for j in range(m - 1, -1, -1):
+            enemy = enemies[j]
+            combined = combined + attack_damage_pmf(enemy["attack_bonus"], player_ac, enemy["damage"],
+                                                    enemy.get("advantage", "none"))
+            enemy_attacks[j] = DamageSampler(combined)
+        
+        # 每场战斗的状态按列保存
+        player_hp = [player["hit_points"]] * n
+        enemy_hp = []
+        for enemy in enemies:
+            if roll_hit_points and enemy.get("hit_dice"):
+                totals, _rolls = compile_expression(enemy["hit_dice"]).roll_many(n, rng)
+                enemy_hp.append([max(hp, 1) for hp in totals])
+            else:
+                enemy_hp.append([enemy["hit_points"]] * n)
+        
+        round_counts = Counter()
+        victory_rounds = Counter()
+        hp_remaining = Counter()
+        victories = 0
+        defeats = 0
+        
+        # 先攻：敌方先手的战斗在第1回合玩家行动前先挨一轮攻击
+        enemy_initiative = max(enemy["initiative"] for enemy in enemies)
+        player_rolls = rng.choices(_D20_FACES, k=n)
+        enemy_rolls = rng.choices(_D20_FACES, k=n)
+        bonus = player.get("initiative", 0) - enemy_initiative
+        ambushed = [i for i, a, b in zip(range(n), player_rolls, enemy_rolls) if a + bonus < b]
+        for i, damage in zip(ambushed, enemy_attacks[0].sample(rng, len(ambushed))):
+            player_hp[i] -= damage
+        fallen = sum(1 for i in ambushed if player_hp[i] <= 0)
+        if fallen:
+            defeats += fallen
+            round_counts[1] += fallen
+        groups = [[i for i in range(n) if player_hp[i] > 0]] + [[] for _ in range(m - 1)]
+        
+        for round_number in range(1, max_rounds + 1):
+            # 玩家阶段：按当前目标分组，每组一次性抽样伤害
+            next_groups = [[] for _ in range(m)]
+            won = []
+            for j in range(m):
+                group = groups[j]
+                if not group:
+                    continue
+                hp = enemy_hp[j]
+                alive = next_groups[j]
+                advance = next_groups[j + 1] if j + 1 < m else won
+                for i, damage in zip(group, player_attacks[j].sample(rng, len(group))):
+                    left = hp[i] - damage
+                    hp[i] = left
+                    if left > 0:
+                        alive.append(i)
+                    else:
+                        advance.append(i)
+            
+            if won:
+                victories += len(won)
+                round_counts[round_number] += len(won)
+                victory_rounds[round_number] += len(won)
+                hp_remaining.update(player_hp[i] for i in won)
+            
+            # 敌人阶段：每组存活敌人的合计伤害只抽样一次
+            active = 0
+            for j in range(m):
+                group = next_groups[j]
+                if not group:
+                    continue
+                survivors = []
+                for i, damage in zip(group, enemy_attacks[j].sample(rng, len(group))):
+                    left = player_hp[i] - damage
+                    player_hp[i] = left
+                    if left > 0:
+                        survivors.append(i)
+                fallen = len(group) - len(survivors)
+                if fallen:
+                    defeats += fallen
+                    round_counts[round_number] += fallen
+                next_groups[j] = survivors
+                active += len(survivors)
+            
+            groups = next_groups
+            if not active:
+                break
+        
+        stalemates = n - victories - defeats
+        elapsed = time.perf_counter() - started
+        finished = victories + defeats
+        
+        return {
+            "n": n,
+            "player": player["name"],
+            "enemies": [enemy["name"] for enemy in enemies],
+            "seed": seed_sequence.to_dict(),
+            "win_rate": victories / n,
+            "loss_rate": defeats / n,
+            "stalemate_rate": stalemates / n,
+            "rounds": {
+                "mean": sum(r * c for r, c in round_counts.items()) / finished if finished else None,
+                "distribution": {r: round_counts[r] / n for r in sorted(round_counts)},
+                "victory_distribution": {r: victory_rounds[r] / n for r in sorted(victory_rounds)}
+            },
+            "player_hp_remaining": {
+                "maximum": player["hit_points"],
+                "mean": sum(hp * c for hp, c in hp_remaining.items()) / victories if victories else None,
+                "distribution": {hp: hp_remaining[hp] / victories for hp in sorted(hp_remaining)}
+            },
+            "elapsed_seconds": elapsed,
+            "fights_per_second": n / elapsed if elapsed else None
+        }
+
+# 便捷函数
+def simulate_encounter(enemies: List[Union[str, Dict]], n: int = 10000, data_path: str = ".",
+                       seed: Union[None, int, Dict, SeedSequence] = None) -> Dict:
+    """模拟遭遇战"""
+    simulator = EncounterSimulator(data_path, seed)
+    return simulator.simulate(enemies, n)
+
+def main(argv: Optional[List[str]] = None):
+    """命令行入口: python -m utils.encounter_simulator goblin goblin -n 100000"""
+    parser = argparse.ArgumentParser(description="蒙特卡洛遭遇战模拟")
+    parser.add_argument("enemies", nargs="+", help="怪物图鉴键或名称，可重复")
+    parser.add_argument("-n", "--count", type=int, default=100000, help="模拟场数")
+    parser.add_argument("--seed", type=int, help="随机种子")
+    parser.add_argument("--data-path", default=".", help="数据目录")
+    parser.add_argument("--weapon", help="玩家使用的武器名称")
+    parser.add_argument("--fixed-hp", action="store_true", help="怪物使用平均生命值而不是掷生命骰")
+    args = parser.parse_args(argv)
+    
+    simulator = EncounterSimulator(args.data_path, args.seed)
+    report = simulator.simulate(args.enemies, args.count, simulator.player_combatant(args.weapon),
+                                roll_hit_points=not args.fixed_hp)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+
+if __name__ == "__main__":
+    main()
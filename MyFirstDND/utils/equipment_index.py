@@ -0,0 +1,218 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 装备索引
+items/equipment_database.json 按类别树组织(weapons.simple_melee、magic_items.rare、consumables.药水……)，
+EquipmentIndex 在加载时遍历一次，建立名称到记录、稀有度/伤害类型/属性/价格区间到物品列表的映射，
+之后按名称或属性查找都是字典查找，不再遍历类别树
+用法: python -m utils.equipment_index get 长剑 [--data-path .]
+      python -m utils.equipment_index find [--rarity uncommon] [--damage-type 挥砍] [--property 投掷] [--cost-band 10-100gp]
+"""
+
+import argparse
+import copy
+import json
+import re
+import sys
+from typing import Dict, List, Optional
+from .data_store import derived
+from .storage_backend import StorageBackend, open_storage
+
+# 不是物品的顶层条目
+NON_ITEM_SECTIONS = ("loot_tables",)
+
+# 类别 -> 战利品管理器使用的物品类型
+LOOT_TYPES = {
+    "weapons": "weapon",
+    "armor": "armor",
+    "shields": "shield",
+    "consumables": "consumable"
+}
+
+# 货币换算为金币
+COIN_VALUES = {"cp": 0.01, "sp": 0.1, "ep": 0.5, "gp": 1.0, "pp": 10.0}
+
+# 价格区间：(上限金币数(不含), 名称)，None表示没有上限
+COST_BANDS = [
+    (1, "<1gp"),
+    (10, "1-10gp"),
+    (100, "10-100gp"),
+    (1000, "100-1000gp"),
+    (None, "1000gp+")
+]
+# 没有标价的物品
+UNPRICED = "unpriced"
+
+_COST_PATTERN = re.compile(r'^\s*([\d,]+(?:\.\d+)?)\s*(cp|sp|ep|gp|pp)\s*$', re.IGNORECASE)
+
+def cost_in_gp(cost) -> Optional[float]:
+    """把 "15gp"、"5 sp" 这样的价格换算为金币数，无法识别时返回None"""
+    if isinstance(cost, (int, float)):
+        return float(cost)
+    if not isinstance(cost, str):
+        return None
+    match = _COST_PATTERN.match(cost)
+    if match is None:
+        return None
+    return float(match.group(1).replace(",", "")) * COIN_VALUES[match.group(2).lower()]
+
+def cost_band(cost) -> str:
+    """价格所在的区间名称"""
+    value = cost_in_gp(cost)
+    if value is None:
+        return UNPRICED
+    for upper, name in COST_BANDS:
+        if upper is None or value < upper:
+            return name
+    return COST_BANDS[-1][1]
+
+class EquipmentIndex:
+    """装备数据库的内存索引(记录与数据库文档共享，只读)"""
+    
+    def __init__(self, database: Dict):
+        """遍历类别树建立全部索引"""
+        self.by_name = {}
+        self.categories = {}
+        self.by_category = {}
+        self.by_rarity = {}
+        self.by_damage_type = {}
+        self.by_property = {}
+        self.by_cost_band = {}
+        
+        for section, tree in database.items():
+            if section in NON_ITEM_SECTIONS or not isinstance(tree, dict):
+                continue
+            self._index_tree(section, section, tree)
+    
+    def _index_tree(self, section: str, category: str, tree: Dict):
+        """递归登记类别树中的物品(带name字段的字典视为物品记录)"""
+        for key, node in tree.items():
+            if not isinstance(node, dict):
+                continue
+            if "name" in node:
+                self._add(section, category, node)
+            else:
+                self._index_tree(section, f"{category}.{key}", node)
+    
+    def _add(self, section: str, category: str, record: Dict):
+        """登记单个物品(重名时保留先出现的记录)"""
+        name = record["name"]
+        if name in self.by_name:
+            return
+        self.by_name[name] = record
+        self.categories[name] = category
+        self.by_category.setdefault(section, []).append(record)
+        if category != section:
+            self.by_category.setdefault(category, []).append(record)
+        self.by_rarity.setdefault(record.get("rarity", "common"), []).append(record)
+        if record.get("damage_type"):
+            self.by_damage_type.setdefault(record["damage_type"], []).append(record)
+        for prop in record.get("properties", []):
+            self.by_property.setdefault(prop, []).append(record)
+        self.by_cost_band.setdefault(cost_band(record.get("cost")), []).append(record)
+    
+    def __len__(self) -> int:
+        return len(self.by_name)
+    
+    def __contains__(self, name: str) -> bool:
+        return name in self.by_name
+    
+    def get(self, name: str) -> Optional[Dict]:
+        """按名称取物品记录"""
+        return self.by_name.get(name)
+    
+    def category_of(self, name: str) -> Optional[str]:
+        """物品所在的类别路径，如 "weapons.simple_melee" """
+        return self.categories.get(name)
+    
+    def loot_type(self, name: str) -> Optional[str]:
+        """物品对应的战利品类型(weapon/armor/shield/consumable)，魔法武器按其基础武器归类"""
+        record = self.by_name.get(name)
+        if record is None:
+            return None
+        section = self.categories[name].split(".", 1)[0]
+        if section in LOOT_TYPES:
+            return LOOT_TYPES[section]
+        if record.get("base_weapon"):
+            return "weapon"
+        return "misc"
+    
+    def find(self, rarity: str = None, damage_type: str = None, prop: str = None, band: str = None,
+             category: str = None) -> List[Dict]:
+        """按稀有度、伤害类型、属性、价格区间和类别组合查找，从最短的候选列表开始求交集"""
+        candidates = [index.get(value, []) for index, value in (
+            (self.by_rarity, rarity),
+            (self.by_damage_type, damage_type),
+            (self.by_property, prop),
+            (self.by_cost_band, band),
+            (self.by_category, category)
+        ) if value is not None]
+        if not candidates:
+            return list(self.by_name.values())
+        candidates.sort(key=len)
+        matched = candidates[0]
+        for other in candidates[1:]:
+            ids = {id(record) for record in other}
+            matched = [record for record in matched if id(record) in ids]
+        return list(matched)
+    
+    def enrich(self, item: Dict) -> Dict:
+        """用数据库中的标准数据补全战利品，返回新字典(战利品中已有的字段优先)
+
+        数据库中没有的物品原样返回；战利品没有type时按类别推断
+        """
+        record = self.by_name.get(item.get("name"))
+        if record is None:
+            return item
+        # 记录中的列表与共享缓存中的文档是同一对象，复制后再交给调用方修改
+        enriched = copy.deepcopy(record)
+        enriched.update(item)
+        if "type" not in item:
+            enriched["type"] = self.loot_type(item["name"])
+        return enriched
+
+def get_equipment_index(storage: StorageBackend) -> EquipmentIndex:
+    """取存储中装备数据库的索引(文件未变化时共享缓存返回同一个文档，索引不重建)"""
+    return derived(storage.load("equipment_database", {}), EquipmentIndex)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="按名称或属性查询装备数据库")
+    parser.add_argument("--data-path", default=".", help="数据目录")
+    subparsers = parser.add_subparsers(dest="command")
+    get_parser = subparsers.add_parser("get", help="按名称查找物品")
+    get_parser.add_argument("name", help="物品名称")
+    find_parser = subparsers.add_parser("find", help="按属性组合查找物品")
+    find_parser.add_argument("--rarity", help="稀有度(common/uncommon/rare...)")
+    find_parser.add_argument("--damage-type", help="伤害类型")
+    find_parser.add_argument("--property", help="武器属性")
+    find_parser.add_argument("--cost-band", choices=[name for _upper, name in COST_BANDS] + [UNPRICED],
+                             help="价格区间")
+    find_parser.add_argument("--category", help="类别(weapons 或 weapons.simple_melee)")
+    args = parser.parse_args(argv)
+    
+    storage = open_storage(args.data_path)
+    try:
+        index = get_equipment_index(storage)
+    finally:
+        storage.close()
+    
+    if args.command == "get":
+        record = index.get(args.name)
+        if record is None:
+            print(f"未找到物品: {args.name}", file=sys.stderr)
+            return 1
+        print(json.dumps(dict(record, category=index.category_of(args.name)), ensure_ascii=False, indent=2))
+        return 0
+    
+    if args.command == "find":
+        for record in index.find(args.rarity, args.damage_type, args.property, args.cost_band, args.category):
+            print(f"{record['name']}\t{index.category_of(record['name'])}\t{record.get('rarity', 'common')}\t"
+                  f"{record.get('cost', '-')}")
+        return 0
+    
+    parser.print_help()
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 跨进程文件锁
+多个工作进程共用一个数据目录时，用咨询锁保护读-改-写。
+数据文件通过重命名整体替换，不能直接对它加锁，所以每个数据文件旁有一个隐藏的锁文件(.<文件名>.lock)；
+单条记录(如一场战斗)的锁位于数据目录的 .locks/ 下。
+有 fcntl 时使用 flock(持有者进程退出时自动释放)，否则退化为独占创建锁文件的协议
+"""
+
+import os
+import re
+import time
+from contextlib import ExitStack, contextmanager
+from typing import Iterable, Iterator, Optional
+
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+# 默认等待锁的秒数
+DEFAULT_LOCK_TIMEOUT = 10.0
+# 记录锁目录(相对数据目录)
+RECORD_LOCK_DIR = ".locks"
+# 锁文件协议下，超过这个秒数的锁文件视为持有者已崩溃
+STALE_LOCK_SECONDS = 300.0
+
+# 重试间隔从最小值开始加倍，直到最大值
+_POLL_MIN = 0.001
+_POLL_MAX = 0.05
+
+class LockTimeout(TimeoutError):
+    """等待锁超时"""
+
+def lock_path(path: str) -> str:
+    """数据文件对应的锁文件路径"""
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f".{name}.lock")
+
+def record_lock_path(data_path: str, kind: str, key: str) -> str:
+    """单条记录(kind类记录中的key)对应的锁文件路径"""
+    safe_key = re.sub(r'[^\w.-]', '_', str(key))
+    return os.path.join(data_path, RECORD_LOCK_DIR, f"{kind}-{safe_key}.lock")
+
+class FileLock:
+    """基于锁文件的跨进程锁，shared为True时为共享(读)锁
+
+    同一进程内的不同线程也会互斥(每次加锁使用独立的文件描述符)，但同一线程不可重入
+    """
+    
+    def __init__(self, path: str, shared: bool = False, timeout: Optional[float] = DEFAULT_LOCK_TIMEOUT):
+        """path为锁文件路径；timeout为None时一直等待"""
+        self.path = path
+        self.shared = shared
+        self.timeout = timeout
+        self._fd = None
+    
+    @property
+    def locked(self) -> bool:
+        """是否持有锁"""
+        return self._fd is not None
+    
+    def acquire(self) -> "FileLock":
+        """加锁，超时时抛出LockTimeout"""
+        if self._fd is not None:
+            raise RuntimeError(f"锁已被持有: {self.path}")
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        deadline = None if self.timeout is None else time.monotonic() + self.timeout
+        delay = _POLL_MIN
+        while True:
+            if self._try_acquire():
+                return self
+            if deadline is not None and time.monotonic() >= deadline:
+                raise LockTimeout(f"等待锁超时({self.timeout}秒): {self.path}")
+            time.sleep(delay)
+            delay = min(delay * 2, _POLL_MAX)
+    
+    def _try_acquire(self) -> bool:
+        """尝试加锁一次，不等待"""
+        if fcntl is not None:
+            fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+            try:
+                fcntl.flock(fd, (fcntl.LOCK_SH if self.shared else fcntl.LOCK_EX) | fcntl.LOCK_NB)
+            except OSError:
+                os.close(fd)
+                return False
+            self._fd = fd
+            return True
+        
+        # 没有fcntl时：能独占创建锁文件的一方持有锁(共享锁也按独占处理)
+        try:
+            fd = os.open(self.path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o644)
+        except FileExistsError:
+            try:
+                if time.time() - os.path.getmtime(self.path) > STALE_LOCK_SECONDS:
+                    os.remove(self.path)
+            except OSError:
+                pass
+            return False
+        os.write(fd, str(os.getpid()).encode('ascii'))
+        self._fd = fd
+        return True
+    
+    def release(self):
+        """释放锁(未持有时忽略)"""
+        fd = self._fd
+        if fd is None:
+            return
+        self._fd = None
+        if fcntl is not None:
+            # 锁文件保留在原处：删除它会让正在等待的进程锁住一个已经脱离目录的文件
+            os.close(fd)
+        else:
+            os.close(fd)
+            os.remove(self.path)
+    
+    def __enter__(self) -> "FileLock":
+        return self.acquire()
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.release()
+        return False
+
+@contextmanager
+def hold_locks(paths: Iterable[str], shared: bool = False,
+               timeout: Optional[float] = DEFAULT_LOCK_TIMEOUT) -> Iterator[None]:
+    """按路径排序依次加锁(避免不同进程交叉等待成环)，退出时全部释放"""
+    with ExitStack() as stack:
+        for path in sorted(set(paths)):
+            stack.enter_context(FileLock(path, shared, timeout))
+        yield
+
+def record_lock(data_path: str, kind: str, key: str, timeout: Optional[float] = DEFAULT_LOCK_TIMEOUT) -> FileLock:
+    """单条记录的独占锁(用于with语句)"""
+    return FileLock(record_lock_path(data_path, kind, key), timeout=timeout)
@@ -92,6 +92,34 @@ class GameAnalyzer:
         
         return recommendations
     
+    def estimate_attack(self, attack_bonus: int, target_ac: int, weapon_damage: str,
+                        advantage: str = "none") -> Dict:
+        """精确计算单次攻击的命中率、重击率和期望伤害(不需要战斗记录)"""
+        from rules.dice_probability import expected_attack
+        
+        return dict(expected_attack(attack_bonus, target_ac, weapon_damage, advantage))
+    
+    def compare_expected_performance(self, analysis: Dict, attacks: List[Dict]) -> Dict:
+        """把实际战斗表现与同样攻击的理论期望值对比"""
+        from rules.dice_probability import expected_attack
+        
+        expected_damage = 0.0
+        expected_hits = 0.0
+        for attack in attacks:
+            estimate = expected_attack(attack["attack_bonus"], attack["target_ac"],
+                                       attack["weapon_damage"], attack.get("advantage", "none"))
+            expected_damage += estimate["expected_damage"]
+            expected_hits += estimate["hit_chance"]
+        
+        expected_hit_rate = expected_hits / len(attacks) if attacks else 0.0
+        return {
+            "expected_damage": expected_damage,
+            "actual_damage": analysis.get("player_damage_dealt", 0),
+            "expected_hit_rate": expected_hit_rate,
+            "actual_hit_rate": analysis.get("hit_rate", 0.0),
+            "damage_luck": analysis.get("player_damage_dealt", 0) - expected_damage
+        }
+    
     def generate_report(self) -> str:
         """生成分析报告"""
         report = []
@@ -0,0 +1,192 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 战斗历史归档
+combat_history.json 只保留未满一段的已结束战斗和有限长度的 recent_combats，
+每满 history_segment_size 场就把它们压缩写入 combat/archive/ 下编号的归档分段
+用法: python -m utils.history_archive compact [--data-path .] [--window 20] [--segment-size 50] [--all]
+      python -m utils.history_archive list [--data-path .]
+"""
+
+import argparse
+import gzip
+import json
+import lzma
+import os
+import sys
+from typing import Dict, Iterator, List, Optional
+from .data_store import read_document
+from .data_transaction import DataTransaction
+from .file_lock import DEFAULT_LOCK_TIMEOUT
+from .serialization import COMPACT, READABLE, dumps, loads
+
+# 归档分段目录(相对数据目录)
+ARCHIVE_DIR = "combat/archive"
+# 默认保留的最近战斗数量
+DEFAULT_RECENT_WINDOW = 20
+# 默认每个归档分段的战斗数量
+DEFAULT_SEGMENT_SIZE = 50
+# 默认压缩格式
+DEFAULT_COMPRESSION = "gzip"
+
+# 压缩格式 -> (文件后缀, 压缩, 解压)
+COMPRESSORS = {
+    "gzip": (".json.gz", gzip.compress, gzip.decompress),
+    "lzma": (".json.xz", lzma.compress, lzma.decompress)
+}
+
+def storage_settings(data_path: str = ".") -> Dict:
+    """读取 config/game_config.json 中的 storage_settings，缺失项使用默认值"""
+    settings = {
+        "recent_combats_window": DEFAULT_RECENT_WINDOW,
+        "history_segment_size": DEFAULT_SEGMENT_SIZE,
+        "archive_compression": DEFAULT_COMPRESSION,
+        "json_format": COMPACT,
+        "lock_timeout": DEFAULT_LOCK_TIMEOUT
+    }
+    config_file = os.path.join(data_path, "config/game_config.json")
+    try:
+        settings.update(read_document(config_file, {}).get("storage_settings", {}))
+    except (OSError, ValueError):
+        pass
+    return settings
+
+class HistoryArchive:
+    """战斗历史归档：维护最近战斗窗口，把已满的战斗段轮转为压缩分段"""
+    
+    def __init__(self, data_path: str = ".", recent_window: Optional[int] = None,
+                 segment_size: Optional[int] = None, compression: Optional[str] = None):
+        """初始化归档(未指定的参数取自配置文件)"""
+        settings = storage_settings(data_path)
+        self.data_path = data_path
+        self.recent_window = recent_window if recent_window is not None else settings["recent_combats_window"]
+        self.segment_size = max(segment_size or settings["history_segment_size"], 1)
+        self.compression = compression or settings["archive_compression"]
+        if self.compression not in COMPRESSORS:
+            raise ValueError(f"未知的压缩格式: {self.compression}")
+    
+    def append(self, combat_history: Dict, combat: Dict, transaction: DataTransaction):
+        """把已结束的战斗加入历史，必要时在同一事务中轮转出一个归档分段"""
+        combat_history.setdefault("combat_sessions", []).append(combat)
+        combat_history.setdefault("recent_combats", []).append(combat)
+        self.trim_recent(combat_history)
+        self.rotate(combat_history, transaction)
+    
+    def trim_recent(self, combat_history: Dict):
+        """把 recent_combats 截断到窗口大小"""
+        recent = combat_history.get("recent_combats", [])
+        if len(recent) > self.recent_window:
+            del recent[:len(recent) - self.recent_window]
+    
+    def rotate(self, combat_history: Dict, transaction: DataTransaction, flush_all: bool = False) -> int:
+        """把已满的战斗段写入归档分段，返回新写入的分段数
+
+        flush_all为True时不足一段的剩余战斗也一并归档
+        """
+        sessions = combat_history.get("combat_sessions", [])
+        written = 0
+        while len(sessions) >= self.segment_size or (flush_all and sessions):
+            chunk = sessions[:self.segment_size]
+            self._write_segment(combat_history, chunk, transaction)
+            del sessions[:len(chunk)]
+            written += 1
+        return written
+    
+    def _write_segment(self, combat_history: Dict, chunk: List[Dict], transaction: DataTransaction):
+        """压缩写入一个分段，并在历史文件的分段索引中登记"""
+        index = combat_history.setdefault("archive_segments", [])
+        number = index[-1]["segment"] + 1 if index else 1
+        suffix, compress, _decompress = COMPRESSORS[self.compression]
+        relative_path = f"{ARCHIVE_DIR}/segment_{number:06d}{suffix}"
+        payload = dumps({"segment": number, "combat_sessions": chunk})
+        transaction.put_bytes(os.path.join(self.data_path, relative_path), compress(payload))
+        
+        start_times = [c.get("start_time", "") for c in chunk]
+        index.append({
+            "segment": number,
+            "file": relative_path,
+            "compression": self.compression,
+            "combats": len(chunk),
+            "first_start": min(start_times),
+            "last_start": max(start_times)
+        })
+    
+    def load_segment(self, entry: Dict) -> List[Dict]:
+        """读取一个归档分段中的全部战斗"""
+        _suffix, _compress, decompress = COMPRESSORS[entry.get("compression", DEFAULT_COMPRESSION)]
+        with open(os.path.join(self.data_path, entry["file"]), 'rb') as f:
+            return loads(decompress(f.read()))["combat_sessions"]
+    
+    def has_combat(self, combat_id: str, combat_history: Dict, start_time: Optional[str] = None) -> bool:
+        """在归档分段中查找战斗ID，给出开始时间时只读取时间范围覆盖它的分段"""
+        for entry in combat_history.get("archive_segments", []):
+            if start_time is not None and not entry["first_start"] <= start_time <= entry["last_start"]:
+                continue
+            if any(c.get("combat_id") == combat_id for c in self.load_segment(entry)):
+                return True
+        return False
+    
+    def iter_combats(self, combat_history: Dict, since: str = None, until: str = None) -> Iterator[Dict]:
+        """按时间顺序遍历归档分段和热文件中的战斗，跳过时间范围之外的分段"""
+        for entry in combat_history.get("archive_segments", []):
+            if since is not None and entry["last_start"] < since:
+                continue
+            if until is not None and entry["first_start"] >= until:
+                continue
+            yield from self.load_segment(entry)
+        yield from combat_history.get("combat_sessions", [])
+
+def compact_history(data_path: str = ".", recent_window: Optional[int] = None, segment_size: Optional[int] = None,
+                    compression: Optional[str] = None, flush_all: bool = False) -> Dict:
+    """压缩已有战役的战斗历史：截断 recent_combats，并把已满的战斗段写入归档"""
+    archive = HistoryArchive(data_path, recent_window, segment_size, compression)
+    history_file = os.path.join(data_path, "combat/combat_history.json")
+    size_before = os.path.getsize(history_file)
+    
+    settings = storage_settings(data_path)
+    with DataTransaction(data_path, settings["json_format"] == READABLE, settings["lock_timeout"]) as transaction:
+        combat_history = transaction.update(history_file)
+        archive.trim_recent(combat_history)
+        segments = archive.rotate(combat_history, transaction, flush_all)
+    
+    return {
+        "segments_written": segments,
+        "segments_total": len(combat_history.get("archive_segments", [])),
+        "combats_in_hot_file": len(combat_history.get("combat_sessions", [])),
+        "bytes_before": size_before,
+        "bytes_after": os.path.getsize(history_file)
+    }
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="战斗历史归档：轮转压缩分段、截断最近战斗窗口")
+    parser.add_argument("--data-path", default=".", help="数据目录")
+    subparsers = parser.add_subparsers(dest="command")
+    compact_parser = subparsers.add_parser("compact", help="压缩已有的战斗历史")
+    compact_parser.add_argument("--window", type=int, help="recent_combats 保留的战斗数量")
+    compact_parser.add_argument("--segment-size", type=int, help="每个归档分段的战斗数量")
+    compact_parser.add_argument("--compression", choices=sorted(COMPRESSORS), help="归档压缩格式")
+    compact_parser.add_argument("--all", action="store_true", help="不足一段的战斗也全部归档")
+    subparsers.add_parser("list", help="列出归档分段")
+    args = parser.parse_args(argv)
+    
+    if args.command == "compact":
+        summary = compact_history(args.data_path, args.window, args.segment_size, args.compression, args.all)
+        print(f"写入 {summary['segments_written']} 个归档分段(共 {summary['segments_total']} 个)，"
+              f"热文件保留 {summary['combats_in_hot_file']} 场战斗，"
+              f"{summary['bytes_before']} -> {summary['bytes_after']} 字节")
+        return 0
+    
+    if args.command == "list":
+        with open(os.path.join(args.data_path, "combat/combat_history.json"), 'r', encoding='utf-8') as f:
+            combat_history = json.load(f)
+        for entry in combat_history.get("archive_segments", []):
+            print(f"{entry['segment']:6d}  {entry['combats']:5d} 场  {entry['first_start']} ~ {entry['last_start']}  "
+                  f"{entry['file']}")
+        return 0
+    
+    parser.print_help()
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
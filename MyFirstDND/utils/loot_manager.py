@@ -5,113 +5,179 @@ DND跑团库 - 战利品管理器
 自动管理装备获得、消耗和更新
 """
 
-import json
 import os
+import threading
+from contextlib import contextmanager
 from datetime import datetime
-from typing import Dict, List, Optional
+from typing import Dict, Iterator, List, Optional
+from .async_io import write_coalescer
+from .data_store import derived
+from .equipment_index import EquipmentIndex, get_equipment_index
+from .models import CONSUMABLE_TYPES, Armor, Character, Consumable, Item, Weapon
+from .storage_backend import StorageBackend, open_storage
 
 class LootManager:
     """战利品管理器 - 自动管理装备和物品"""
     
-    def __init__(self, data_path: str = "."):
-        """初始化管理器"""
+    def __init__(self, data_path: str = ".", storage: Optional[StorageBackend] = None):
+        """初始化管理器(storage不指定时按数据目录自动选择存储后端)"""
         self.data_path = data_path
+        self.storage = storage or open_storage(data_path)
         self.player_character_file = os.path.join(data_path, "characters/player_character.json")
         self.equipment_database_file = os.path.join(data_path, "items/equipment_database.json")
+        # 各线程进行中的背包事务(线程池中的异步写入不会并入调用线程的事务)
+        self._local = threading.local()
         
+    @contextmanager
+    def transaction(self) -> Iterator[Character]:
+        """背包事务：with块内的 add_loot/remove_item/equip_item/use_consumable/auto_organize_inventory
+        都作用于同一份内存中的角色数据，整个事务只读取和保存一次角色文件
+
+        with块正常结束时提交；事务中的操作出错时异常直接抛出，整个事务回滚，不会保存一半的修改。
+        事务期间持有角色文件的跨进程锁，其他进程的修改不会被覆盖；嵌套使用时并入外层事务
+        """
+        active = self._active()
+        if active is not None:
+            yield active
+            return
+        
+        with self.storage.transaction() as transaction:
+            player_data = transaction.update("player_character")
+            character = Character.from_dict(player_data)
+            self._local.character = character
+            try:
+                yield character
+            finally:
+                self._local.character = None
+            player_data.update(character.to_dict())
+    
+    def _active(self) -> Optional[Character]:
+        """当前线程进行中的背包事务中的角色数据"""
+        return getattr(self._local, "character", None)
+    
+    def _failed(self, action: str, e: Exception):
+        """操作出错：在背包事务中时继续抛出以回滚整个事务，否则打印错误"""
+        if self._active() is not None:
+            raise e
+        print(f"{action}时出错: {e}")
+    
+    def _character(self) -> Character:
+        """角色数据的只读模型(角色文件未变化时不重建)；在背包事务中时返回事务中的数据"""
+        active = self._active()
+        if active is not None:
+            return active
+        return derived(self.storage.load("player_character"), Character.from_dict)
+    
     def add_loot(self, loot_items: List[Dict]) -> bool:
         """添加战利品到角色装备"""
         try:
             # 加载角色数据
-            with open(self.player_character_file, 'r', encoding='utf-8') as f:
-                player_data = json.load(f)
-            
-            # 处理每个战利品
-            for item in loot_items:
-                self._add_single_item(player_data, item)
-            
-            # 保存更新
-            with open(self.player_character_file, 'w', encoding='utf-8') as f:
-                json.dump(player_data, f, ensure_ascii=False, indent=2)
+            with self.transaction() as character:
+                # 处理每个战利品
+                for item in loot_items:
+                    self._add_single_item(character, item)
             
             return True
             
         except Exception as e:
-            print(f"添加战利品时出错: {e}")
+            self._failed("添加战利品", e)
             return False
     
-    def _add_single_item(self, player_data: Dict, item: Dict):
-        """添加单个物品"""
+    async def add_loot_async(self, loot_items: List[Dict]) -> bool:
+        """add_loot的异步版本：并发的添加请求合并成一次读写，在线程池中执行"""
+        # 按绝对路径合并，经不同相对路径访问同一数据目录的管理器也合并到同一批
+        key = ("player_character", os.path.abspath(self.data_path))
+        return await write_coalescer.submit(key, self._add_loot_batch, loot_items)
+    
+    def _add_loot_batch(self, batches: List[List[Dict]]) -> List[bool]:
+        """读取一次角色数据，依次添加多批战利品后只保存一次"""
+        try:
+            with self.transaction() as character:
+                for loot_items in batches:
+                    for item in loot_items:
+                        self._add_single_item(character, item)
+            return [True] * len(batches)
+            
+        except Exception as e:
+            print(f"添加战利品时出错: {e}")
+            return [False] * len(batches)
+    
+    @property
+    def equipment_index(self) -> EquipmentIndex:
+        """装备数据库索引(数据库文件变化后才重建)"""
+        return get_equipment_index(self.storage)
+    
+    def _add_single_item(self, character: Character, item: Dict):
+        """添加单个物品(先用装备数据库中的标准数据补全)"""
+        item = self.equipment_index.enrich(item)
         item_type = item.get("type", "misc")
         item_name = item.get("name", "未知物品")
         
         if item_type == "weapon":
             # 添加到武器列表
-            if "weapons" not in player_data["equipment"]:
-                player_data["equipment"]["weapons"] = []
+            if character.weapons is None:
+                character.weapons = []
             
             # 检查是否已存在
-            existing_weapon = next((w for w in player_data["equipment"]["weapons"] if w["name"] == item_name), None)
+            existing_weapon = next((w for w in character.weapons if w.name == item_name), None)
             if existing_weapon:
                 # 更新现有武器
                 existing_weapon.update(item)
             else:
                 # 添加新武器
-                player_data["equipment"]["weapons"].append(item)
+                character.weapons.append(Weapon.from_dict(item))
                 
         elif item_type == "armor":
             # 添加到护甲
-            player_data["equipment"]["armor"] = item
+            character.armor = Armor.from_dict(item)
             
         elif item_type == "shield":
             # 添加到盾牌
-            player_data["equipment"]["shield"] = item
+            character.shield = Armor.from_dict(item)
             
         elif item_type == "consumable":
             # 添加到消耗品列表
-            if "items" not in player_data["equipment"]:
-                player_data["equipment"]["items"] = []
+            if character.items is None:
+                character.items = []
             
             # 查找现有消耗品
-            existing_item = next((i for i in player_data["equipment"]["items"] if i["name"] == item_name), None)
-            if existing_item and "quantity" in existing_item:
-                existing_item["quantity"] += item.get("quantity", 1)
+            existing_item = next((i for i in character.items if i.name == item_name), None)
+            if existing_item and existing_item.quantity is not None:
+                existing_item.quantity += item.get("quantity", 1)
             else:
-                player_data["equipment"]["items"].append(item)
+                character.items.append(Consumable.from_dict(item))
                 
         elif item_type == "ammunition":
             # 添加到弹药
-            if "items" not in player_data["equipment"]:
-                player_data["equipment"]["items"] = []
+            if character.items is None:
+                character.items = []
             
-            existing_ammo = next((i for i in player_data["equipment"]["items"] if i["name"] == item_name), None)
+            existing_ammo = next((i for i in character.items if i.name == item_name), None)
             if existing_ammo:
-                existing_ammo["quantity"] += item.get("quantity", 1)
+                existing_ammo.quantity = (existing_ammo.quantity or 0) + item.get("quantity", 1)
             else:
-                player_data["equipment"]["items"].append(item)
+                character.items.append(Item.from_dict(item))
         
         # 更新库存
-        self._update_inventory(player_data, item)
+        self._update_inventory(character, item)
     
-    def _update_inventory(self, player_data: Dict, item: Dict):
+    def _update_inventory(self, character: Character, item: Dict):
         """更新库存信息"""
-        inventory = player_data.get("inventory", {})
-        
         # 更新金币
         if "gold" in item:
-            inventory["gold"] = inventory.get("gold", 0) + item["gold"]
+            character.gold = (character.gold or 0) + item["gold"]
         
         # 更新宝石
         if "gems" in item:
-            if "gems" not in inventory:
-                inventory["gems"] = []
-            inventory["gems"].extend(item["gems"])
+            if character.gems is None:
+                character.gems = []
+            character.gems.extend(item["gems"])
         
         # 更新魔法物品
         if item.get("rarity") in ["uncommon", "rare", "very_rare", "legendary"]:
-            if "magic_items" not in inventory:
-                inventory["magic_items"] = []
-            inventory["magic_items"].append({
+            if character.magic_items is None:
+                character.magic_items = []
+            character.magic_items.append({
                 "name": item["name"],
                 "type": item.get("type", "unknown"),
                 "rarity": item.get("rarity", "common")
@@ -120,128 +186,105 @@ class LootManager:
     def remove_item(self, item_name: str, quantity: int = 1) -> bool:
         """移除物品"""
         try:
-            with open(self.player_character_file, 'r', encoding='utf-8') as f:
-                player_data = json.load(f)
-            
-            # 从装备中移除
-            if "weapons" in player_data["equipment"]:
-                player_data["equipment"]["weapons"] = [
-                    w for w in player_data["equipment"]["weapons"] 
-                    if w["name"] != item_name
-                ]
-            
-            # 从物品中移除
-            if "items" in player_data["equipment"]:
-                for item in player_data["equipment"]["items"]:
-                    if item["name"] == item_name:
-                        if "quantity" in item:
-                            item["quantity"] -= quantity
-                            if item["quantity"] <= 0:
-                                player_data["equipment"]["items"].remove(item)
-                        else:
-                            player_data["equipment"]["items"].remove(item)
-                        break
-            
-            # 保存更新
-            with open(self.player_character_file, 'w', encoding='utf-8') as f:
-                json.dump(player_data, f, ensure_ascii=False, indent=2)
+            with self.transaction() as character:
+                self._remove_from(character, item_name, quantity)
             
             return True
             
         except Exception as e:
-            print(f"移除物品时出错: {e}")
+            self._failed("移除物品", e)
             return False
     
+    def _remove_from(self, character: Character, item_name: str, quantity: int):
+        """从内存中的角色数据移除物品"""
+        # 从装备中移除
+        if character.weapons is not None:
+            character.weapons = [w for w in character.weapons if w.name != item_name]
+        
+        # 从物品中移除
+        if character.items is not None:
+            for item in character.items:
+                if item.name == item_name:
+                    if item.quantity is not None:
+                        item.quantity -= quantity
+                        if item.quantity <= 0:
+                            character.items.remove(item)
+                    else:
+                        character.items.remove(item)
+                    break
+    
     def use_consumable(self, item_name: str) -> Optional[Dict]:
-        """使用消耗品"""
+        """使用消耗品(药水等)，在同一次读写中找到并扣除一个，返回使用的物品"""
         try:
-            with open(self.player_character_file, 'r', encoding='utf-8') as f:
-                player_data = json.load(f)
+            # 背包里没有时不打开事务，也就不会重写角色文件
+            if self._find_consumable(self._character(), item_name) is None:
+                return None
             
-            # 查找消耗品
-            if "items" in player_data["equipment"]:
-                for item in player_data["equipment"]["items"]:
-                    if item["name"] == item_name and item.get("type") == "药水":
-                        # 使用消耗品
-                        if self.remove_item(item_name, 1):
-                            return item
-                        break
+            with self.transaction() as character:
+                item = self._find_consumable(character, item_name)
+                if item is None:
+                    return None
+                used = item.to_dict()
+                self._remove_from(character, item_name, 1)
             
-            return None
+            return used
             
         except Exception as e:
-            print(f"使用消耗品时出错: {e}")
+            self._failed("使用消耗品", e)
             return None
     
+    def _find_consumable(self, character: Character, item_name: str) -> Optional[Item]:
+        """查找消耗品(类型为consumable或药水)"""
+        for item in character.items or []:
+            if item.name == item_name and item.type in CONSUMABLE_TYPES:
+                return item
+        return None
+    
     def equip_item(self, item_name: str, slot: str) -> bool:
         """装备物品"""
         try:
-            with open(self.player_character_file, 'r', encoding='utf-8') as f:
-                player_data = json.load(f)
-            
-            # 查找物品
-            item = self._find_item(player_data, item_name)
-            if not item:
+            # 背包里没有时不打开事务，也就不会重写角色文件
+            if self._character().find_item(item_name) is None:
                 return False
             
-            # 装备到指定槽位
-            if slot == "weapon":
-                # 装备武器
-                if "equipped_weapon" not in player_data["equipment"]:
-                    player_data["equipment"]["equipped_weapon"] = {}
-                player_data["equipment"]["equipped_weapon"] = item
-                
-            elif slot == "armor":
-                # 装备护甲
-                player_data["equipment"]["armor"] = item
+            with self.transaction() as character:
+                # 查找物品
+                item = character.find_item(item_name)
+                if not item:
+                    return False
                 
-            elif slot == "shield":
-                # 装备盾牌
-                player_data["equipment"]["shield"] = item
-            
-            # 保存更新
-            with open(self.player_character_file, 'w', encoding='utf-8') as f:
-                json.dump(player_data, f, ensure_ascii=False, indent=2)
+                # 装备到指定槽位
+                if slot == "weapon":
+                    # 装备武器
+                    character.equipped_weapon = item
+                    
+                elif slot == "armor":
+                    # 装备护甲
+                    character.armor = item
+                    
+                elif slot == "shield":
+                    # 装备盾牌
+                    character.shield = item
             
             return True
             
         except Exception as e:
-            print(f"装备物品时出错: {e}")
+            self._failed("装备物品", e)
             return False
     
-    def _find_item(self, player_data: Dict, item_name: str) -> Optional[Dict]:
-        """查找物品"""
-        # 在武器中查找
-        if "weapons" in player_data["equipment"]:
-            for weapon in player_data["equipment"]["weapons"]:
-                if weapon["name"] == item_name:
-                    return weapon
-        
-        # 在物品中查找
-        if "items" in player_data["equipment"]:
-            for item in player_data["equipment"]["items"]:
-                if item["name"] == item_name:
-                    return item
-        
-        return None
-    
     def get_equipment_summary(self) -> Dict:
         """获取装备摘要"""
         try:
-            with open(self.player_character_file, 'r', encoding='utf-8') as f:
-                player_data = json.load(f)
-            
-            equipment = player_data.get("equipment", {})
-            inventory = player_data.get("inventory", {})
+            character = self._character()
             
             summary = {
-                "weapons": len(equipment.get("weapons", [])),
-                "armor": equipment.get("armor", {}).get("name", "无"),
-                "shield": equipment.get("shield", {}).get("name", "无"),
-                "items": len(equipment.get("items", [])),
-                "gold": inventory.get("gold", 0),
-                "magic_items": len(inventory.get("magic_items", [])),
-                "gems": len(inventory.get("gems", []))
+                "weapons": len(character.weapons or []),
+                "armor": getattr(character.armor, "name", None) or "无",
+                "shield": getattr(character.shield, "name", None) or "无",
+                "items": len(character.items or []),
+                "gold": character.gold or 0,
+                "magic_items": len(character.magic_items or []),
+                "gems": len(character.gems or [])
             }
             
             return summary
@@ -253,38 +296,32 @@ class LootManager:
     def auto_organize_inventory(self) -> bool:
         """自动整理库存"""
         try:
-            with open(self.player_character_file, 'r', encoding='utf-8') as f:
-                player_data = json.load(f)
-            
-            # 整理物品分类
-            if "items" in player_data["equipment"]:
-                organized_items = []
-                consumables = []
-                ammunition = []
-                tools = []
-                
-                for item in player_data["equipment"]["items"]:
-                    item_type = item.get("type", "misc")
-                    if item_type == "药水":
-                        consumables.append(item)
-                    elif item_type == "弹药":
-                        ammunition.append(item)
-                    elif item_type == "工具":
-                        tools.append(item)
-                    else:
-                        organized_items.append(item)
-                
-                # 重新组织物品列表
-                player_data["equipment"]["items"] = organized_items + consumables + ammunition + tools
-            
-            # 保存更新
-            with open(self.player_character_file, 'w', encoding='utf-8') as f:
-                json.dump(player_data, f, ensure_ascii=False, indent=2)
+            with self.transaction() as character:
+                # 整理物品分类
+                if character.items is not None:
+                    organized_items = []
+                    consumables = []
+                    ammunition = []
+                    tools = []
+                    
+                    for item in character.items:
+                        item_type = item.type or "misc"
+                        if item_type in CONSUMABLE_TYPES:
+                            consumables.append(item)
+                        elif item_type == "弹药":
+                            ammunition.append(item)
+                        elif item_type == "工具":
+                            tools.append(item)
+                        else:
+                            organized_items.append(item)
+                    
+                    # 重新组织物品列表
+                    character.items = organized_items + consumables + ammunition + tools
             
             return True
             
         except Exception as e:
-            print(f"自动整理库存时出错: {e}")
+            self._failed("自动整理库存", e)
             return False
 
 # 便捷函数
@@ -0,0 +1,260 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 怪物图鉴索引
+MonsterIndex 在加载 monsters/monster_manual.json 时一次性建立按挑战等级、经验值、类型、体型和环境的查找表，
+并把怪物按挑战等级和经验值排成有序数组，范围查询(挑战等级a到b、经验值不超过n)用二分查找完成，
+按经验值预算生成候选遭遇时只扫描落在预算窗口内的怪物，图鉴扩充到上千个自制怪物后依然很快
+用法: python -m utils.monster_index encounters 400 [--max-monsters 6] [--environment 森林] [--limit 10]
+      python -m utils.monster_index range [--cr-min 0.25] [--cr-max 1] [--xp-max 100]
+"""
+
+import argparse
+import sys
+from bisect import bisect_left, bisect_right
+from fractions import Fraction
+from typing import Dict, List, Optional, Tuple
+from .data_store import derived
+from .storage_backend import StorageBackend, open_storage
+
+# 挑战等级 -> 经验值(怪物没有给出experience_points时使用)
+CR_EXPERIENCE = {
+    0: 10, 0.125: 25, 0.25: 50, 0.5: 100, 1: 200, 2: 450, 3: 700, 4: 1100, 5: 1800,
+    6: 2300, 7: 2900, 8: 3900, 9: 5000, 10: 5900, 11: 7200, 12: 8400, 13: 10000, 14: 11500,
+    15: 13000, 16: 15000, 17: 18000, 18: 20000, 19: 22000, 20: 25000, 21: 33000, 22: 41000,
+    23: 50000, 24: 62000, 25: 75000, 26: 90000, 27: 105000, 28: 120000, 29: 135000, 30: 155000
+}
+
+# 遭遇中怪物数量 -> 经验值倍率：(数量上限(含), 倍率)，None表示没有上限
+MONSTER_COUNT_MULTIPLIERS = [
+    (1, 1.0),
+    (2, 1.5),
+    (6, 2.0),
+    (10, 2.5),
+    (14, 3.0),
+    (None, 4.0)
+]
+
+# 候选遭遇的调整后经验值至少达到预算的比例
+DEFAULT_MIN_FILL = 0.5
+
+def parse_challenge_rating(value) -> float:
+    """把 0.25、"1/4"、"2" 这样的挑战等级转换为数值"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return float(Fraction(str(value).strip()))
+
+def count_multiplier(count: int) -> float:
+    """怪物数量对应的经验值倍率"""
+    for upper, multiplier in MONSTER_COUNT_MULTIPLIERS:
+        if upper is None or count <= upper:
+            return multiplier
+    return MONSTER_COUNT_MULTIPLIERS[-1][1]
+
+def _as_tags(value) -> List[str]:
+    """环境标签可以是字符串或列表"""
+    if isinstance(value, str):
+        return [value]
+    return list(value or [])
+
+class MonsterIndex:
+    """怪物图鉴的内存索引(怪物记录与图鉴文档共享，只读)"""
+    
+    def __init__(self, manual: Dict):
+        """建立查找表和有序数组"""
+        self.monsters = {}
+        self.by_name = {}
+        self.by_cr = {}
+        self.by_xp = {}
+        self.by_type = {}
+        self.by_size = {}
+        self.by_environment = {}
+        self.builder = manual.get("encounter_builder", {})
+        
+        entries = []
+        for key, monster in manual.get("monsters", {}).items():
+            cr = parse_challenge_rating(monster.get("challenge_rating", 0))
+            xp = monster.get("experience_points", CR_EXPERIENCE.get(cr, 0))
+            self.monsters[key] = monster
+            self.by_name[monster.get("name", key)] = key
+            self.by_cr.setdefault(cr, []).append(key)
+            self.by_xp.setdefault(xp, []).append(key)
+            if monster.get("type"):
+                self.by_type.setdefault(monster["type"], []).append(key)
+            if monster.get("size"):
+                self.by_size.setdefault(monster["size"], []).append(key)
+            for tag in _as_tags(monster.get("environment")):
+                self.by_environment.setdefault(tag, []).append(key)
+            entries.append((cr, xp, key))
+        
+        # 有序数组：数值数组供二分查找，键数组与之一一对应
+        entries.sort(key=lambda e: (e[0], e[2]))
+        self.cr_values = [cr for cr, _xp, _key in entries]
+        self.cr_keys = [key for _cr, _xp, key in entries]
+        entries.sort(key=lambda e: (e[1], e[2]))
+        self.xp_values = [xp for _cr, xp, _key in entries]
+        self.xp_keys = [key for _cr, _xp, key in entries]
+        self.xp_of = {key: xp for _cr, xp, key in entries}
+        self.cr_of = {key: cr for cr, _xp, key in entries}
+    
+    def __len__(self) -> int:
+        return len(self.monsters)
+    
+    def get(self, key_or_name: str) -> Optional[Dict]:
+        """按图鉴键(goblin)或名称(哥布林)取怪物"""
+        if key_or_name in self.monsters:
+            return self.monsters[key_or_name]
+        key = self.by_name.get(key_or_name)
+        return self.monsters[key] if key is not None else None
+    
+    def cr_between(self, low: float = None, high: float = None) -> List[str]:
+        """挑战等级在[low, high]内的怪物键，按挑战等级排序"""
+        start = 0 if low is None else bisect_left(self.cr_values, low)
+        end = len(self.cr_values) if high is None else bisect_right(self.cr_values, high)
+        return self.cr_keys[start:end]
+    
+    def xp_between(self, low: int = None, high: int = None) -> List[str]:
+        """经验值在[low, high]内的怪物键，按经验值排序"""
+        start = 0 if low is None else bisect_left(self.xp_values, low)
+        end = len(self.xp_values) if high is None else bisect_right(self.xp_values, high)
+        return self.xp_keys[start:end]
+    
+    def xp_at_most(self, budget: int) -> List[str]:
+        """经验值不超过budget的怪物键"""
+        return self.xp_between(None, budget)
+    
+    def find(self, monster_type: str = None, size: str = None, environment: str = None,
+             cr_min: float = None, cr_max: float = None) -> List[str]:
+        """按类型、体型、环境和挑战等级范围组合查找，结果按挑战等级排序"""
+        keys = self.cr_between(cr_min, cr_max)
+        for table, value in ((self.by_type, monster_type), (self.by_size, size),
+                             (self.by_environment, environment)):
+            if value is not None:
+                allowed = set(table.get(value, []))
+                keys = [key for key in keys if key in allowed]
+        return keys
+    
+    def suggested_cr(self, difficulty: str, level: int) -> Optional[float]:
+        """encounter_builder.challenge_rating_guide 中某难度、某等级建议的挑战等级"""
+        guide = self.builder.get("challenge_rating_guide", {}).get(difficulty, {})
+        suffix = {1: "st", 2: "nd", 3: "rd"}.get(level, "th")
+        value = guide.get(f"{level}{suffix}_level")
+        return parse_challenge_rating(value) if value is not None else None
+    
+    def difficulty_multiplier(self, players: int) -> float:
+        """encounter_builder.difficulty_multipliers 中某玩家人数的难度倍率，超出表格时取最大人数的值"""
+        multipliers = self.builder.get("difficulty_multipliers", {})
+        key = "1_player" if players == 1 else f"{players}_players"
+        if key in multipliers:
+            return multipliers[key]
+        return multipliers[max(multipliers, key=lambda k: int(k.split("_", 1)[0]))] if multipliers else 1.0
+    
+    def candidate_encounters(self, xp_budget: int, max_monsters: int = 6, limit: int = 20,
+                             min_fill: float = DEFAULT_MIN_FILL, allowed: Optional[List[str]] = None,
+                             mixed: bool = True) -> List[Dict]:
+        """按经验值预算生成候选遭遇，调整后经验值(基础经验值x数量倍率)在[min_fill*预算, 预算]内
+
+        allowed: 只使用这些怪物(如 find() 的结果)
+        mixed: 同时生成"一个首领+若干同种随从"的两种怪物组合
+        返回按调整后经验值从高到低排序的前limit个
+        """
+        allowed_set = set(allowed) if allowed is not None else None
+        floor = xp_budget * min_fill
+        candidates = []
+        
+        for count in range(1, max_monsters + 1):
+            multiplier = count_multiplier(count)
+            # 单种怪物：每只的经验值必须落在[floor, budget] / (count*multiplier)内
+            for key in self._window(floor / (count * multiplier), xp_budget / (count * multiplier),
+                                    allowed_set, limit):
+                candidates.append(self._encounter([(key, count)], multiplier))
+            
+            if not mixed or count < 2:
+                continue
+            # 首领+随从：首领从高经验值一侧取，随从的经验值上限由剩余预算决定
+            budget_base = xp_budget / multiplier
+            for leader in self._window(0, budget_base, allowed_set, limit):
+                remaining = budget_base - self.xp_of[leader]
+                minions = count - 1
+                for minion in self._window((floor / multiplier - self.xp_of[leader]) / minions,
+                                           min(remaining / minions, self.xp_of[leader]), allowed_set, 3):
+                    if minion != leader:
+                        candidates.append(self._encounter([(leader, 1), (minion, minions)], multiplier))
+        
+        candidates.sort(key=lambda c: (-c["adjusted_xp"], c["count"]))
+        return candidates[:limit]
+    
+    def _window(self, low: float, high: float, allowed_set: Optional[set], limit: int) -> List[str]:
+        """经验值在[low, high]内的怪物，从高经验值一侧最多取limit个"""
+        start = bisect_left(self.xp_values, max(low, 0))
+        end = bisect_right(self.xp_values, high)
+        picked = []
+        for i in range(end - 1, start - 1, -1):
+            key = self.xp_keys[i]
+            if allowed_set is None or key in allowed_set:
+                picked.append(key)
+                if len(picked) >= limit:
+                    break
+        return picked
+    
+    def _encounter(self, groups: List[Tuple[str, int]], multiplier: float) -> Dict:
+        """组装候选遭遇"""
+        base_xp = sum(self.xp_of[key] * count for key, count in groups)
+        return {
+            "monsters": [{"id": key, "name": self.monsters[key].get("name", key), "count": count,
+                          "challenge_rating": self.cr_of[key]} for key, count in groups],
+            "count": sum(count for _key, count in groups),
+            "base_xp": base_xp,
+            "multiplier": multiplier,
+            "adjusted_xp": base_xp * multiplier
+        }
+
+def get_monster_index(storage: StorageBackend) -> MonsterIndex:
+    """取存储中怪物图鉴的索引(文件未变化时共享缓存返回同一个文档，索引不重建)"""
+    return derived(storage.load("monster_manual", {}), MonsterIndex)
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="怪物图鉴查询与遭遇生成")
+    parser.add_argument("--data-path", default=".", help="数据目录")
+    subparsers = parser.add_subparsers(dest="command")
+    range_parser = subparsers.add_parser("range", help="按挑战等级/经验值范围和标签查询怪物")
+    encounter_parser = subparsers.add_parser("encounters", help="按经验值预算生成候选遭遇")
+    encounter_parser.add_argument("budget", type=int, help="经验值预算")
+    encounter_parser.add_argument("--max-monsters", type=int, default=6, help="每个遭遇最多的怪物数量")
+    encounter_parser.add_argument("--limit", type=int, default=10, help="输出的候选数量")
+    for sub in (range_parser, encounter_parser):
+        sub.add_argument("--cr-min", type=parse_challenge_rating, help="最低挑战等级")
+        sub.add_argument("--cr-max", type=parse_challenge_rating, help="最高挑战等级")
+        sub.add_argument("--type", help="生物类型")
+        sub.add_argument("--size", help="体型")
+        sub.add_argument("--environment", help="环境标签")
+    range_parser.add_argument("--xp-max", type=int, help="经验值上限")
+    args = parser.parse_args(argv)
+    
+    if args.command not in ("range", "encounters"):
+        parser.print_help()
+        return 1
+    
+    storage = open_storage(args.data_path)
+    try:
+        index = get_monster_index(storage)
+    finally:
+        storage.close()
+    
+    keys = index.find(args.type, args.size, args.environment, args.cr_min, args.cr_max)
+    if args.command == "range":
+        if args.xp_max is not None:
+            cheap = set(index.xp_at_most(args.xp_max))
+            keys = [key for key in keys if key in cheap]
+        for key in keys:
+            print(f"{key}\t{index.monsters[key].get('name', key)}\tCR {index.cr_of[key]:g}\t{index.xp_of[key]} XP")
+        return 0
+    
+    for encounter in index.candidate_encounters(args.budget, args.max_monsters, args.limit, allowed=keys):
+        groups = " + ".join(f"{m['name']}x{m['count']}" for m in encounter["monsters"])
+        print(f"{encounter['adjusted_xp']:8.0f} XP  ({encounter['base_xp']} x {encounter['multiplier']:g})  {groups}")
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - JSON序列化
+程序维护的数据文件默认以紧凑格式写入，安装了 orjson 时自动使用它编码和解析，
+需要人工查看时用 export 命令导出带缩进的可读副本
+用法: python -m utils.serialization export [--data-path .] [--output export]
+"""
+
+import argparse
+import json
+import os
+import sys
+from typing import Any, List, Optional, Union
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+# 紧凑格式：程序维护的文件默认使用
+COMPACT = "compact"
+# 可读格式：两空格缩进
+READABLE = "readable"
+
+def encoder_name() -> str:
+    """当前使用的编码器"""
+    return "orjson" if orjson is not None else "json"
+
+def dumps(obj: Any, readable: bool = False) -> bytes:
+    """编码为UTF-8 JSON字节串"""
+    if orjson is not None:
+        option = orjson.OPT_NON_STR_KEYS
+        if readable:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, option=option)
+    if readable:
+        return json.dumps(obj, ensure_ascii=False, indent=2).encode('utf-8')
+    return json.dumps(obj, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def loads(data: Union[str, bytes]) -> Any:
+    """解析JSON"""
+    if orjson is not None:
+        return orjson.loads(data)
+    return json.loads(data)
+
+def load_file(path: str) -> Any:
+    """读取并解析JSON文件"""
+    with open(path, 'rb') as f:
+        return loads(f.read())
+
+def export_readable(data_path: str = ".", output_dir: Optional[str] = None) -> List[str]:
+    """把全部数据文档导出为带缩进的可读JSON，返回写入的文件列表
+
+    output_dir 为None时就地改写数据目录中的文件(此后程序再次写入时仍恢复为配置的格式)
+    """
+    from .data_transaction import DataTransaction
+    from .storage_backend import DOCUMENTS, open_storage
+    
+    storage = open_storage(data_path)
+    written = []
+    try:
+        if output_dir is None:
+            # 就地改写只调整格式，不把SQLite中的数据写回JSON；
+            # 在事务中加锁读取、临时文件+重命名替换，崩溃或并发的战斗结算都不会截断或覆盖数据文件
+            paths = [os.path.join(data_path, relative_path) for relative_path in DOCUMENTS.values()]
+            with DataTransaction(data_path, True, storage.lock_timeout) as transaction:
+                transaction.acquire(*paths)
+                for path in paths:
+                    if transaction.update(path) is not None:
+                        written.append(path)
+            return written
+        
+        for name, relative_path in DOCUMENTS.items():
+            document = storage.load(name)
+            if document is None:
+                continue
+            path = os.path.join(output_dir, relative_path)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(dumps(document, readable=True))
+            written.append(path)
+    finally:
+        storage.close()
+    return written
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="导出带缩进的可读JSON，便于人工查看数据文件")
+    parser.add_argument("--data-path", default=".", help="数据目录")
+    subparsers = parser.add_subparsers(dest="command")
+    export_parser = subparsers.add_parser("export", help="导出可读JSON")
+    export_parser.add_argument("--output", default="export", help="导出目录")
+    export_parser.add_argument("--in-place", action="store_true", help="就地改写数据目录中的文件")
+    args = parser.parse_args(argv)
+    
+    if args.command == "export":
+        written = export_readable(args.data_path, None if args.in_place else args.output)
+        for path in written:
+            print(path)
+        print(f"已导出 {len(written)} 个文件(编码器: {encoder_name()})", file=sys.stderr)
+        return 0
+    
+    parser.print_help()
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,392 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - SQLite存储后端
+战斗、回合、参战者、战利品和冒险会话日志存入带索引的SQLite表(WAL模式)，
+角色、平衡性分析等其余文档仍是JSON文件，与表在同一个提交中生效
+用法: python -m utils.sqlite_storage migrate [--data-path .]
+      python -m utils.sqlite_storage query --enemy 狼 --since 2024-01-01 --until 2024-02-01
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import sys
+import threading
+import time
+from typing import Any, Dict, List, Optional
+from .data_transaction import DataTransaction, apply_renames, discard_staged, recover_pending_commit
+from .file_lock import hold_locks, lock_path
+from .serialization import dumps, loads
+from .storage_backend import SQLITE_FILE, JsonStorage, StorageTransaction
+
+# load("combat_history") 附带的最近战斗数量
+RECENT_COMBATS = 10
+# 单条SQL中IN(...)参数的最大数量
+IN_CHUNK = 500
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS combats (
+    combat_id TEXT PRIMARY KEY,
+    start_time TEXT,
+    end_time TEXT,
+    victory INTEGER,
+    round_count INTEGER,
+    damage_dealt INTEGER,
+    damage_taken INTEGER,
+    body TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS idx_combats_start_time ON combats(start_time);
+CREATE TABLE IF NOT EXISTS rounds (
+    combat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    round INTEGER,
+    type TEXT,
+    body TEXT NOT NULL,
+    PRIMARY KEY (combat_id, seq)
+);
+CREATE TABLE IF NOT EXISTS participants (
+    combat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT,
+    monster_id TEXT,
+    body TEXT NOT NULL,
+    PRIMARY KEY (combat_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_participants_name ON participants(name, combat_id);
+CREATE INDEX IF NOT EXISTS idx_participants_monster ON participants(monster_id, combat_id);
+CREATE TABLE IF NOT EXISTS loot (
+    combat_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    name TEXT,
+    type TEXT,
+    body TEXT NOT NULL,
+    PRIMARY KEY (combat_id, seq)
+);
+CREATE INDEX IF NOT EXISTS idx_loot_name ON loot(name);
+CREATE TABLE IF NOT EXISTS session_logs (
+    session_number INTEGER PRIMARY KEY,
+    date TEXT,
+    body TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS pending_renames (
+    temp_path TEXT PRIMARY KEY,
+    path TEXT NOT NULL
+);
+"""
+
+def _encode(value: Any) -> str:
+    """编码为紧凑JSON文本"""
+    return dumps(value).decode('utf-8')
+
+def _session_number(session: Dict, index: int) -> int:
+    """会话编号，缺失时按位置编号"""
+    return int(session.get("session_number") or index + 1)
+
+class SqliteTransaction(StorageTransaction):
+    """SQLite后端的事务：表数据和JSON文档在同一个数据库提交中生效"""
+    
+    def __init__(self, storage: "SqliteStorage"):
+        """初始化事务"""
+        self.storage = storage
+        self.documents = DataTransaction(storage.data_path, storage.readable, storage.lock_timeout)
+        self.combats = []
+        self.session_logs = None
+        self._session_bodies = {}
+    
+    def update(self, name: str, default: Any = None) -> Any:
+        """读取文档并标记为待写入；冒险日志的session_logs来自数据库"""
+        document = self.documents.update(self.storage.path(name), default)
+        if name == "adventure_log" and document is not None and self.session_logs is None:
+            stored = self.storage.load_session_logs()
+            if stored:
+                document["session_logs"] = stored
+                self._session_bodies = {_session_number(s, i): _encode(s) for i, s in enumerate(stored)}
+            # 数据库里还没有会话日志时沿用JSON中的，提交时一并导入
+            self.session_logs = document.setdefault("session_logs", [])
+        return document
+    
+    def lock(self, *names: str):
+        """按路径排序锁住文档对应的JSON文件"""
+        self.documents.acquire(*[self.storage.path(name) for name in names])
+    
+    def add_combat(self, combat: Dict):
+        """登记一场已结束的战斗"""
+        self.combats.append(combat)
+    
+    def commit(self):
+        """先写JSON临时文件，再在一个数据库事务中写入表数据和重命名清单，最后重命名"""
+        try:
+            self._commit()
+        finally:
+            self.documents.release()
+    
+    def rollback(self):
+        """放弃全部修改"""
+        self.documents.rollback()
+        self.combats = []
+    
+    def _commit(self):
+        """提交(调用方负责释放JSON文件锁)"""
+        adventure_path = self.storage.path("adventure_log")
+        changed_sessions = []
+        if self.session_logs is not None:
+            for i, session in enumerate(self.session_logs):
+                number = _session_number(session, i)
+                body = _encode(session)
+                if self._session_bodies.get(number) != body:
+                    changed_sessions.append((number, session.get("date"), body))
+            # 会话日志只保存在数据库中
+            self.documents.put(adventure_path, dict(self.documents.documents[adventure_path], session_logs=[]))
+        
+        renames = self.documents.stage()
+        storage = self.storage
+        with storage.lock:
+            connection = storage.connection
+            try:
+                connection.execute("BEGIN IMMEDIATE")
+                for combat in self.combats:
+                    storage.insert_combat(combat)
+                connection.executemany(
+                    "INSERT OR REPLACE INTO session_logs (session_number, date, body) VALUES (?, ?, ?)",
+                    changed_sessions)
+                # 提交点：重命名清单和表数据一起落盘
+                connection.executemany("INSERT OR REPLACE INTO pending_renames (temp_path, path) VALUES (?, ?)",
+                                       renames)
+                connection.execute("COMMIT")
+            except Exception:
+                connection.execute("ROLLBACK")
+                discard_staged(renames)
+                raise
+            
+            apply_renames(renames)
+            connection.executemany("DELETE FROM pending_renames WHERE temp_path = ?",
+                                   [(temp_path,) for temp_path, _path in renames])
+        self.combats = []
+
+class SqliteStorage(JsonStorage):
+    """SQLite存储：战斗历史和冒险会话日志在数据库中，其余文档沿用JSON文件"""
+    
+    def __init__(self, data_path: str = ".", db_file: Optional[str] = None):
+        """打开(必要时创建)数据库"""
+        super().__init__(data_path)
+        self.db_file = db_file or os.path.join(data_path, SQLITE_FILE)
+        self.lock = threading.RLock()
+        # 手动管理事务；同一连接可被多个线程使用，由self.lock串行化
+        self.connection = sqlite3.connect(self.db_file, timeout=self.lock_timeout, isolation_level=None,
+                                          check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        # 提交即持久化，保证数据库和重命名后的JSON文件一致
+        self.connection.execute("PRAGMA synchronous=FULL")
+        self.connection.executescript(SCHEMA)
+    
+    def load(self, name: str, default: Any = None) -> Any:
+        """读取文档；冒险日志附带数据库中的会话日志，战斗历史附带最近的战斗"""
+        document = super().load(name, default)
+        if not isinstance(document, dict):
+            return document
+        # 缓存中的文档是共享对象，不能原地合并数据库内容，返回浅拷贝
+        if name == "adventure_log":
+            stored = self.load_session_logs()
+            if stored:
+                document = dict(document, session_logs=stored)
+        elif name == "combat_history" and not document.get("combat_sessions"):
+            recent = self.query_combats(latest=RECENT_COMBATS)
+            if recent:
+                document = dict(document, recent_combats=recent)
+        return document
+    
+    def transaction(self) -> SqliteTransaction:
+        """开始一个多文档事务"""
+        return SqliteTransaction(self)
+    
+    def load_session_logs(self) -> List[Dict]:
+        """按编号读取全部会话日志"""
+        with self.lock:
+            rows = self.connection.execute("SELECT body FROM session_logs ORDER BY session_number").fetchall()
+        return [loads(body) for body, in rows]
+    
+    def insert_combat(self, combat: Dict) -> bool:
+        """写入一场战斗及其回合、参战者和战利品(需在事务内调用)，已存在时跳过"""
+        combat_id = combat["combat_id"]
+        rounds = combat.get("rounds", [])
+        enemies = combat.get("enemies", [])
+        loot = combat.get("loot_gained", [])
+        body = {k: v for k, v in combat.items() if k not in ("rounds", "enemies", "loot_gained")}
+        cursor = self.connection.execute(
+            "INSERT OR IGNORE INTO combats (combat_id, start_time, end_time, victory, round_count, "
+            "damage_dealt, damage_taken, body) VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+            (combat_id, combat.get("start_time"), combat.get("end_time"), int(bool(combat.get("victory", False))),
+             len(rounds), combat.get("player_damage_dealt", 0), combat.get("enemy_damage_dealt", 0), _encode(body)))
+        if cursor.rowcount == 0:
+            return False
+        
+        self.connection.executemany(
+            "INSERT INTO rounds (combat_id, seq, round, type, body) VALUES (?, ?, ?, ?, ?)",
+            [(combat_id, i, r.get("round"), r.get("type"), _encode(r)) for i, r in enumerate(rounds)])
+        self.connection.executemany(
+            "INSERT INTO participants (combat_id, seq, name, monster_id, body) VALUES (?, ?, ?, ?, ?)",
+            [(combat_id, i, e.get("name"), e.get("id"), _encode(e)) if isinstance(e, dict)
+             else (combat_id, i, str(e), None, _encode(e)) for i, e in enumerate(enemies)])
+        self.connection.executemany(
+            "INSERT INTO loot (combat_id, seq, name, type, body) VALUES (?, ?, ?, ?, ?)",
+            [(combat_id, i, item.get("name"), item.get("type"), _encode(item)) for i, item in enumerate(loot)
+             if isinstance(item, dict)])
+        return True
+    
+    def has_combat(self, combat_id: str, start_time: Optional[str] = None) -> bool:
+        """按主键查找战斗(全部历史都在同一张表中，不需要start_time)"""
+        with self.lock:
+            row = self.connection.execute("SELECT 1 FROM combats WHERE combat_id = ?", (combat_id,)).fetchone()
+        return row is not None
+    
+    def query_combats(self, enemy: str = None, since: str = None, until: str = None,
+                      victory: bool = None, limit: int = None, include_rounds: bool = False,
+                      latest: int = None) -> List[Dict]:
+        """通过索引查询历史战斗；latest取最近的N场(仍按开始时间正序返回)"""
+        conditions = []
+        params = []
+        if enemy is not None:
+            if since is None and until is None:
+                # 没有时间范围时从参战者索引出发
+                conditions.append("combat_id IN (SELECT combat_id FROM participants WHERE name = ? "
+                                  "UNION SELECT combat_id FROM participants WHERE monster_id = ?)")
+            else:
+                # 有时间范围时从开始时间索引出发，逐场检查参战者
+                conditions.append("EXISTS (SELECT 1 FROM participants p WHERE p.combat_id = combats.combat_id "
+                                  "AND (p.name = ? OR p.monster_id = ?))")
+            params.extend([enemy, enemy])
+        if since is not None:
+            conditions.append("start_time >= ?")
+            params.append(since)
+        if until is not None:
+            conditions.append("start_time < ?")
+            params.append(until)
+        if victory is not None:
+            conditions.append("victory = ?")
+            params.append(int(victory))
+        
+        sql = "SELECT combat_id, body FROM combats"
+        if conditions:
+            sql += " WHERE " + " AND ".join(conditions)
+        if latest is not None:
+            sql += " ORDER BY start_time DESC LIMIT ?"
+            params.append(latest)
+        else:
+            sql += " ORDER BY start_time"
+            if limit is not None:
+                sql += " LIMIT ?"
+                params.append(limit)
+        
+        with self.lock:
+            rows = self.connection.execute(sql, params).fetchall()
+            if latest is not None:
+                rows.reverse()
+            combats = {combat_id: loads(body) for combat_id, body in rows}
+            children = [("participants", "enemies"), ("loot", "loot_gained")]
+            if include_rounds:
+                children.append(("rounds", "rounds"))
+            for combat in combats.values():
+                for _table, key in children:
+                    combat[key] = []
+            ids = list(combats)
+            for start in range(0, len(ids), IN_CHUNK):
+                chunk = ids[start:start + IN_CHUNK]
+                placeholders = ",".join("?" * len(chunk))
+                for table, key in children:
+                    for combat_id, body in self.connection.execute(
+                            f"SELECT combat_id, body FROM {table} WHERE combat_id IN ({placeholders}) "
+                            f"ORDER BY combat_id, seq", chunk):
+                        combats[combat_id][key].append(loads(body))
+        return list(combats.values())
+    
+    def recover(self):
+        """补完数据库已提交但JSON文件尚未重命名的事务"""
+        recover_pending_commit(self.data_path, self.lock_timeout)
+        with self.lock:
+            renames = [list(row) for row in self.connection.execute("SELECT temp_path, path FROM pending_renames")]
+            if not renames:
+                return
+            # 其他进程可能正在提交这些文件，等它释放文件锁后再补完
+            with hold_locks([lock_path(path) for _temp, path in renames], timeout=self.lock_timeout):
+                apply_renames(renames)
+            self.connection.executemany("DELETE FROM pending_renames WHERE temp_path = ?",
+                                        [(temp_path,) for temp_path, _path in renames])
+    
+    def close(self):
+        """关闭数据库连接"""
+        with self.lock:
+            self.connection.close()
+
+def migrate_json_to_sqlite(data_path: str = ".", keep_backup: bool = True) -> Dict:
+    """把combat_history.json中的历史战斗和adventure_log.json中的会话日志导入SQLite
+
+    导入后JSON文件中对应的列表被清空(默认先备份为 .bak)，之后open_storage会自动使用SQLite后端
+    """
+    storage = SqliteStorage(data_path)
+    try:
+        storage.recover()
+        history_file = storage.path("combat_history")
+        adventure_file = storage.path("adventure_log")
+        if keep_backup:
+            for path in (history_file, adventure_file):
+                if os.path.exists(path):
+                    shutil.copy2(path, path + ".bak")
+        
+        transaction = storage.transaction()
+        transaction.lock("combat_history", "adventure_log")
+        combat_history = transaction.update("combat_history")
+        # 包括已轮转进归档分段的战斗
+        sessions = list(storage.archive.iter_combats(combat_history)) if combat_history else []
+        for combat in sessions:
+            transaction.add_combat(combat)
+        if combat_history is not None:
+            combat_history["combat_sessions"] = []
+            combat_history["recent_combats"] = []
+        adventure_log = transaction.update("adventure_log")
+        session_logs = len(adventure_log.get("session_logs", [])) if adventure_log else 0
+        transaction.commit()
+        
+        return {"combats": len(sessions), "session_logs": session_logs, "db_file": storage.db_file}
+    finally:
+        storage.close()
+
+def main(argv: Optional[List[str]] = None) -> int:
+    """命令行入口"""
+    parser = argparse.ArgumentParser(description="SQLite存储后端：迁移JSON数据、查询战斗历史")
+    parser.add_argument("--data-path", default=".", help="数据目录")
+    subparsers = parser.add_subparsers(dest="command")
+    migrate_parser = subparsers.add_parser("migrate", help="把JSON中的战斗历史和会话日志导入SQLite")
+    migrate_parser.add_argument("--no-backup", action="store_true", help="不备份原JSON文件")
+    query_parser = subparsers.add_parser("query", help="查询历史战斗，每行输出一场战斗(JSON)")
+    query_parser.add_argument("--enemy", help="敌人名称或怪物ID")
+    query_parser.add_argument("--since", help="开始时间下限(ISO格式，含)")
+    query_parser.add_argument("--until", help="开始时间上限(ISO格式，不含)")
+    query_parser.add_argument("--victory", choices=["yes", "no"], help="只看胜利或失败的战斗")
+    query_parser.add_argument("--limit", type=int, help="最多返回的战斗数量")
+    query_parser.add_argument("--rounds", action="store_true", help="包含逐回合记录")
+    args = parser.parse_args(argv)
+    
+    if args.command == "migrate":
+        summary = migrate_json_to_sqlite(args.data_path, keep_backup=not args.no_backup)
+        print(f"已导入 {summary['combats']} 场战斗、{summary['session_logs']} 条会话日志到 {summary['db_file']}")
+        return 0
+    
+    if args.command == "query":
+        storage = SqliteStorage(args.data_path)
+        victory = None if args.victory is None else args.victory == "yes"
+        start = time.perf_counter()
+        combats = storage.query_combats(args.enemy, args.since, args.until, victory, args.limit, args.rounds)
+        elapsed = (time.perf_counter() - start) * 1000
+        storage.close()
+        for combat in combats:
+            print(_encode(combat))
+        print(f"共 {len(combats)} 场战斗，查询耗时 {elapsed:.1f} ms", file=sys.stderr)
+        return 0
+    
+    parser.print_help()
+    return 1
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,207 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+DND跑团库 - 存储后端
+战斗记录器、战利品管理器和AI指令加载器通过统一的存储接口读写数据，
+JsonStorage 保持原有的JSON文件布局，SqliteStorage(见 sqlite_storage.py)把战斗历史和冒险日志放入SQLite
+"""
+
+import os
+from typing import Any, Dict, List, Optional
+from .data_store import read_document
+from .data_transaction import DataTransaction, atomic_write_json, recover_pending_commit
+from .history_archive import HistoryArchive, storage_settings
+from .serialization import READABLE
+
+# 文档名 -> 数据目录下的JSON文件
+DOCUMENTS = {
+    "player_character": "characters/player_character.json",
+    "combat_history": "combat/combat_history.json",
+    "balance_analysis": "combat/balance_analysis.json",
+    "adventure_log": "adventures/adventure_log.json",
+    "equipment_database": "items/equipment_database.json",
+    "monster_manual": "monsters/monster_manual.json"
+}
+
+# SQLite数据库文件(位于数据目录下)，存在时默认使用SQLite后端
+SQLITE_FILE = "dnd_storage.sqlite3"
+
+def combat_matches(combat: Dict, enemy: str = None, since: str = None, until: str = None,
+                   victory: bool = None) -> bool:
+    """判断战斗是否满足查询条件(since/until为ISO时间字符串，until不含)"""
+    start_time = combat.get("start_time", "")
+    if since is not None and start_time < since:
+        return False
+    if until is not None and start_time >= until:
+        return False
+    if victory is not None and bool(combat.get("victory", False)) != victory:
+        return False
+    if enemy is not None:
+        return any(isinstance(e, dict) and enemy in (e.get("name"), e.get("id"))
+                   for e in combat.get("enemies", []))
+    return True
+
+class StorageTransaction:
+    """存储事务接口：在内存中修改文档、登记已结束的战斗，commit时一次性生效"""
+    
+    def update(self, name: str, default: Any = None) -> Any:
+        """读取文档并标记为待写入，返回的对象可以直接原地修改"""
+        raise NotImplementedError
+    
+    def lock(self, *names: str):
+        """一次性按固定顺序锁住要修改的全部文档(修改多个文档的事务在读取前调用)"""
+        raise NotImplementedError
+    
+    def add_combat(self, combat: Dict):
+        """登记一场已结束的战斗(包含全部回合)"""
+        raise NotImplementedError
+    
+    def commit(self):
+        """提交全部修改"""
+        raise NotImplementedError
+    
+    def rollback(self):
+        """放弃全部修改并释放锁"""
+        raise NotImplementedError
+    
+    def __enter__(self) -> "StorageTransaction":
+        return self
+    
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is None:
+            self.commit()
+        else:
+            self.rollback()
+        return False
+
+class StorageBackend:
+    """存储后端接口"""
+    
+    def load(self, name: str, default: Any = None) -> Any:
+        """读取文档，不存在时返回default(返回的文档只读，修改请使用事务)"""
+        raise NotImplementedError
+    
+    def save(self, name: str, document: Any):
+        """原子地保存单个文档"""
+        raise NotImplementedError
+    
+    def transaction(self) -> StorageTransaction:
+        """开始一个多文档事务"""
+        raise NotImplementedError
+    
+    def has_combat(self, combat_id: str, start_time: Optional[str] = None) -> bool:
+        """战斗是否已经合并进历史(包括已归档的战斗)，start_time用于缩小查找范围"""
+        raise NotImplementedError
+    
+    def query_combats(self, enemy: str = None, since: str = None, until: str = None,
+                      victory: bool = None, limit: int = None, include_rounds: bool = False) -> List[Dict]:
+        """按敌人名称或ID、开始时间范围和胜负查询历史战斗，按开始时间排序"""
+        raise NotImplementedError
+    
+    def recover(self):
+        """启动时补完中断的提交"""
+    
+    def close(self):
+        """释放资源"""
+
+class JsonTransaction(StorageTransaction):
+    """JSON后端的事务：每个文件只解析一次，通过DataTransaction统一提交"""
+    
+    def __init__(self, storage: "JsonStorage"):
+        """初始化事务"""
+        self.storage = storage
+        self.data = DataTransaction(storage.data_path, storage.readable, storage.lock_timeout)
+    
+    def update(self, name: str, default: Any = None) -> Any:
+        """读取文档并标记为待写入"""
+        return self.data.update(self.storage.path(name), default)
+    
+    def lock(self, *names: str):
+        """按路径排序锁住文档对应的文件"""
+        self.data.acquire(*[self.storage.path(name) for name in names])
+    
+    def add_combat(self, combat: Dict):
+        """把战斗加入combat_history.json，已满一段时在同一事务中轮转为归档分段"""
+        self.storage.archive.append(self.update("combat_history"), combat, self.data)
+    
+    def commit(self):
+        """提交全部修改"""
+        self.data.commit()
+    
+    def rollback(self):
+        """放弃全部修改"""
+        self.data.rollback()
+
+class JsonStorage(StorageBackend):
+    """JSON文件存储：保持原有的数据目录布局"""
+    
+    def __init__(self, data_path: str = "."):
+        """初始化存储"""
+        self.data_path = data_path
+        self.archive = HistoryArchive(data_path)
+        # 程序维护的文件默认紧凑写入，storage_settings.json_format 为 "readable" 时带缩进
+        settings = storage_settings(data_path)
+        self.readable = settings["json_format"] == READABLE
+        # 等待其他进程释放文件锁的秒数
+        self.lock_timeout = settings["lock_timeout"]
+    
+    def path(self, name: str) -> str:
+        """文档对应的文件路径"""
+        return os.path.join(self.data_path, DOCUMENTS.get(name, name))
+    
+    def load(self, name: str, default: Any = None) -> Any:
+        """读取JSON文档(返回共享缓存中的对象，调用方不得修改；文件变化后才重新解析)"""
+        return read_document(self.path(name), default)
+    
+    def save(self, name: str, document: Any):
+        """原子地保存JSON文档"""
+        atomic_write_json(self.path(name), document, self.readable, self.lock_timeout)
+    
+    def transaction(self) -> JsonTransaction:
+        """开始一个多文档事务"""
+        return JsonTransaction(self)
+    
+    def has_combat(self, combat_id: str, start_time: Optional[str] = None) -> bool:
+        """先在combat_history.json中查找战斗ID，找不到时再查归档分段
+
+        合并完成后战斗可能已随轮转进入归档，且不在最近战斗窗口中(窗口为0或已被挤出)
+        """
+        combat_history = self.load("combat_history", {})
+        if any(c.get("combat_id") == combat_id
+               for key in ("combat_sessions", "recent_combats") for c in combat_history.get(key, [])):
+            return True
+        return self.archive.has_combat(combat_id, combat_history, start_time)
+    
+    def query_combats(self, enemy: str = None, since: str = None, until: str = None,
+                      victory: bool = None, limit: int = None, include_rounds: bool = False) -> List[Dict]:
+        """逐条扫描归档分段(按时间范围跳过)和combat_history.json中的历史战斗"""
+        combat_history = self.load("combat_history", {})
+        matched = [c for c in self.archive.iter_combats(combat_history, since, until)
+                   if combat_matches(c, enemy, since, until, victory)]
+        matched.sort(key=lambda c: c.get("start_time", ""))
+        if limit is not None:
+            matched = matched[:limit]
+        if not include_rounds:
+            matched = [{k: v for k, v in c.items() if k != "rounds"} for c in matched]
+        return matched
+    
+    def recover(self):
+        """根据提交意图文件补完中断的提交"""
+        recover_pending_commit(self.data_path, self.lock_timeout)
+
+def open_storage(data_path: str = ".", backend: Optional[str] = None) -> StorageBackend:
+    """打开存储后端
+
+    backend: "json" 或 "sqlite"；不指定时数据目录下已有SQLite数据库就用SQLite，否则用JSON
+    """
+    if backend is None:
+        backend = "sqlite" if os.path.exists(os.path.join(data_path, SQLITE_FILE)) else "json"
+    if backend == "json":
+        storage = JsonStorage(data_path)
+    elif backend == "sqlite":
+        from .sqlite_storage import SqliteStorage
+        storage = SqliteStorage(data_path)
+    else:
+        raise ValueError(f"未知的存储后端: {backend}")
+    storage.recover()
+    return storage
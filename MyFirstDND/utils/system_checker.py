@@ -5,17 +5,18 @@ DND跑团库 - 系统检查器
 验证系统完整性，确保所有组件正常工作
 """
 
-import json
 import os
 import sys
-from typing import Dict, List, Tuple
+from typing import Dict, List, Optional, Tuple
+from .storage_backend import StorageBackend, open_storage
 
 class SystemChecker:
     """系统检查器 - 验证DND跑团库完整性"""
     
-    def __init__(self, data_path: str = "."):
-        """初始化检查器"""
+    def __init__(self, data_path: str = ".", storage: Optional[StorageBackend] = None):
+        """初始化检查器(storage不指定时按数据目录自动选择存储后端)"""
         self.data_path = data_path
+        self.storage = storage or open_storage(data_path)
         self.required_files = [
             "characters/player_character.json",
             "combat/combat_history.json",
@@ -146,13 +147,10 @@ class SystemChecker:
         """验证数据文件完整性"""
         results = {}
         
-        # 检查角色数据
-        character_file = os.path.join(self.data_path, "characters/player_character.json")
-        if os.path.exists(character_file):
-            try:
-                with open(character_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
+        # 检查角色数据(通过共享文档缓存读取)
+        try:
+            data = self.storage.load("player_character")
+            if data is not None:
                 required_fields = ["character_info", "ability_scores", "combat_stats", "equipment"]
                 validation = {}
                 
@@ -164,44 +162,41 @@ class SystemChecker:
                     "required_fields": validation,
                     "status": "✅" if all(validation.values()) else "⚠️"
                 }
-                
-            except Exception as e:
+            else:
                 results["player_character"] = {
                     "valid_json": False,
-                    "error": str(e),
+                    "error": "文件不存在",
                     "status": "❌"
                 }
-        else:
+                
+        except Exception as e:
             results["player_character"] = {
                 "valid_json": False,
-                "error": "文件不存在",
+                "error": str(e),
                 "status": "❌"
             }
         
         # 检查战斗历史
-        combat_file = os.path.join(self.data_path, "combat/combat_history.json")
-        if os.path.exists(combat_file):
-            try:
-                with open(combat_file, 'r', encoding='utf-8') as f:
-                    data = json.load(f)
-                
+        try:
+            data = self.storage.load("combat_history")
+            if data is not None:
                 results["combat_history"] = {
                     "valid_json": True,
                     "has_sessions": "combat_sessions" in data,
                     "has_statistics": "statistics" in data,
                     "status": "✅"
                 }
-                
-            except Exception as e:
+            else:
                 results["combat_history"] = {
                     "valid_json": False,
-                    "error": str(e),
+                    "error": "文件不存在",
                     "status": "❌"
                 }
-        else:
+                
+        except Exception as e:
             results["combat_history"] = {
                 "valid_json": False,
-                "error": "文件不存在",
+                "error": str(e),
                 "status": "❌"
             }
         